@@ -0,0 +1,82 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+
+import os
+import sys
+import getopt
+from helpers.io_handler import IOHandler, Color
+from helpers.file_handler import FileHandler
+from helpers.timer import Timer
+from helpers.errors import DeltaPatchMismatchException
+from data_mapping.common import Mapping
+from data_mapping.delta_patch import DeltaPatch
+
+
+def read_main_arguments(argv):
+    """
+    Commands:
+        -i --ifolder <artifact_folder>
+        -p --patch <patch_file>
+        -o --ofolder <output_folder>
+
+    Apply a delta patch created by create_mappings.py -p to the artifacts of the run it was created from.
+    Without an output folder the artifacts are updated in place.
+
+    Examples:
+        python apply_delta.py -i 'output' -p 'output_new/ue_delta_patch.json'
+        python apply_delta.py -i 'output' -p 'output_new/ue_delta_patch.json' -o 'output_patched'
+    """
+    input_folder = None
+    patch_file = None
+    output_folder = None
+    usage_string = "python apply_delta.py -i <artifact_folder> -p <patch_file> [-o <output_folder>]"
+    try:
+        opts, args = getopt.getopt(
+            args=argv,
+            shortopts="hi:p:o:",
+            longopts=["help", "ifolder=", "patch=", "ofolder="]
+        )
+    except getopt.GetoptError as err:
+        IOHandler.show_error(f"Error: {err}")
+        IOHandler.show_error(f"Correct usage: {usage_string}")
+        sys.exit()
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            IOHandler.print_color(usage_string, enforce=True, color=Color.GREEN)
+            sys.exit()
+        elif opt in ("-i", "--ifolder"):
+            input_folder = arg
+        elif opt in ("-p", "--patch"):
+            patch_file = arg
+        elif opt in ("-o", "--ofolder"):
+            output_folder = arg
+
+    if not input_folder or not os.path.isdir(input_folder):
+        IOHandler.show_error("ERROR: Please provide an existing artifact folder!")
+        sys.exit()
+    if not patch_file or not os.path.isfile(patch_file):
+        IOHandler.show_error("ERROR: Please provide an existing patch file!")
+        sys.exit()
+    return input_folder, patch_file, output_folder or input_folder
+
+
+def main(argv):
+    program_timer = Timer()
+    input_folder, patch_file, output_folder = read_main_arguments(argv)
+    settings = FileHandler.read_config_file()
+    patch = Mapping.import_dict_from_json(patch_file)
+    print(f"Apply delta patch: {patch['summary']}")
+    artifacts = DeltaPatch.read_artifacts(input_folder, settings)
+    try:
+        artifacts = DeltaPatch.apply(patch, artifacts)
+    except DeltaPatchMismatchException as err:
+        IOHandler.show_error(f"ERROR: {err}")
+        sys.exit()
+    DeltaPatch.write_artifacts(artifacts, output_folder, settings,
+                               compression=Mapping.verified_compression(settings.get('export', {}).get('compression')))
+    print(f"Overall time: {program_timer.get_seconds():.2f} seconds")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,2 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
@@ -0,0 +1,94 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+#
+#  Usage:
+#  python -m benchmarks.clustering [-n <sizes>] [-m <methods>] [-o <output_file>]
+
+import sys
+import json
+import getopt
+import tracemalloc
+from benchmarks.synthetic import SyntheticData
+from data_mapping.clustering import Clustering, CLUSTERING_METHODS
+from helpers.file_handler import FileHandler
+from helpers.timer import Timer
+
+DEFAULT_SIZES = [1000, 5000]
+DEFAULT_METHODS = ['spectral', 'spectral_embedding', 'minibatch_kmeans', 'bisecting_kmeans']
+
+
+def read_main_arguments(argv):
+    opts, args = getopt.getopt(
+        args=argv,
+        shortopts="hn:m:o:",
+        longopts=["help", "sizes=", "methods=", "ofile="]
+    )
+    sizes = DEFAULT_SIZES
+    methods = DEFAULT_METHODS
+    output_file = None
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print('python -m benchmarks.clustering [-n <size,size,...>] [-m <method,method,...>] [-o <output file>]')
+            sys.exit()
+        elif opt in ("-n", "--sizes"):
+            sizes = [int(n) for n in arg.split(",")]
+        elif opt in ("-m", "--methods"):
+            methods = arg.split(",")
+        elif opt in ("-o", "--ofile"):
+            output_file = arg
+    return sizes, methods, output_file
+
+
+def leaf_size_balance(cluster_df, cluster_columns):
+    # Leaf sizes over all non-empty leaves and their spread
+    leaf_sizes = cluster_df.groupby(cluster_columns).size().to_numpy()
+    return {
+        'leaves': int(leaf_sizes.shape[0]),
+        'min': int(leaf_sizes.min()),
+        'max': int(leaf_sizes.max()),
+        'mean': float(leaf_sizes.mean()),
+        'cv': float(leaf_sizes.std() / leaf_sizes.mean()),
+        'singletons': int((leaf_sizes == 1).sum()),
+    }
+
+
+def main(argv):
+    sizes, methods, output_file = read_main_arguments(argv)
+    settings = FileHandler.read_config_file()
+    branching_factors = settings['clustering']['branching_factors']
+    cluster_columns = [f"b_{i}" for i in range(len(branching_factors))]
+    results = []
+    for n_songs in sizes:
+        model_collection = {'synthetic': SyntheticData.coordinates(n_songs)}
+        for method in methods:
+            if method not in CLUSTERING_METHODS:
+                print(f"Skipping unknown method {method}")
+                continue
+            tracemalloc.start()
+            timer = Timer()
+            cluster_collection = Clustering.hierarchical_clustering(
+                model_collection=model_collection,
+                branching_factors=branching_factors,
+                method=method,
+                options=settings['clustering']
+            )
+            seconds = timer.get_seconds()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+            balance = leaf_size_balance(cluster_collection['synthetic'], cluster_columns)
+            results.append({'method': method, 'songs': n_songs, 'seconds': seconds, 'peak_mb': peak_mb,
+                            'balance': balance})
+
+    print(f"{'method':<20} {'songs':>8} {'seconds':>10} {'peak MB':>9} {'leaves':>7} {'min':>6} {'max':>6} {'cv':>6}")
+    for r in results:
+        b = r['balance']
+        print(f"{r['method']:<20} {r['songs']:>8} {r['seconds']:>10.2f} {r['peak_mb']:>9.1f} {b['leaves']:>7} "
+              f"{b['min']:>6} {b['max']:>6} {b['cv']:>6.2f}")
+    if output_file:
+        FileHandler.create_folders_if_not_exists(output_file)
+        with open(output_file, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
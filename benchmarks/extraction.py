@@ -0,0 +1,198 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+#
+#  Usage:
+#  python -m benchmarks.extraction [-n <songs>] [-l <seconds>] [-f <formats>] [-t <taggers>] [-w <work_folder>]
+#  [-o <output_file>]
+
+import os
+import sys
+import json
+import wave
+import getopt
+import shutil
+import tempfile
+import subprocess
+from benchmarks.synthetic import SyntheticData
+from benchmarks.local_db_agent import LocalDBAgent
+from essentia_handlers.tagger import Tagger
+from models.models import Model
+from helpers.file_handler import FileHandler
+from helpers.lazy_import import LazyImport
+from helpers.tracing import Tracer
+from helpers.timer import Timer
+
+psutil = LazyImport("psutil")
+
+DEFAULT_SONGS = 5
+DEFAULT_SECONDS = 60
+DEFAULT_FORMATS = ['wav']
+DEFAULT_TAGGERS = ['performance', 'pooling_demo', 'new_process']
+SAMPLE_RATE = 44100
+
+
+def read_main_arguments(argv):
+    opts, args = getopt.getopt(
+        args=argv,
+        shortopts="hn:l:f:t:w:o:",
+        longopts=["help", "songs=", "length=", "formats=", "taggers=", "wfolder=", "ofile="]
+    )
+    n_songs = DEFAULT_SONGS
+    seconds = DEFAULT_SECONDS
+    formats = DEFAULT_FORMATS
+    taggers = DEFAULT_TAGGERS
+    work_folder = None
+    output_file = None
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print('python -m benchmarks.extraction [-n <songs>] [-l <seconds per song>] [-f <wav,mp4>] '
+                  '[-t <tagger,tagger,...>] [-w <work folder>] [-o <output file>]')
+            sys.exit()
+        elif opt in ("-n", "--songs"):
+            n_songs = int(arg)
+        elif opt in ("-l", "--length"):
+            seconds = int(arg)
+        elif opt in ("-f", "--formats"):
+            formats = arg.split(",")
+        elif opt in ("-t", "--taggers"):
+            taggers = arg.split(",")
+        elif opt in ("-w", "--wfolder"):
+            work_folder = arg
+        elif opt in ("-o", "--ofile"):
+            output_file = arg
+    return n_songs, seconds, formats, taggers, work_folder, output_file
+
+
+def create_fixtures(media_folder, n_songs, seconds, media_format):
+    """
+    Write synthetic recordings to the media folder, existing fixtures of the same length are reused
+    :return: list of (media id, relative media path, file size) tuples
+    """
+    fixtures = []
+    for i, media_id in enumerate(SyntheticData.media_ids(n_songs)):
+        rel_media_path = f"{media_format}/{seconds}s/{media_id}.{media_format}"
+        abs_media_path = os.path.join(media_folder, rel_media_path)
+        if not os.path.exists(abs_media_path):
+            FileHandler.create_folders_if_not_exists(abs_media_path)
+            wav_path = abs_media_path if media_format == "wav" else abs_media_path + ".wav"
+            with wave.open(wav_path, 'wb') as f:
+                f.setnchannels(2)
+                f.setsampwidth(2)
+                f.setframerate(SAMPLE_RATE)
+                for chunk in SyntheticData.audio(seconds, SAMPLE_RATE, seed=i):
+                    f.writeframes(chunk.tobytes())
+            if media_format == "mp4":
+                # Small video track like the archive videos, AAC audio
+                subprocess.run(
+                    ["ffmpeg", "-loglevel", "error", "-y", "-f", "lavfi", "-i", "color=c=black:s=320x180:r=25",
+                     "-i", wav_path, "-shortest", "-c:v", "libx264", "-c:a", "aac", "-b:a", "192k", abs_media_path],
+                    check=True
+                )
+                os.remove(wav_path)
+        fixtures.append((media_id, rel_media_path, os.path.getsize(abs_media_path)))
+    return fixtures
+
+
+def run_tagger(tagger_type, fixtures, media_folder, output_folder, seconds, trace_file):
+    """
+    Extract the features of all fixtures with a fresh feature table
+    :return: dictionary with the results of the run
+    """
+    db_agent = LocalDBAgent()
+    db_agent.open_connection()
+    for media_id, rel_media_path, filesize in fixtures:
+        db_agent.add_media_entry(SyntheticData.media_entry(media_id, rel_media_path, seconds, SAMPLE_RATE, filesize))
+    tagger = Tagger.get_instance(tagger_type)
+    # Resident memory is sampled whenever a span is closed, i.e. after every decode, inference and pooling step.
+    # Memory is rarely returned to the OS, so the baseline includes what earlier taggers of the benchmark left behind.
+    process = psutil.Process()
+    baseline_rss = process.memory_info().rss
+    peak = {'rss': baseline_rss}
+
+    def sample_rss(span):
+        peak['rss'] = max(peak['rss'], process.memory_info().rss)
+
+    Tracer.add_listener(sample_rss)
+    Tracer.enable(trace_file)
+    song_seconds = []
+    timer = Timer()
+    try:
+        for counter, (media_id, rel_media_path, _) in enumerate(fixtures, start=1):
+            song_timer = Timer()
+            song_span = Tracer.start_span("song", media_id=media_id, media_path=rel_media_path)
+            tagger.init(
+                media_file_path=os.path.join(media_folder, rel_media_path),
+                media_data=db_agent.fetch_entry_for_media_path(rel_media_path),
+                output_folder=os.path.join(output_folder, tagger_type),
+                db_agent=db_agent
+            )
+            tagger.process_song(counter=counter, total=len(fixtures))
+            Tracer.end_span(song_span, audio_seconds=tagger.get_media_duration_secs())
+            song_seconds.append(song_timer.get_seconds())
+    finally:
+        Tracer.remove_listener(sample_rss)
+    total_seconds = timer.get_seconds()
+    Tracer.export()
+    db_agent.close_connection()
+    audio_seconds = len(fixtures) * seconds
+    # The first song includes the warm-up of TensorFlow and is reported separately
+    steady_seconds = sum(song_seconds[1:])
+    return {
+        'songs': len(fixtures),
+        'audio_seconds': audio_seconds,
+        'seconds': total_seconds,
+        'songs_per_second': len(fixtures) / total_seconds,
+        'real_time_factor': total_seconds / audio_seconds,
+        'first_song_seconds': song_seconds[0],
+        'steady_real_time_factor': steady_seconds / (audio_seconds - seconds) if len(fixtures) > 1 else None,
+        'baseline_rss_mb': baseline_rss / 2 ** 20,
+        'peak_rss_mb': peak['rss'] / 2 ** 20,
+        'peak_rss_increase_mb': (peak['rss'] - baseline_rss) / 2 ** 20,
+        'stages': Tracer.summary(),
+    }
+
+
+def main(argv):
+    n_songs, seconds, formats, taggers, work_folder, output_file = read_main_arguments(argv)
+    if work_folder is None:
+        work_folder = tempfile.mkdtemp(prefix="mjf-extraction-benchmark-")
+    media_folder = os.path.join(work_folder, "media")
+    output_folder = os.path.join(work_folder, "output")
+
+    model_timer = Timer()
+    Model.init()
+    model_seconds = model_timer.get_seconds()
+
+    results = []
+    for media_format in formats:
+        if media_format == "mp4" and shutil.which("ffmpeg") is None:
+            print("Skipping mp4 fixtures, ffmpeg not found")
+            continue
+        fixtures = create_fixtures(media_folder, n_songs, seconds, media_format)
+        for tagger_type in taggers:
+            if tagger_type not in DEFAULT_TAGGERS:
+                print(f"Skipping unknown tagger {tagger_type}")
+                continue
+            trace_file = os.path.join(work_folder, f"trace-{tagger_type}-{media_format}.json")
+            result = run_tagger(tagger_type, fixtures, media_folder, output_folder, seconds, trace_file)
+            results.append({'tagger': tagger_type, 'format': media_format, 'song_seconds': seconds,
+                            'model_load_seconds': model_seconds, **result})
+
+    print(f"{'tagger':<14} {'format':>6} {'songs':>6} {'seconds':>9} {'songs/s':>8} {'RTF':>7} {'base MB':>9} "
+          f"{'peak MB':>9} {'+MB':>7}")
+    for r in results:
+        print(f"{r['tagger']:<14} {r['format']:>6} {r['songs']:>6} {r['seconds']:>9.2f} "
+              f"{r['songs_per_second']:>8.3f} {r['real_time_factor']:>7.3f} {r['baseline_rss_mb']:>9.1f} "
+              f"{r['peak_rss_mb']:>9.1f} {r['peak_rss_increase_mb']:>7.1f}")
+        for name, values in sorted(r['stages'].items(), key=lambda item: -item[1]['total']):
+            share = 100 * values['total'] / r['seconds']
+            print(f"    {name:<50} {values['count']:>6} {values['total']:>9.2f} {share:>6.1f}%")
+    print(f"Fixtures, outputs and traces in {work_folder}")
+    if output_file:
+        FileHandler.create_folders_if_not_exists(output_file)
+        with open(output_file, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,90 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+
+import json
+import sqlite3
+from helpers.tracing import Tracer
+
+
+class LocalDBAgent:
+    """
+    Stand-in for DBAgent with the media and feature tables in an SQLite database, so the taggers can be run against
+    synthetic recordings without the PostgreSQL server. Only the queries used by the taggers are implemented.
+    """
+
+    def __init__(self, db_file=":memory:"):
+        self.db_file = db_file
+        self.connection = None
+
+    def open_connection(self):
+        self.connection = sqlite3.connect(self.db_file)
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS media ("
+            "media_id TEXT PRIMARY KEY, media_path TEXT UNIQUE, metadata TEXT, media_info TEXT);"
+            "CREATE TABLE IF NOT EXISTS feature ("
+            "media_id TEXT, model_name TEXT, feature_type TEXT, version TEXT, model_params TEXT, data TEXT, "
+            "fingerprint TEXT, PRIMARY KEY (media_id, model_name));"
+        )
+
+    def close_connection(self):
+        self.connection.close()
+
+    # *************************
+    # Media table
+    # **************************
+    def add_media_entry(self, media_entry):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?)",
+            (media_entry['media_id'], media_entry['media_path'], json.dumps(media_entry['metadata']),
+             json.dumps(media_entry['media_info']))
+        )
+        self.connection.commit()
+
+    def fetch_entry_for_media_path(self, rel_media_path):
+        row = self.connection.execute(
+            "SELECT media_id, media_path, metadata, media_info FROM media WHERE media_path = ?", (rel_media_path,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'media_id': row[0], 'media_path': row[1], 'metadata': json.loads(row[2]),
+                'media_info': json.loads(row[3])}
+
+    def count_entries_in_table_media(self):
+        return self.connection.execute("SELECT COUNT(*) FROM media").fetchone()[0]
+
+    # *************************
+    # Feature table
+    # **************************
+    def fetch_feature_entries_for_media(self, media_id):
+        rows = self.connection.execute(
+            "SELECT media_id, model_name, feature_type, version, model_params, data, fingerprint FROM feature "
+            "WHERE media_id = ?", (media_id,)
+        ).fetchall()
+        return [{
+            'media_id': row[0],
+            'model_name': row[1],
+            'feature_type': row[2],
+            'version': row[3],
+            'model_params': json.loads(row[4]),
+            'data': json.loads(row[5]),
+            'fingerprint': json.loads(row[6]) if row[6] is not None else None,
+        } for row in rows]
+
+    def check_if_model_feature_exists_for(self, model_name, media_id):
+        return self.connection.execute(
+            "SELECT 1 FROM feature WHERE model_name = ? AND media_id = ?", (model_name, media_id)
+        ).fetchone() is not None
+
+    def add_feature_entry(self, feature):
+        with Tracer.span("db_write", media_id=feature.get('media_id'), model=feature.get('model_name')):
+            self.connection.execute(
+                "INSERT OR REPLACE INTO feature VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (feature['media_id'], feature['model_name'], feature['feature_type'], str(feature['version']),
+                 json.dumps(feature['model_params']), json.dumps(feature['data']),
+                 json.dumps(feature['fingerprint']) if feature.get('fingerprint') is not None else None)
+            )
+            self.connection.commit()
+        return True
+
+    def update_feature_entry_for(self, feature, model_name, media_id):
+        return self.add_feature_entry({**feature, 'model_name': model_name, 'media_id': media_id})
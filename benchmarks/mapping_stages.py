@@ -0,0 +1,267 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+#
+#  Usage:
+#  python -m benchmarks.mapping_stages [-n <sizes>] [-s <stages>] [-b <baseline_file>] [-r <threshold>]
+#  [-o <output_file>]
+
+import sys
+import glob
+import json
+import pickle
+import getopt
+import tracemalloc
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import SyntheticData
+from data_mapping.cleaner import Cleaner
+from data_mapping.dimensionality_reduction import DimRed
+from data_mapping.clustering import Clustering
+from data_mapping.combiner import Combiner
+from data_mapping.preprocessor import Preprocessor
+from data_mapping.membership_index import MembershipIndex
+from helpers.converter import Converter
+from helpers.file_handler import FileHandler
+from helpers.timer import Timer
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+STAGES = ['clean', 'dr', 'cluster', 'branching', 'metadata', 'preprocess']
+# t-SNE and the spectral clustering take minutes per model already at a few thousand songs, they are only measured on
+# request. Their input is provided by cheap stand-ins otherwise.
+DEFAULT_STAGES = ['clean', 'branching', 'metadata', 'preprocess']
+DEFAULT_THRESHOLD = 0.2
+# Differences below these values are treated as noise when comparing against the baseline
+MIN_REGRESSION_SECONDS = 0.1
+MIN_REGRESSION_MB = 1.0
+# Hierarchy builder for the cluster input of later stages if the cluster stage itself is not measured
+STAND_IN_CLUSTERING_METHOD = 'minibatch_kmeans'
+# Sizes beyond which t-SNE and the spectral clustering do not finish in reasonable time
+SLOW_STAGE_MAX_SONGS = 2000
+
+
+def read_main_arguments(argv):
+    opts, args = getopt.getopt(
+        args=argv,
+        shortopts="hn:s:b:r:o:",
+        longopts=["help", "sizes=", "stages=", "baseline=", "threshold=", "ofile="]
+    )
+    sizes = DEFAULT_SIZES
+    stages = DEFAULT_STAGES
+    baseline_file = None
+    threshold = DEFAULT_THRESHOLD
+    output_file = None
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print('python -m benchmarks.mapping_stages [-n <size,size,...>] [-s <stage,stage,...>] '
+                  '[-b <baseline file>] [-r <threshold>] [-o <output file>]')
+            sys.exit()
+        elif opt in ("-n", "--sizes"):
+            sizes = [int(n) for n in arg.split(",")]
+        elif opt in ("-s", "--stages"):
+            stages = arg.split(",")
+            unknown = [stage for stage in stages if stage not in STAGES]
+            if unknown:
+                print(f"ERROR: Unknown stages {', '.join(unknown)}, possible values: {', '.join(STAGES)}")
+                sys.exit(1)
+        elif opt in ("-b", "--baseline"):
+            baseline_file = arg
+        elif opt in ("-r", "--threshold"):
+            threshold = float(arg)
+        elif opt in ("-o", "--ofile"):
+            output_file = arg
+    return sizes, stages, baseline_file, threshold, output_file
+
+
+def read_class_lists(model_names):
+    # Class lists of the models as stored in the feature table, e.g. mtg_jamendo_genre
+    class_lists = {}
+    for metadata_file in sorted(glob.glob("models/model_data/*.json")):
+        with open(metadata_file, 'r') as f:
+            metadata = json.load(f)
+        if metadata['name'] in model_names:
+            class_lists[metadata['name']] = metadata['classes']
+    return class_lists
+
+
+def metadata_stage(metadata_df, leaf_clusters, settings):
+    # In-memory part of the metadata stage, without the database query and the file exports
+    Converter.datetime_to_localized_timestring.cache_clear()
+    Combiner.make_concert_dates_human_readable(metadata_df, settings['metadata'].get('languages', ['en']))
+    containing_clusters, metadata_df = Preprocessor.add_containing_clusters(metadata_df, leaf_clusters)
+    if settings['metadata'].get('export_mode', 'expanded') in ('interned', 'both'):
+        Preprocessor.intern_metadata(metadata_df)
+    return containing_clusters
+
+
+def preprocess_stage(containing_clusters, groups, settings):
+    # In-memory part of the preprocess stage, without the file exports
+    Preprocessor.calculate_cluster_relations(containing_clusters)
+    top_k = settings['preprocessor'].get('sparse_relations', {}).get('top_k', 0)
+    if top_k > 0:
+        Preprocessor.calculate_top_cluster_relations(containing_clusters, top_k)
+    if settings['preprocessor'].get('membership_index', {}).get('enabled', False):
+        MembershipIndex.from_containing_clusters(containing_clusters, groups)
+
+
+def run_stages(n_songs, stages, settings, class_lists):
+    """
+    Run all stages on synthetic data of n_songs songs, the stages in stages are measured one by one and per model.
+    Inputs of a measured stage are the outputs of the previous stages, or cheap stand-ins if those are not measured.
+    :return: list of records with stage, model, songs, seconds and peak_mb
+    """
+    records = []
+
+    def measure(stage, model, function, *args, **kwargs):
+        if stage not in stages:
+            return function(*args, **kwargs)
+        # tracemalloc slows down allocations, the time and the peak memory are measured in separate passes. Stages
+        # may change their input, so the memory pass runs on a copy taken before the first pass. Unlike deepcopy,
+        # pickling also copies the objects in the object columns of dataframes, e.g. the metadata dictionaries.
+        memory_args, memory_kwargs = pickle.loads(pickle.dumps((args, kwargs)))
+        timer = Timer()
+        result = function(*args, **kwargs)
+        seconds = timer.get_seconds()
+        tracemalloc.start()
+        function(*memory_args, **memory_kwargs)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+        del memory_args, memory_kwargs
+        records.append({'stage': stage, 'model': model, 'songs': n_songs, 'seconds': seconds, 'peak_mb': peak_mb})
+        return result
+
+    branching_factors = settings['clustering']['branching_factors']
+    leaf_clusters = {}
+    groups = []
+    for seed, (model_name, classes) in enumerate(class_lists.items()):
+        probabilities = SyntheticData.class_probabilities(n_songs, len(classes), seed=seed)
+        # clean
+        if 'clean' in stages:
+            feature_df = SyntheticData.feature_rows(model_name, classes, probabilities)
+            vector_df = measure('clean', model_name, Cleaner.split_by_model, feature_df, data_is_json=True)[model_name]
+            del feature_df
+        else:
+            vector_df = pd.concat([pd.DataFrame({'media_id': SyntheticData.media_ids(n_songs)}),
+                                   pd.DataFrame(probabilities, columns=classes)], axis=1)
+        # dr
+        if 'dr' in stages:
+            coordinates_df = measure('dr', model_name, DimRed.perform_tsne, {model_name: vector_df},
+                                     perplexity=settings['dr']['perplexity'],
+                                     iterations=settings['dr']['iterations'])[model_name]
+        else:
+            coordinates_df = SyntheticData.coordinates(n_songs, seed=seed)
+        # cluster
+        cluster_df = measure('cluster', model_name, Clustering.hierarchical_clustering, {model_name: coordinates_df},
+                             branching_factors=branching_factors,
+                             method=(settings['clustering'].get('method', 'spectral') if 'cluster' in stages
+                                     else STAND_IN_CLUSTERING_METHOD),
+                             options=settings['clustering'])[model_name]
+        # branching, leaf ids are consecutive over all models like in a run over all models
+        _, model_leaf_clusters = measure('branching', model_name, Combiner.process_all_models,
+                                         cluster_dataframes={model_name: cluster_df},
+                                         vector_dataframes={model_name: vector_df},
+                                         model_full_names=settings['models'],
+                                         tree_structure_yaml="tree_structure.yaml",
+                                         geometry_precision=settings.get('export', {}).get('geometry_precision'))
+        leaf_offset = len(leaf_clusters)
+        groups.append([leaf_offset, leaf_offset + len(model_leaf_clusters) - 1])
+        leaf_clusters.update({leaf_offset + leaf_id: songs for leaf_id, songs in model_leaf_clusters.items()})
+    leaf_clusters = measure('branching', 'all', Preprocessor.append_stats_to_leaf_clusters, leaf_clusters)
+    # metadata and preprocess cover all models at once
+    containing_clusters = measure('metadata', 'all', metadata_stage,
+                                  SyntheticData.metadata(n_songs), leaf_clusters, settings)
+    measure('preprocess', 'all', preprocess_stage, containing_clusters, groups, settings)
+    return records
+
+
+def stage_totals(records):
+    # Sum of the time and maximum of the peak memory over the models of every stage and size
+    totals = {}
+    for r in records:
+        total = totals.setdefault((r['stage'], r['songs']), {'seconds': 0.0, 'peak_mb': 0.0})
+        total['seconds'] += r['seconds']
+        total['peak_mb'] = max(total['peak_mb'], r['peak_mb'])
+    return totals
+
+
+def scaling_exponents(records):
+    # Slope of log(seconds) and log(peak memory) over log(songs) per stage and model, i.e. seconds ~ songs^exponent
+    series = {}
+    for r in records:
+        series.setdefault((r['stage'], r['model']), []).append(r)
+    for (stage, songs), total in stage_totals(records).items():
+        series.setdefault((stage, 'total'), []).append({'songs': songs, **total})
+    exponents = []
+    for (stage, model), values in series.items():
+        if len({v['songs'] for v in values}) < 2:
+            continue
+        songs = np.log([v['songs'] for v in values])
+        exponents.append({
+            'stage': stage,
+            'model': model,
+            'time_exponent': float(np.polyfit(songs, np.log([max(v['seconds'], 1e-6) for v in values]), 1)[0]),
+            'memory_exponent': float(np.polyfit(songs, np.log([max(v['peak_mb'], 1e-6) for v in values]), 1)[0]),
+        })
+    return exponents
+
+
+def regressions(records, baseline_records, threshold):
+    # Stages whose time or peak memory exceeds the baseline of the same size by more than threshold
+    found = []
+    baseline_totals = stage_totals(baseline_records)
+    for key, total in stage_totals(records).items():
+        if key not in baseline_totals:
+            continue
+        for metric, minimum in (('seconds', MIN_REGRESSION_SECONDS), ('peak_mb', MIN_REGRESSION_MB)):
+            value, baseline_value = total[metric], baseline_totals[key][metric]
+            if value > baseline_value * (1 + threshold) and value - baseline_value > minimum:
+                found.append({'stage': key[0], 'songs': key[1], 'metric': metric, 'value': value,
+                              'baseline': baseline_value})
+    return found
+
+
+def main(argv):
+    sizes, stages, baseline_file, threshold, output_file = read_main_arguments(argv)
+    settings = FileHandler.read_config_file()
+    class_lists = read_class_lists(settings['models'])
+    if 'dr' in stages and min(sizes) <= 3 * settings['dr']['perplexity']:
+        print(f"ERROR: t-SNE with perplexity {settings['dr']['perplexity']} needs more than "
+              f"{3 * settings['dr']['perplexity']} songs, remove dr from the stages or use larger sizes")
+        sys.exit(1)
+    slow_stages = [stage for stage in ('dr', 'cluster') if stage in stages and
+                   (stage == 'dr' or settings['clustering'].get('method', 'spectral') == 'spectral')]
+    if slow_stages and max(sizes) > SLOW_STAGE_MAX_SONGS:
+        print(f"WARNING: {', '.join(slow_stages)} may not finish with more than {SLOW_STAGE_MAX_SONGS} songs, "
+              f"measure them with smaller sizes, e.g. -n 1000,2000")
+    # Load the locale data of Babel once, otherwise it is attributed to the metadata stage of the first size
+    Converter.datetime_to_localized_timestrings("2000-01-01", settings['metadata'].get('languages', ['en']))
+    records = []
+    for n_songs in sizes:
+        records += run_stages(n_songs, stages, settings, class_lists)
+    exponents = scaling_exponents(records)
+
+    print(f"{'stage':<12} {'model':<24} {'songs':>8} {'seconds':>10} {'peak MB':>9}")
+    for r in sorted(records, key=lambda r: (STAGES.index(r['stage']), r['model'], r['songs'])):
+        print(f"{r['stage']:<12} {r['model']:<24} {r['songs']:>8} {r['seconds']:>10.3f} {r['peak_mb']:>9.1f}")
+    if exponents:
+        print(f"\n{'stage':<12} {'model':<24} {'time exp':>9} {'memory exp':>11}")
+        for e in exponents:
+            print(f"{e['stage']:<12} {e['model']:<24} {e['time_exponent']:>9.2f} {e['memory_exponent']:>11.2f}")
+    results = {'sizes': sizes, 'stages': stages, 'records': records, 'scaling': exponents}
+    if output_file:
+        FileHandler.create_folders_if_not_exists(output_file)
+        with open(output_file, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if baseline_file:
+        with open(baseline_file, 'r') as file:
+            found = regressions(records, json.load(file)['records'], threshold)
+        for r in found:
+            print(f"REGRESSION: {r['stage']} with {r['songs']} songs, {r['metric']} {r['value']:.3f} "
+                  f"vs. {r['baseline']:.3f} in baseline")
+        if found:
+            sys.exit(1)
+        print(f"No stage regressed by more than {100 * threshold:.0f}% against {baseline_file}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
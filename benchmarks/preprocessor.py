@@ -0,0 +1,82 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+#
+#  Usage:
+#  python -m benchmarks.preprocessor [-n <sizes>] [-o <output_file>]
+
+import sys
+import json
+import getopt
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import SyntheticData
+from data_mapping.preprocessor import Preprocessor
+from helpers.file_handler import FileHandler
+from helpers.timer import Timer
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+
+def read_main_arguments(argv):
+    opts, args = getopt.getopt(
+        args=argv,
+        shortopts="hn:o:",
+        longopts=["help", "sizes=", "ofile="]
+    )
+    sizes = DEFAULT_SIZES
+    output_file = None
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print('python -m benchmarks.preprocessor [-n <size,size,...>] [-o <output file>]')
+            sys.exit()
+        elif opt in ("-n", "--sizes"):
+            sizes = [int(n) for n in arg.split(",")]
+        elif opt in ("-o", "--ofile"):
+            output_file = arg
+    return sizes, output_file
+
+
+def reference_cluster_relations(containing_clusters):
+    # Loop based implementation the vectorized version has to reproduce exactly
+    clusters_per_song = np.array(list(containing_clusters.values()))
+    n_clusters = clusters_per_song.max() - clusters_per_song.min() + 1
+    n_relations = clusters_per_song.shape[1]
+    relation_matrix = np.zeros((n_clusters, n_clusters), dtype=float)
+    for song_clusters in clusters_per_song:
+        for i in range(n_relations):
+            for j in range(n_relations):
+                relation_matrix[song_clusters[i], song_clusters[j]] += 1
+    relation_matrix = np.array([row / max(row) for row in relation_matrix])
+    return pd.DataFrame(relation_matrix)
+
+
+def main(argv):
+    sizes, output_file = read_main_arguments(argv)
+    results = []
+    for n_songs in sizes:
+        containing_clusters = SyntheticData.containing_clusters(n_songs)
+        timer = Timer()
+        reference_df = reference_cluster_relations(containing_clusters)
+        reference_seconds = timer.get_seconds()
+        timer.reset()
+        relation_df = Preprocessor.calculate_cluster_relations(containing_clusters)
+        seconds = timer.get_seconds()
+        results.append({
+            'songs': n_songs,
+            'reference_seconds': reference_seconds,
+            'seconds': seconds,
+            'equal': bool(reference_df.equals(relation_df)),
+        })
+
+    print(f"{'songs':>8} {'loop [s]':>10} {'sparse [s]':>11} {'speedup':>8} {'equal':>6}")
+    for r in results:
+        print(f"{r['songs']:>8} {r['reference_seconds']:>10.3f} {r['seconds']:>11.4f} "
+              f"{r['reference_seconds'] / r['seconds']:>8.1f} {str(r['equal']):>6}")
+    if output_file:
+        FileHandler.create_folders_if_not_exists(output_file)
+        with open(output_file, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,116 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+#
+#  Usage:
+#  python -m benchmarks.scene_pack -i <mapping_folder> [-r <repeats>] [-o <output_file>]
+
+import os
+import sys
+import json
+import getopt
+import numpy as np
+import pandas as pd
+from data_mapping.common import Mapping
+from data_mapping.scene_pack import ScenePack
+from helpers.file_handler import FileHandler
+from helpers.timer import Timer
+
+DEFAULT_REPEATS = 5
+
+
+def read_main_arguments(argv):
+    opts, args = getopt.getopt(
+        args=argv,
+        shortopts="hi:r:o:",
+        longopts=["help", "ifolder=", "repeats=", "ofile="]
+    )
+    input_folder = None
+    repeats = DEFAULT_REPEATS
+    output_file = None
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print('python -m benchmarks.scene_pack -i <mapping folder> [-r <repeats>] [-o <output file>]')
+            sys.exit()
+        elif opt in ("-i", "--ifolder"):
+            input_folder = arg
+        elif opt in ("-r", "--repeats"):
+            repeats = int(arg)
+        elif opt in ("-o", "--ofile"):
+            output_file = arg
+    if input_folder is None:
+        print("Please provide the output folder of a mapping run with -i")
+        sys.exit()
+    return input_folder, repeats, output_file
+
+
+def json_files(input_folder, settings):
+    # Files the client parses at startup
+    files = {
+        'branches': settings['branching_filenames']['branches_filename'],
+        'leaves': settings['branching_filenames']['leaves_filename'],
+        'metadata': settings['metadata']['metadata_filename'],
+        'containing_clusters': settings['preprocessor']['containing_clusters_filename'],
+    }
+    return {name: os.path.join(input_folder, file) for name, file in files.items()
+            if os.path.exists(os.path.join(input_folder, file))}
+
+
+def load_json_set(files, relations_file):
+    collections = {name: Mapping.import_dict_from_json(file) for name, file in files.items()}
+    collections['relations'] = pd.read_csv(relations_file, header=None).to_numpy()
+    # Touch the geometry of every song like a client building its vertex buffer
+    n_songs = sum(len(leaf['songs']) for leaf in collections['leaves'].values())
+    return collections, n_songs
+
+
+def load_scene_pack(pack_file, memory_map):
+    scene_pack = ScenePack.load(pack_file, memory_map=memory_map)
+    return scene_pack, float(np.asarray(scene_pack.sections['song_geometry']).sum())
+
+
+def best_of(repeats, function, *args):
+    seconds = []
+    for _ in range(repeats):
+        timer = Timer()
+        function(*args)
+        seconds.append(timer.get_seconds())
+    return min(seconds)
+
+
+def main(argv):
+    input_folder, repeats, output_file = read_main_arguments(argv)
+    settings = FileHandler.read_config_file()
+    files = json_files(input_folder, settings)
+    relations_file = os.path.join(input_folder, settings['preprocessor']['cluster_relations_filename'])
+    pack_file = os.path.join(input_folder, "benchmark_scene.pack")
+    collections, _ = load_json_set(files, relations_file)
+    ScenePack.from_collections(
+        branch_clusters=collections['branches'],
+        leaf_clusters=collections['leaves'],
+        song_metadata=collections.get('metadata'),
+        cluster_relations=collections['relations']
+    ).export(pack_file)
+
+    results = {
+        'json_files': sorted(files.keys()) + ['relations'],
+        'json_bytes': sum(os.path.getsize(file) for file in files.values()) + os.path.getsize(relations_file),
+        'pack_bytes': os.path.getsize(pack_file),
+        'json_seconds': best_of(repeats, load_json_set, files, relations_file),
+        'pack_mmap_seconds': best_of(repeats, load_scene_pack, pack_file, True),
+        'pack_read_seconds': best_of(repeats, load_scene_pack, pack_file, False),
+    }
+    os.remove(pack_file)
+
+    print(f"{'format':>12} {'size [MB]':>10} {'load [s]':>10} {'speedup':>8}")
+    print(f"{'json + csv':>12} {results['json_bytes'] / 1e6:>10.2f} {results['json_seconds']:>10.4f} {1:>8.1f}")
+    for name, key in (('pack (mmap)', 'pack_mmap_seconds'), ('pack (read)', 'pack_read_seconds')):
+        print(f"{name:>12} {results['pack_bytes'] / 1e6:>10.2f} {results[key]:>10.4f} "
+              f"{results['json_seconds'] / results[key]:>8.1f}")
+    if output_file:
+        FileHandler.create_folders_if_not_exists(output_file)
+        with open(output_file, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,197 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+
+# Import necessary libraries
+import numpy as np
+import pandas as pd
+
+
+class SyntheticData:
+
+    @staticmethod
+    def media_ids(n_songs):
+        return [f"mjf-{i}" for i in range(1, n_songs + 1)]
+
+    @staticmethod
+    def coordinates(n_songs, n_blobs=12, seed=0):
+        """
+        Create a t-SNE like dataframe with media_id and 3-D coordinates, consisting of gaussian blobs of varying size.
+        :param n_songs: Number of songs
+        :type n_songs: int
+        :param n_blobs: Number of blobs
+        :type n_blobs: int
+        :param seed: Seed for the random number generator
+        :type seed: int
+        :return: dataframe
+        """
+        rng = np.random.default_rng(seed)
+        centers = rng.normal(scale=25.0, size=(n_blobs, 3))
+        weights = rng.dirichlet(np.ones(n_blobs))
+        blob = rng.choice(n_blobs, size=n_songs, p=weights)
+        spread = rng.uniform(2.0, 6.0, size=n_blobs)
+        xyz = centers[blob] + rng.normal(size=(n_songs, 3)) * spread[blob, None]
+        df = pd.DataFrame(xyz, columns=['X', 'Y', 'Z'])
+        df.insert(0, 'media_id', SyntheticData.media_ids(n_songs))
+        return df
+
+    @staticmethod
+    def containing_clusters(n_songs, n_models=3, leaves_per_model=100, seed=0):
+        """
+        Create containing clusters as written by the metadata stage: every song is part of one leaf per model,
+        leaf ids are consecutive over all models.
+        :param n_songs: Number of songs
+        :type n_songs: int
+        :param n_models: Number of models
+        :type n_models: int
+        :param leaves_per_model: Number of leaf clusters per model
+        :type leaves_per_model: int
+        :param seed: Seed for the random number generator
+        :type seed: int
+        :return: Dictionary with media ids as keys and lists of leaf ids as values
+        """
+        rng = np.random.default_rng(seed)
+        # Skewed leaf sizes like in a real hierarchy
+        weights = rng.dirichlet(np.full(leaves_per_model, 0.5), size=n_models)
+        leaves = np.column_stack([
+            rng.choice(leaves_per_model, size=n_songs, p=weights[m]) + m * leaves_per_model for m in range(n_models)
+        ])
+        return dict(zip(SyntheticData.media_ids(n_songs), leaves.tolist()))
+
+    @staticmethod
+    def audio(seconds, sample_rate=44100, seed=0):
+        """
+        Create a stereo concert-like signal: a chord that changes every half second, a percussive noise burst on every
+        beat and a low noise floor, generated second by second.
+        :param seconds: Length of the signal in seconds
+        :type seconds: int
+        :param sample_rate: Sample rate of the signal
+        :type sample_rate: int
+        :param seed: Seed for the random number generator
+        :type seed: int
+        :return: generator of int16 arrays of shape (sample_rate, 2), one per second
+        """
+        rng = np.random.default_rng(seed)
+        t = np.arange(sample_rate) / sample_rate
+        beat = np.exp(-30 * (t % 0.5))
+        for _ in range(seconds):
+            signal = np.zeros(sample_rate)
+            for half in range(2):
+                part = slice(half * sample_rate // 2, (half + 1) * sample_rate // 2)
+                for midi_note in rng.integers(40, 80, size=3):
+                    frequency = 440.0 * 2 ** ((midi_note - 69) / 12)
+                    signal[part] += 0.15 * np.sin(2 * np.pi * frequency * t[part])
+            signal += 0.2 * beat * rng.normal(size=sample_rate) + 0.01 * rng.normal(size=sample_rate)
+            stereo = np.column_stack([signal, np.roll(signal, 32)])
+            yield (np.clip(stereo, -1, 1) * 32767).astype(np.int16)
+
+    @staticmethod
+    def media_entry(media_id, media_path, seconds, sample_rate=44100, filesize=0):
+        """
+        Create a row of the media table for a synthetic recording, as returned by DBAgent.fetch_entry_for_media_path
+        :param media_id: Media id of the recording
+        :type media_id: str
+        :param media_path: Media path relative to the media folder
+        :type media_path: str
+        :param seconds: Duration of the recording in seconds
+        :type seconds: float
+        :param sample_rate: Sample rate of the audio
+        :type sample_rate: int
+        :param filesize: Size of the media file in bytes
+        :type filesize: int
+        :return: dictionary
+        """
+        return {
+            'media_id': media_id,
+            'media_path': media_path,
+            'metadata': {
+                'title': f"Synthetic song {media_id}",
+                'concert_name': "Synthetic concert",
+                'date': "1990-07-06",
+                'location': "Montreux",
+                'musicians': ["Synthetic band"],
+            },
+            'media_info': {
+                'audio': {'sample_rate': sample_rate},
+                'duration': float(seconds),
+                'filesize': filesize,
+            },
+        }
+
+    @staticmethod
+    def class_probabilities(n_songs, n_classes, n_styles=12, concentration=20.0, seed=0):
+        """
+        Create class probabilities like the activations of a classifier: every song belongs to one of a few styles and
+        draws its probabilities from a Dirichlet distribution around the profile of its style, so songs of the same
+        style are similar and most of the mass is on a few classes.
+        :param n_songs: Number of songs
+        :type n_songs: int
+        :param n_classes: Number of classes of the model
+        :type n_classes: int
+        :param n_styles: Number of styles
+        :type n_styles: int
+        :param concentration: Concentration of the songs around their style, higher values give tighter styles
+        :type concentration: float
+        :param seed: Seed for the random number generator
+        :type seed: int
+        :return: array of shape (n_songs, n_classes), rows sum to 1
+        """
+        rng = np.random.default_rng(seed)
+        profiles = rng.dirichlet(np.full(n_classes, 0.3), size=n_styles) * concentration + 0.05
+        style = rng.choice(n_styles, size=n_songs, p=rng.dirichlet(np.ones(n_styles)))
+        # Dirichlet samples via normalised gamma variates, one draw for all songs
+        gamma = rng.standard_gamma(profiles[style])
+        return gamma / gamma.sum(axis=1, keepdims=True)
+
+    @staticmethod
+    def feature_rows(model_name, classes, probabilities):
+        """
+        Create the rows of the feature table for one model as fetched by the clean stage: media_id, model_name and
+        the class probabilities as dictionary in data.
+        :param model_name: Name of the model as stored in the feature table
+        :type model_name: str
+        :param classes: Class names of the model
+        :type classes: list[str]
+        :param probabilities: Class probabilities of shape (number of songs, number of classes)
+        :type probabilities: np.ndarray
+        :return: dataframe
+        """
+        return pd.DataFrame({
+            'media_id': SyntheticData.media_ids(probabilities.shape[0]),
+            'model_name': model_name,
+            'data': [dict(zip(classes, row)) for row in probabilities.tolist()],
+        })
+
+    @staticmethod
+    def metadata(n_songs, songs_per_concert=12, seed=0):
+        """
+        Create the song metadata as fetched by the metadata stage: songs of the same concert share the concert name,
+        date, location and musicians.
+        :param n_songs: Number of songs
+        :type n_songs: int
+        :param songs_per_concert: Average number of songs per concert
+        :type songs_per_concert: int
+        :param seed: Seed for the random number generator
+        :type seed: int
+        :return: dataframe with media_id, media_path and metadata columns
+        """
+        rng = np.random.default_rng(seed)
+        n_concerts = max(n_songs // songs_per_concert, 1)
+        concert = np.sort(rng.integers(0, n_concerts, size=n_songs)).tolist()
+        days = rng.integers(0, 50 * 365, size=n_concerts)
+        dates = (np.datetime64('1967-06-15') + days).astype(str).tolist()
+        musicians = [[f"Musician {m}" for m in rng.integers(0, 5 * n_concerts, size=rng.integers(1, 8)).tolist()]
+                     for _ in range(n_concerts)]
+        durations = rng.gamma(4.0, 80.0, size=n_songs).round(2)
+        media_ids = SyntheticData.media_ids(n_songs)
+        return pd.DataFrame({
+            'media_id': media_ids,
+            'media_path': [f"{dates[c][:4]}/concert-{c}/{media_id}.mp4" for c, media_id in zip(concert, media_ids)],
+            'metadata': [{
+                'title': f"Song {media_id}",
+                'concert_name': f"Concert {c}",
+                'date': dates[c],
+                'location': "Montreux" if c % 10 else "Montreux Casino",
+                'duration': duration,
+                'musicians': musicians[c],
+            } for c, media_id, duration in zip(concert, media_ids, durations.tolist())],
+        })
@@ -8,12 +8,17 @@ from helpers.io_handler import IOHandler, Color
 from helpers.file_handler import FileHandler
 from helpers.timer import Timer
 from helpers.converter import Converter
+from helpers.tracing import Tracer
+from helpers.errors import UnknownClusteringMethodException
 from data_mapping.common import Mapping
 from data_mapping.cleaner import Cleaner
 from data_mapping.dimensionality_reduction import DimRed
 from data_mapping.clustering import Clustering
 from data_mapping.combiner import Combiner
 from data_mapping.preprocessor import Preprocessor
+from data_mapping.membership_index import MembershipIndex
+from data_mapping.scene_pack import ScenePack
+from data_mapping.delta_patch import DeltaPatch
 
 # Define tasks
 mapping_tasks = {
@@ -35,6 +40,8 @@ def read_main_arguments(argv):
         -f --file <input_file>
         -o --ofolder <output_folder>
         -l --limit <limit>
+        -p --previous <previous_output_folder>
+        --trace <trace_file>
 
     Tasks:
         clean
@@ -55,8 +62,12 @@ def read_main_arguments(argv):
         preprocess
         - Calculate distributions of songs in a cluster throughout other features
     
+    A previous output folder adds a delta patch with the changes to the artifacts of the previous run.
+    A trace file records the time spent in every stage, as JSON lines or, for .json files, in Chrome trace format.
+
     Examples:
         python create_mappings.py -o 'output'
+        python create_mappings.py -s branching -o 'output_new' -p 'output'
         python create_mappings.py -t clean -o 'output'
             (if pipeline starts with clean and no input file is given, data is extracted from database)
         python create_mappings.py -s clean -e dr -o 'output' -l 3000
@@ -72,12 +83,14 @@ def read_main_arguments(argv):
     input_file = None
     output_folder = None
     limit = None
-    usage_string = "python create_mappings.py -o <output_folder> [-l <limit>]"
+    previous_folder = None
+    usage_string = ("python create_mappings.py -o <output_folder> [-l <limit>] [-p <previous_output_folder>] "
+                    "[--trace <trace_file>]")
     try:
         opts, args = getopt.getopt(
             args=argv,
-            shortopts="ht:s:e:f:o:l:",
-            longopts=["help", "task=", "start=", "end=", "file=", "ofolder=", "limit="]
+            shortopts="ht:s:e:f:o:l:p:",
+            longopts=["help", "task=", "start=", "end=", "file=", "ofolder=", "limit=", "previous=", "trace="]
         )
     except getopt.GetoptError as err:
         IOHandler.show_error(f"Error: {err}")
@@ -105,12 +118,16 @@ def read_main_arguments(argv):
             except TypeError:
                 IOHandler.show_error("ERROR: Provided limit is not an integer value!")
                 sys.exit()
+        elif opt in ("-p", "--previous"):
+            previous_folder = arg
+        elif opt == "--trace":
+            Tracer.enable(arg)
 
-    return start_task, end_task, input_file, output_folder, limit
+    return start_task, end_task, input_file, output_folder, limit, previous_folder
 
 
 def verified_arguments(parsed_arguments):
-    start_task, end_task, input_file, output_folder, limit = parsed_arguments
+    start_task, end_task, input_file, output_folder, limit, previous_folder = parsed_arguments
 
     # Calculate index of first task
     if start_task:
@@ -148,192 +165,349 @@ def verified_arguments(parsed_arguments):
         IOHandler.show_error("ERROR: Please provide an existing output folder!")
         sys.exit()
 
-    return start_index, end_index, input_file, output_folder, limit
+    # Assert that the previous output folder exists if one was provided
+    if previous_folder and not os.path.isdir(previous_folder):
+        IOHandler.show_error("ERROR: The previous output folder does not exist!")
+        IOHandler.show_error(previous_folder)
+        sys.exit()
+
+    # Assert that the delta patch, which is created after the last stage, has all artifacts of the run
+    if previous_folder and end_index < list(mapping_tasks.keys()).index('preprocess'):
+        IOHandler.show_error("ERROR: A delta patch (-p) needs a run that ends with the preprocess stage!")
+        sys.exit()
+
+    return start_index, end_index, input_file, output_folder, limit, previous_folder
+
+
+def finish_run(program_timer):
+    print(f"Overall time: {program_timer.get_seconds():.2f} seconds")
+    Tracer.finish()
 
 
 def main(argv):
     program_timer = Timer()
     parsed_arguments = read_main_arguments(argv)
-    start_index, end_index, csv_file, output_folder, limit = verified_arguments(parsed_arguments)
+    start_index, end_index, csv_file, output_folder, limit, previous_folder = verified_arguments(parsed_arguments)
     settings = FileHandler.read_config_file()
     database_name = settings['database']['name']
+    export_settings = settings.get('export', {})
+    compression = Mapping.verified_compression(export_settings.get('compression'))
+    # The scene pack and delta patches are built from the expanded song metadata file
+    export_mode = settings['metadata'].get('export_mode', 'expanded')
+    if export_mode == 'interned' and ((export_settings.get('scene_pack') or {}).get('enabled', False)
+                                      or previous_folder is not None):
+        IOHandler.show_error("ERROR: The scene pack and delta patches need the expanded song metadata, "
+                             "set metadata.export_mode to 'both' instead of 'interned'!")
+        sys.exit()
     if output_folder is None:
         output_folder = f"mappings_{Converter.get_file_timestring()}"
 
     clean_collection = {}
     dr_collection = {}
     cluster_collection = {}
-    ue_leaf_clusters = {}
+    ue_leaf_clusters_extended = {}
     containing_clusters_dict = {}
 
     # ====================================
     #   clean
     # ====================================
     if start_index == 0:
-        # Clean data from csv or database source
-        if csv_file:
-            clean_collection = Cleaner.convert_from_csv(csv_file, limit)
-        else:
-            clean_collection = Cleaner.convert_from_database(database_name, limit)
-        Mapping.export_to_multiple_csv(
-            model_collection=clean_collection,
-            output_folder=output_folder,
-            prefix=mapping_tasks['clean'],
-            data_name="features"
-        )
+        with Tracer.span("stage[clean]", limit=limit):
+            # Clean data from csv or database source
+            if csv_file:
+                clean_collection = Cleaner.convert_from_csv(csv_file, limit)
+            else:
+                clean_collection = Cleaner.convert_from_database(database_name, limit)
+            Mapping.export_to_multiple_csv(
+                model_collection=clean_collection,
+                output_folder=output_folder,
+                prefix=mapping_tasks['clean'],
+                data_name="features"
+            )
 
     if end_index < 1:
-        print(f"Overall time: {program_timer.get_seconds()} seconds")
+        finish_run(program_timer)
         return    # Abort early
 
     # ====================================
     #   dr
     # ====================================
     if start_index <= 1:
-        # Dimensionality reduction
-        if start_index == 1:
-            clean_collection = Mapping.import_from_multiple_csv(
-                input_folder=output_folder,
-                prefix=mapping_tasks['clean'],
-                limit=limit
+        with Tracer.span("stage[dr]", limit=limit):
+            # Dimensionality reduction
+            if start_index == 1:
+                clean_collection = Mapping.import_from_multiple_csv(
+                    input_folder=output_folder,
+                    prefix=mapping_tasks['clean'],
+                    limit=limit
+                )
+            dr_collection = DimRed.perform_tsne(
+                model_collection=clean_collection,
+                perplexity=settings['dr']['perplexity'],
+                iterations=settings['dr']['iterations']
+            )
+            Mapping.export_to_multiple_csv(
+                model_collection=dr_collection,
+                output_folder=output_folder,
+                prefix=mapping_tasks['dr'],
+                data_name="TSNE Coordinates"
             )
-        dr_collection = DimRed.perform_tsne(
-            model_collection=clean_collection,
-            perplexity=settings['dr']['perplexity'],
-            iterations=settings['dr']['iterations']
-        )
-        Mapping.export_to_multiple_csv(
-            model_collection=dr_collection,
-            output_folder=output_folder,
-            prefix=mapping_tasks['dr'],
-            data_name="TSNE Coordinates"
-        )
 
     if end_index < 2:
-        print(f"Overall time: {program_timer.get_seconds()} seconds")
+        finish_run(program_timer)
         return    # Abort early
 
     # ====================================
     #   cluster
     # ====================================
     if start_index <= 2:
-        # Clustering
-        if start_index == 2:
-            dr_collection = Mapping.import_from_multiple_csv(
-                input_folder=output_folder,
-                prefix=mapping_tasks['dr'],
-                limit=limit
+        with Tracer.span("stage[cluster]", limit=limit):
+            # Clustering
+            if start_index == 2:
+                dr_collection = Mapping.import_from_multiple_csv(
+                    input_folder=output_folder,
+                    prefix=mapping_tasks['dr'],
+                    limit=limit
+                )
+            try:
+                cluster_collection = Clustering.hierarchical_clustering(
+                    model_collection=dr_collection,
+                    branching_factors=settings['clustering']['branching_factors'],
+                    method=settings['clustering'].get('method', 'spectral'),
+                    options=settings['clustering']
+                )
+            except UnknownClusteringMethodException as error:
+                IOHandler.show_error(error)
+                sys.exit()
+            Mapping.export_to_multiple_csv(
+                model_collection=cluster_collection,
+                output_folder=output_folder,
+                prefix=mapping_tasks['cluster'],
+                data_name="Clusters"
             )
-        cluster_collection = Clustering.hierarchical_spectral_clustering(
-            model_collection=dr_collection,
-            branching_factors=settings['clustering']['branching_factors']
-        )
-        Mapping.export_to_multiple_csv(
-            model_collection=cluster_collection,
-            output_folder=output_folder,
-            prefix=mapping_tasks['cluster'],
-            data_name="Spectral Clusters"
-        )
 
     if end_index < 3:
-        print(f"Overall time: {program_timer.get_seconds()} seconds")
+        finish_run(program_timer)
         return    # Abort early
 
     # ====================================
     #   branching
     # ====================================
     if start_index <= 3:
-        # Calculate geometry and feature vectors for branches and leaf clusters and store them into json files
-        if start_index == 3:
-            cluster_collection = Mapping.import_from_multiple_csv(
-                input_folder=output_folder,
-                prefix=mapping_tasks['cluster'],
-                limit=limit
+        with Tracer.span("stage[branching]", limit=limit):
+            # Calculate geometry and feature vectors for branches and leaf clusters and store them into json files
+            if start_index == 3:
+                cluster_collection = Mapping.import_from_multiple_csv(
+                    input_folder=output_folder,
+                    prefix=mapping_tasks['cluster'],
+                    limit=limit
+                )
+            if start_index > 0:
+                clean_collection = Mapping.import_from_multiple_csv(
+                    input_folder=output_folder,
+                    prefix=mapping_tasks['clean'],
+                    limit=limit
+                )
+            ue_branch_clusters, ue_leaf_clusters = Combiner.process_all_models(
+                cluster_dataframes=cluster_collection,
+                vector_dataframes=clean_collection,
+                model_full_names=settings['models'],
+                tree_structure_yaml="tree_structure.yaml",
+                geometry_precision=export_settings.get('geometry_precision')
             )
-        if start_index > 0:
-            clean_collection = Mapping.import_from_multiple_csv(
-                input_folder=output_folder,
-                prefix=mapping_tasks['clean'],
-                limit=limit
+            ue_leaf_clusters_extended = Preprocessor.append_stats_to_leaf_clusters(
+                leaf_cluster_geometry_dict=ue_leaf_clusters
             )
-        ue_branch_clusters, ue_leaf_clusters = Combiner.process_all_models(
-            cluster_dataframes=cluster_collection,
-            vector_dataframes=clean_collection,
-            model_full_names=settings['models'],
-            tree_structure_yaml="tree_structure.yaml"
-        )
-        ue_leaf_clusters_extended = Preprocessor.append_stats_to_leaf_clusters(
-            leaf_cluster_geometry_dict=ue_leaf_clusters
-        )
-        # Export to JSON
-        print("Exporting json files... ", end="")
-        Mapping.export_collection_to_json(
-            collection=ue_branch_clusters,
-            output_file=os.path.join(output_folder, settings['branching_filenames']['branches_filename'])
-        )
-        Mapping.export_collection_to_json(
-            collection=ue_leaf_clusters_extended,
-            output_file=os.path.join(output_folder, settings['branching_filenames']['leaves_filename'])
-        )
-        print("Done.")
+            # Export to JSON
+            print("Exporting json files... ", end="")
+            Mapping.export_collection_to_json(
+                collection=ue_branch_clusters,
+                output_file=os.path.join(output_folder, settings['branching_filenames']['branches_filename']),
+                compression=compression
+            )
+            Mapping.export_collection_to_json(
+                collection=ue_leaf_clusters_extended,
+                output_file=os.path.join(output_folder, settings['branching_filenames']['leaves_filename']),
+                compression=compression
+            )
+            print("Done.")
+            shard_settings = settings['branching_filenames'].get('leaf_shards') or {}
+            if shard_settings.get('enabled', False):
+                print("Exporting leaf cluster shards... ", end="")
+                written, unchanged, removed = Mapping.export_collection_to_json_shards(
+                    collection=ue_leaf_clusters_extended,
+                    output_folder=os.path.join(output_folder, shard_settings['folder']),
+                    manifest_file=os.path.join(output_folder, shard_settings['manifest_filename']),
+                    compression=compression
+                )
+                print(f"Done. {written} written, {unchanged} unchanged, {removed} removed.")
 
     if end_index < 4:
-        print(f"Overall time: {program_timer.get_seconds()} seconds")
+        finish_run(program_timer)
         return    # Abort early
     
     # ====================================
     #   metadata
     # ====================================
     if start_index <= 4:
-        # Read media paths and metadata for all songs from database and store them into a json file
-        if start_index == 4:
-            ue_leaf_clusters = Mapping.import_dict_from_json(
-                file_name=os.path.join(output_folder, settings['branching_filenames']['leaves_filename']),
+        with Tracer.span("stage[metadata]", limit=limit):
+            # Read media paths and metadata for all songs from database and store them into a json file
+            leaves_file = os.path.join(output_folder, settings['branching_filenames']['leaves_filename'])
+            metadata_file = os.path.join(output_folder, settings['metadata']['metadata_filename'])
+            languages = settings['metadata'].get('languages', ['en'])
+            if start_index == 4:
+                ue_leaf_clusters_extended = Mapping.import_dict_from_json(file_name=leaves_file)
+            incremental_settings = settings['metadata'].get('incremental') or {}
+            if incremental_settings.get('enabled', False):
+                # Fetch only songs changed since the watermark of the previous run and patch its metadata file
+                state_file = os.path.join(output_folder, incremental_settings['state_filename'])
+                metadata_state = {
+                    'watermark_column': incremental_settings.get('watermark_column'),
+                    'languages': languages,
+                    'leaves_sha1': FileHandler.file_sha1(leaves_file),
+                    'limit': limit,
+                    'export_mode': export_mode,
+                }
+                previous_state = Mapping.import_dict_from_json(state_file) if os.path.exists(state_file) else {}
+                patch_previous = os.path.exists(metadata_file) and all(
+                    previous_state.get(key) == value for key, value in metadata_state.items())
+                if not patch_previous:
+                    print("No matching previous metadata export found, fetching all songs.")
+                metadata_df, media_ids, metadata_state['watermark'] = Combiner.read_changed_metadata_from_database(
+                    db_name=database_name,
+                    watermark_column=metadata_state['watermark_column'],
+                    watermark=previous_state.get('watermark') if patch_previous else None,
+                    limit=limit
+                )
+            else:
+                metadata_df = Combiner.read_features_from_database(
+                    db_name=database_name,
+                    limit=limit
+                )
+            Combiner.make_concert_dates_human_readable(metadata_df, languages)
+            # Add information about all clusters a song is part of and store this information in a separate file too
+            changed_media_ids = metadata_df['media_id'].tolist()
+            containing_clusters_dict, metadata_df = Preprocessor.add_containing_clusters(
+                metadata_df=metadata_df,
+                cluster_geometry_dict=ue_leaf_clusters_extended
             )
-        metadata_df = Combiner.read_features_from_database(
-            db_name=database_name,
-            limit=limit
-        )
-        Combiner.make_concert_dates_human_readable(metadata_df, 'en')
-        # Add information about all clusters a song is part of and store this information in a separate file too
-        containing_clusters_dict, metadata_df = Preprocessor.add_containing_clusters(
-            metadata_df=metadata_df,
-            cluster_geometry_dict=ue_leaf_clusters
-        )
-        # metadata_df.set_index('media_id', inplace=True)
-        Mapping.export_df_to_json(
-            df=metadata_df,
-            output_file=os.path.join(output_folder, settings['metadata']['metadata_filename'])
-        )
-        Mapping.export_collection_to_json(
-            collection=containing_clusters_dict,
-            output_file=os.path.join(output_folder, settings['preprocessor']['containing_clusters_filename'])
-        )
+            if incremental_settings.get('enabled', False) and patch_previous:
+                metadata_df = Preprocessor.patch_metadata(
+                    previous_metadata=Mapping.import_dict_from_json(metadata_file),
+                    changed_metadata_df=metadata_df,
+                    changed_media_ids=changed_media_ids,
+                    media_ids=media_ids
+                )
+            # metadata_df.set_index('media_id', inplace=True)
+            # The incremental refresh patches the expanded file of the previous run, so it is written in any mode
+            if export_mode in ('expanded', 'both') or incremental_settings.get('enabled', False):
+                Mapping.export_df_to_json(
+                    df=metadata_df,
+                    output_file=os.path.join(output_folder, settings['metadata']['metadata_filename']),
+                    compression=compression
+                )
+            if export_mode in ('interned', 'both'):
+                Mapping.export_collection_to_json(
+                    collection=Preprocessor.intern_metadata(metadata_df),
+                    output_file=os.path.join(output_folder, settings['metadata']['interned_filename']),
+                    compression=compression
+                )
+            Mapping.export_collection_to_json(
+                collection=containing_clusters_dict,
+                output_file=os.path.join(output_folder, settings['preprocessor']['containing_clusters_filename']),
+                compression=compression
+            )
+            if incremental_settings.get('enabled', False):
+                Mapping.export_collection_to_json(metadata_state, state_file)
     
     if end_index < 5:
-        print(f"Overall time: {program_timer.get_seconds()} seconds")
+        finish_run(program_timer)
         return  # Abort early
     
     # ====================================
     #   preprocess
     # ====================================
     if start_index <= 5:
-        # Calculate distributions of songs in a cluster throughout other features
-        if start_index == 5:
-            containing_clusters_dict = Mapping.import_dict_from_json(
-                file_name=os.path.join(output_folder, settings['preprocessor']['containing_clusters_filename'])
+        with Tracer.span("stage[preprocess]", limit=limit):
+            # Calculate distributions of songs in a cluster throughout other features
+            if start_index == 5:
+                containing_clusters_dict = Mapping.import_dict_from_json(
+                    file_name=os.path.join(output_folder, settings['preprocessor']['containing_clusters_filename'])
+                )
+            cluster_relations_df = Preprocessor.calculate_cluster_relations(
+                containing_clusters=containing_clusters_dict
             )
-        cluster_relations_df = Preprocessor.calculate_cluster_relations(
-            containing_clusters=containing_clusters_dict
-        )
-        Mapping.export_df_to_csv(
-            dataframe=cluster_relations_df,
-            output_file=os.path.join(output_folder, settings['preprocessor']['cluster_relations_filename']),
-            index=False,
-            header=False
-        )
-    
-    print(f"Overall time: {program_timer.get_seconds():.2f} seconds")
+            Mapping.export_df_to_csv(
+                dataframe=cluster_relations_df,
+                output_file=os.path.join(output_folder, settings['preprocessor']['cluster_relations_filename']),
+                index=False,
+                header=False
+            )
+            sparse_settings = settings['preprocessor'].get('sparse_relations', {})
+            if sparse_settings.get('top_k', 0) > 0:
+                top_relations = Preprocessor.calculate_top_cluster_relations(
+                    containing_clusters=containing_clusters_dict,
+                    top_k=sparse_settings['top_k']
+                )
+                Mapping.export_arrays_to_binary(
+                    arrays=top_relations,
+                    output_file=os.path.join(output_folder, sparse_settings['data_filename']),
+                    index_file=os.path.join(output_folder, sparse_settings['index_filename']),
+                    attributes={
+                        'format': 'csr',
+                        'n_clusters': len(top_relations['indptr']) - 1,
+                        'top_k': sparse_settings['top_k'],
+                        'includes_self': False,
+                    }
+                )
+            membership_settings = settings['preprocessor'].get('membership_index', {})
+            if membership_settings.get('enabled', False):
+                # Leaf id range of every model from the branch clusters of the branching stage
+                branch_clusters = Mapping.import_dict_from_json(
+                    file_name=os.path.join(output_folder, settings['branching_filenames']['branches_filename'])
+                )
+                MembershipIndex.from_containing_clusters(
+                    containing_clusters=containing_clusters_dict,
+                    groups=MembershipIndex.groups_from_branch_clusters(branch_clusters)
+                ).export(
+                    output_file=os.path.join(output_folder, membership_settings['data_filename']),
+                    index_file=os.path.join(output_folder, membership_settings['index_filename'])
+                )
+            scene_pack_settings = export_settings.get('scene_pack') or {}
+            if scene_pack_settings.get('enabled', False):
+                # Pack the outputs of branching, metadata and preprocess into a single binary file for the client
+                metadata_file = os.path.join(output_folder, settings['metadata']['metadata_filename'])
+                scene_pack = ScenePack.from_collections(
+                    branch_clusters=Mapping.import_dict_from_json(
+                        file_name=os.path.join(output_folder, settings['branching_filenames']['branches_filename'])
+                    ),
+                    leaf_clusters=Mapping.import_dict_from_json(
+                        file_name=os.path.join(output_folder, settings['branching_filenames']['leaves_filename'])
+                    ),
+                    song_metadata=(Mapping.import_dict_from_json(metadata_file)
+                                   if os.path.exists(metadata_file) else None),
+                    cluster_relations=cluster_relations_df
+                )
+                scene_pack.export(os.path.join(output_folder, scene_pack_settings['filename']))
+
+    # ====================================
+    #   delta patch
+    # ====================================
+    if previous_folder is not None:
+        with Tracer.span("stage[delta_patch]", limit=limit):
+            # Store the changes since the previous run, clients can update with apply_delta.py
+            delta_patch = DeltaPatch.create(
+                previous_artifacts=DeltaPatch.read_artifacts(previous_folder, settings),
+                artifacts=DeltaPatch.read_artifacts(output_folder, settings)
+            )
+            Mapping.export_collection_to_json(
+                collection=delta_patch,
+                output_file=os.path.join(output_folder, export_settings.get('delta_filename', "ue_delta_patch.json")),
+                compression=compression
+            )
+            print(f"Delta patch: {delta_patch['summary']}")
+
+    finish_run(program_timer)
 
 
 if __name__ == '__main__':
@@ -2,77 +2,205 @@
 #  All rights reserved.
 
 # Import necessary libraries
-from sklearn.cluster import SpectralClustering
+from sklearn.cluster import SpectralClustering, KMeans, MiniBatchKMeans, BisectingKMeans
+from sklearn.manifold import spectral_embedding
+from sklearn.neighbors import kneighbors_graph
+from sklearn.preprocessing import normalize
+import numpy as np
 import pandas as pd
 from helpers.timer import Timer
+from helpers.errors import UnknownClusteringMethodException
+
+COORDINATE_COLUMNS = ['X', 'Y', 'Z']
+
+# Available hierarchy builders
+CLUSTERING_METHODS = {
+    'spectral': "Spectral Clustering",
+    'spectral_embedding': "Spectral Embedding Clustering",
+    'minibatch_kmeans': "Mini-Batch K-Means Clustering",
+    'bisecting_kmeans': "Bisecting K-Means Clustering",
+}
+
+# Default values
+DEFAULT_EMBEDDING_COMPONENTS = 32
+DEFAULT_EMBEDDING_NEIGHBORS = 10
+DEFAULT_BATCH_SIZE = 4096
 
 
 class Clustering:
-    
+
     @staticmethod
-    def hierarchical_spectral_clustering(model_collection, branching_factors):
-        print(f"Perform hierarchical Spectral Clustering for all {len(model_collection)} models:")
+    def hierarchical_clustering(model_collection, branching_factors, method='spectral', options=None):
+        """
+        Build a cluster hierarchy for every model with the given hierarchy builder.
+        :param model_collection: Dictionary of dataframes with media_id and coordinates, model names as keys.
+        :type model_collection: dict[str, pd.DataFrame]
+        :param branching_factors: Number of clusters per node for each depth
+        :type branching_factors: list[int]
+        :param method: Name of the hierarchy builder, one of CLUSTERING_METHODS
+        :type method: str
+        :param options: Clustering settings, builder specific values are read from the sub-keys embedding and kmeans
+        :type options: dict | None
+        :return: Dictionary of dataframes with cluster columns b_0..b_k, model names as keys.
+        """
+        if method not in CLUSTERING_METHODS:
+            raise UnknownClusteringMethodException(method)
+        if options is None:
+            options = {}
+        print(f"Perform hierarchical {CLUSTERING_METHODS[method]} for all {len(model_collection)} models:")
         cluster_collection = {}
-        cluster_columns = []
-        for i in range(len(branching_factors)):
-            cluster_columns.append(f"b_{i}")
-        
         for model_name, feature_df in model_collection.items():
             print(f"Calculate clusters for {model_name}...")
             cluster_timer = Timer()
-            # Copy model dataframe, append columns for each depth and preset all values to -1
-            df_original = feature_df.copy()
-            for i in range(len(branching_factors)):
-                df_original[cluster_columns[i]] = -1
-            # Perform Spectral Clustering recursively to obtain a cluster hierarchy
-            # df_original will be updated in the process!
-            Clustering.__update_cluster_labels(df_original, df_original, branching_factors[0], cluster_columns[0])
-            Clustering.__create_subclusters(df_original, df_original, 0, branching_factors, cluster_columns)
+            # Hold coordinates as one contiguous float32 array and the hierarchy as an int32 label matrix
+            # with one column per depth, preset to -1
+            coordinates = np.ascontiguousarray(feature_df[COORDINATE_COLUMNS].to_numpy(dtype=np.float32))
+            labels = np.full((coordinates.shape[0], len(branching_factors)), -1, dtype=np.int32)
+            if method == 'spectral_embedding':
+                node_labeler = Clustering.__spectral_embedding_labeler(
+                    coordinates, branching_factors, options.get('embedding') or {})
+            elif method in ('minibatch_kmeans', 'bisecting_kmeans'):
+                node_labeler = Clustering.__kmeans_labeler(coordinates, method, options.get('kmeans') or {})
+            else:
+                def node_labeler(indices, num_clusters):
+                    return Clustering.__spectral_labels(coordinates[indices], num_clusters)
+            # Cluster recursively to obtain a cluster hierarchy
+            # labels will be updated in the process!
+            Clustering.__label_subclusters(
+                node_labeler=node_labeler,
+                labels=labels,
+                indices=np.arange(coordinates.shape[0]),
+                depth=0,
+                br_factors=branching_factors
+            )
             # Store dataframe in collection
-            cluster_collection[model_name] = df_original
+            cluster_collection[model_name] = Clustering.__labels_to_dataframe(feature_df, labels)
             print(f"Done. Time elapsed: {cluster_timer.get_seconds()} seconds")
         return cluster_collection
-    
+
     @staticmethod
-    def __update_cluster_labels(df_original, df_cluster, num_clusters, cluster_column):
-        # Check if there are enough samples in df_cluster for spectral clustering
-        if df_cluster.shape[0] >= 2:
-            df_values = df_cluster.iloc[:, 1:4]
-            n_neighbors = min(df_cluster.shape[0], 10)
-            # Choose one of the following clustering methods.
-            # Both versions use the cluster_qr strategy for assigning labels in the embedding space.
-            # 1. Construct the affinity matrix by computing a graph of nearest neighbors
-            spectral_nn = SpectralClustering(
-                n_clusters=num_clusters,
-                eigen_solver='amg',
-                affinity='nearest_neighbors',
-                n_neighbors=n_neighbors,
-                assign_labels='cluster_qr'
-            )
-            # 2. Construct the affinity matrix using a radial basis function (RBF) kernel
-            spectral_rbf = SpectralClustering(
-                n_clusters=num_clusters,
+    def hierarchical_spectral_clustering(model_collection, branching_factors):
+        return Clustering.hierarchical_clustering(model_collection, branching_factors, method='spectral')
+
+    @staticmethod
+    def __labels_to_dataframe(feature_df, labels):
+        """
+        Convert a label matrix into the cluster csv schema: coordinates followed by one column b_i per depth.
+        :param feature_df: Dataframe with media_id and coordinates
+        :type feature_df: pd.DataFrame
+        :param labels: Label matrix of shape (number of songs, depth)
+        :type labels: np.ndarray
+        :return: dataframe
+        """
+        cluster_columns = [f"b_{i}" for i in range(labels.shape[1])]
+        cluster_df = feature_df.copy()
+        cluster_df[cluster_columns] = pd.DataFrame(labels, columns=cluster_columns, index=feature_df.index)
+        return cluster_df
+
+    @staticmethod
+    def __spectral_labels(values, num_clusters):
+        # Check if there are enough samples for spectral clustering, fill with zeroes otherwise
+        if values.shape[0] < 2:
+            return np.zeros(values.shape[0], dtype=np.int32)
+        n_neighbors = min(values.shape[0], 10)
+        # Choose one of the following clustering methods.
+        # Both versions use the cluster_qr strategy for assigning labels in the embedding space.
+        # 1. Construct the affinity matrix by computing a graph of nearest neighbors
+        spectral_nn = SpectralClustering(
+            n_clusters=num_clusters,
+            eigen_solver='amg',
+            affinity='nearest_neighbors',
+            n_neighbors=n_neighbors,
+            assign_labels='cluster_qr'
+        )
+        # 2. Construct the affinity matrix using a radial basis function (RBF) kernel
+        spectral_rbf = SpectralClustering(
+            n_clusters=num_clusters,
+            eigen_solver='amg',
+            affinity='rbf',
+            assign_labels='cluster_qr'
+        )
+        spectral = spectral_rbf.fit(values)
+        return spectral.labels_.astype(np.int32)
+
+    @staticmethod
+    def __spectral_embedding_labeler(coordinates, branching_factors, options):
+        """
+        Compute the spectral embedding of all songs once and return a node labeler that clusters subsets of songs
+        with k-means in the embedded space, optionally followed by a local refinement on the neighbourhood graph.
+        """
+        n_samples = coordinates.shape[0]
+        n_neighbors = min(options.get('n_neighbors', DEFAULT_EMBEDDING_NEIGHBORS), n_samples - 1)
+        n_components = min(options.get('n_components', DEFAULT_EMBEDDING_COMPONENTS), n_samples - 1)
+        refinement = options.get('refinement', True)
+        if n_neighbors < 1 or n_components < max(branching_factors):
+            # Too few songs for a meaningful embedding: cluster the coordinates directly
+            embedding = coordinates
+            graph = None
+        else:
+            # Symmetric, sparse nearest neighbour affinity and a single eigen-decomposition for the whole model
+            graph = kneighbors_graph(coordinates, n_neighbors=n_neighbors, include_self=True)
+            graph = (0.5 * (graph + graph.T)).tocsr()
+            embedding = spectral_embedding(
+                graph,
+                n_components=n_components,
                 eigen_solver='amg',
-                affinity='rbf',
-                assign_labels='cluster_qr'
+                drop_first=False
             )
-            spectral = spectral_rbf.fit(df_values)
-            labels = pd.DataFrame(spectral.labels_, index=df_cluster.index)
-        else:
-            # Fill with zeroes
-            labels = pd.DataFrame([0 for _ in range(df_cluster.shape[0])], index=df_cluster.index)
-        # Update original dataframe and recursive sub-dataframe
-        labels = labels.rename(columns={0: cluster_column})
-        df_original.update(labels)
-        df_cluster.update(labels)
-    
+            embedding = np.ascontiguousarray(normalize(embedding).astype(np.float32))
+
+        def node_labeler(indices, num_clusters):
+            if indices.shape[0] < 2:
+                return np.zeros(indices.shape[0], dtype=np.int32)
+            kmeans = KMeans(n_clusters=min(num_clusters, indices.shape[0]), n_init=3)
+            node_labels = kmeans.fit_predict(embedding[indices]).astype(np.int32)
+            if refinement and graph is not None:
+                node_labels = Clustering.__refine_labels(graph, indices, node_labels, num_clusters)
+            return node_labels
+
+        return node_labeler
+
+    @staticmethod
+    def __kmeans_labeler(coordinates, method, options):
+        """
+        Return a node labeler that clusters subsets of songs with MiniBatchKMeans or BisectingKMeans on the
+        coordinates. Both scale linearly with the number of songs and never build an affinity matrix.
+        """
+        batch_size = options.get('batch_size', DEFAULT_BATCH_SIZE)
+
+        def node_labeler(indices, num_clusters):
+            if indices.shape[0] < 2:
+                return np.zeros(indices.shape[0], dtype=np.int32)
+            num_clusters = min(num_clusters, indices.shape[0])
+            if method == 'minibatch_kmeans':
+                kmeans = MiniBatchKMeans(n_clusters=num_clusters, batch_size=batch_size, n_init=3)
+            else:
+                kmeans = BisectingKMeans(n_clusters=num_clusters, bisecting_strategy='largest_cluster')
+            return kmeans.fit_predict(coordinates[indices]).astype(np.int32)
+
+        return node_labeler
+
+    @staticmethod
+    def __refine_labels(graph, indices, node_labels, num_clusters):
+        # Reassign each song to the label held by most of its neighbours within the node (including itself)
+        subgraph = graph[indices][:, indices]
+        one_hot = np.zeros((indices.shape[0], num_clusters), dtype=np.float32)
+        one_hot[np.arange(indices.shape[0]), node_labels] = 1.0
+        votes = subgraph @ one_hot
+        # Keep the current label on ties
+        votes[np.arange(indices.shape[0]), node_labels] += 1e-3
+        return votes.argmax(axis=1).astype(np.int32)
+
     @staticmethod
-    def __create_subclusters(df_original, df_cluster, depth, br_factors, cluster_columns):
+    def __label_subclusters(node_labeler, labels, indices, depth, br_factors):
+        # Label the songs of this node at the current depth
+        node_labels = node_labeler(indices, br_factors[depth])
+        labels[indices, depth] = node_labels
         if depth == len(br_factors) - 1:
             return
-        df_subclusters = df_cluster.groupby(cluster_columns[depth])
-        depth += 1
-        for subcluster_name, df_subcluster in df_subclusters:
-            Clustering.__update_cluster_labels(df_original, df_subcluster, br_factors[depth], cluster_columns[depth])
+        # Split index array by label (in ascending label order) instead of grouping dataframes
+        order = np.argsort(node_labels, kind='stable')
+        boundaries = np.flatnonzero(np.diff(node_labels[order])) + 1
+        for sub_indices in np.split(indices[order], boundaries):
             # Recursion
-            Clustering.__create_subclusters(df_original, df_subcluster, depth, br_factors, cluster_columns)
+            Clustering.__label_subclusters(node_labeler, labels, sub_indices, depth + 1, br_factors)
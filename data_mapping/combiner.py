@@ -3,7 +3,8 @@
 
 # Import necessary libraries
 import yaml
-from sklearn import preprocessing
+import numpy as np
+import pandas as pd
 from helpers.timer import Timer
 from helpers.converter import Converter
 from database.db_agent import DBAgent
@@ -19,12 +20,24 @@ DEFAULT_TANGENT = {
 
 class Combiner:
     @staticmethod
-    def __normalise_data(cluster_data):
-        df = cluster_data.copy()
-        min_max_scaler = preprocessing.MinMaxScaler()
-        df[['X', 'Y', 'Z']] = min_max_scaler.fit_transform(df[['X', 'Y', 'Z']])
-        return df
-    
+    def __normalise_geometry(coordinates, starts):
+        """
+        Min-max normalise coordinates per segment, with the same arithmetic as sklearn's MinMaxScaler.
+        :param coordinates: Coordinates of shape (number of songs, 3), sorted by segment
+        :type coordinates: np.ndarray
+        :param starts: First row of every segment
+        :type starts: np.ndarray
+        :return: normalised coordinates
+        """
+        segment_lengths = np.diff(np.append(starts, coordinates.shape[0]))
+        data_min = np.minimum.reduceat(coordinates, starts, axis=0)
+        data_range = np.maximum.reduceat(coordinates, starts, axis=0) - data_min
+        # Near constant features are not scaled
+        data_range[data_range < 10 * np.finfo(data_range.dtype).eps] = 1.0
+        scale = 1 / data_range
+        offset = 0 - data_min * scale
+        return coordinates * np.repeat(scale, segment_lengths, axis=0) + np.repeat(offset, segment_lengths, axis=0)
+
     @staticmethod
     def __determine_params(geometry, num_branches, branch_index):
         if 'DB_Length' in geometry:
@@ -60,82 +73,136 @@ class Combiner:
         }
 
     @staticmethod
-    def __create_ue_cluster_data(cluster, group_indices, depth, max_depth, tree_structure,
-                                 leaf_clusters=None, leaf_cluster_counter=0, best_of=DEFAULT_BESTOF):
+    def __aggregate_clusters(full_df, group_indices, feature_summaries, best_of=DEFAULT_BESTOF,
+                             geometry_precision=None):
+        """
+        Compute counts, means and top features of all nodes of a cluster hierarchy in one pass.
+        Rows are sorted by their label codes, so that every node is a contiguous segment of rows. Sums of the
+        leaves are reduced with np.add.reduceat and summed up again for the nodes above.
+        :param full_df: Dataframe with coordinates, cluster columns and feature columns of one model
+        :type full_df: pd.DataFrame
+        :param group_indices: Names of the cluster columns, one per depth
+        :type group_indices: list[str]
+        :param feature_summaries: Top features string per song with the index of full_df
+        :type feature_summaries: pd.Series
+        :param best_of: Number of top features per node
+        :type best_of: int
+        :param geometry_precision: Number of decimals of the normalised leaf geometry, None for full precision
+        :type geometry_precision: int | None
+        :return: Dictionary with node and leaf arrays
+        """
+        # Songs without cluster labels are not part of the hierarchy
+        clustered_df = full_df.dropna(subset=group_indices)
+        codes = clustered_df[group_indices].to_numpy(dtype=np.int64)
+        order = np.lexsort(codes.T[::-1])
+        codes = codes[order]
+        n_rows = codes.shape[0]
+
+        # First row of every node per depth
+        starts = []
+        changed = np.zeros(max(n_rows - 1, 0), dtype=bool)
+        for depth in range(len(group_indices)):
+            changed |= codes[1:, depth] != codes[:-1, depth]
+            starts.append(np.concatenate(([0], np.flatnonzero(changed) + 1)) if n_rows else np.zeros(0, dtype=int))
+
+        # Feature sums and non-missing counts for the leaves, then for all nodes above
+        features = clustered_df.iloc[:, 8:].to_numpy(dtype=np.float64)[order]
+        present = ~np.isnan(features)
+        leaf_sums = np.add.reduceat(np.where(present, features, 0.0), starts[-1], axis=0)
+        leaf_present = np.add.reduceat(present, starts[-1], axis=0)
+        nodes = []
+        for depth in range(len(group_indices)):
+            node_starts = starts[depth]
+            # Position of the first leaf of each node
+            leaf_positions = np.searchsorted(starts[-1], node_starts)
+            sums = np.add.reduceat(leaf_sums, leaf_positions, axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means = sums / np.add.reduceat(leaf_present, leaf_positions, axis=0)
+            nodes.append({
+                'starts': node_starts,
+                'elements': np.diff(np.append(node_starts, n_rows)),
+                'metadata': Combiner.__feature_top_shots_batch(
+                    pd.DataFrame(means, columns=clustered_df.columns[8:]), best_of).tolist(),
+                # Index of the parent node at the depth above
+                'parents': np.searchsorted(starts[depth - 1], node_starts, side='right') - 1 if depth > 0 else None,
+            })
+
+        # Leaf geometry, normalised per leaf
+        geometry = clustered_df[['X', 'Y', 'Z']].to_numpy(dtype=np.float64)[order]
+        normalised_geometry = Combiner.__normalise_geometry(geometry, starts[-1]) if n_rows else geometry
+        if geometry_precision is not None:
+            normalised_geometry = np.round(normalised_geometry, geometry_precision)
+        return {
+            'nodes': nodes,
+            'media_ids': clustered_df['media_id'].to_numpy()[order].tolist(),
+            'geometry': normalised_geometry.tolist(),
+            'features': feature_summaries.loc[clustered_df.index].to_numpy()[order].tolist(),
+        }
+
+    @staticmethod
+    def __create_ue_cluster_data(aggregation, depth, first, last, tree_structure,
+                                 leaf_clusters=None, leaf_cluster_counter=0):
         if leaf_clusters is None:
             leaf_clusters = {}
-        cluster_groups = cluster.groupby(group_indices[depth])
+        nodes = aggregation['nodes']
+        max_depth = len(nodes) - 1
         cluster_list = []
         branch_counter = 0
-        for sub_index, sub_df in cluster_groups:
-            cluster_means = sub_df.iloc[:, 8:].mean(axis=0)
-            top_shots = cluster_means.sort_values(ascending=False).head(best_of)
-
+        for node_index in range(first, last):
             # Combine data to JSON
             node_json = {
-                "metadata": " | ".join([f"{k}: {100 * v:.1f} %" for k, v in top_shots.items()]),
-                "elements": sub_df.shape[0],
+                "metadata": nodes[depth]['metadata'][node_index],
+                "elements": int(nodes[depth]['elements'][node_index]),
             }
             # Add geometry info for non-leave nodes
             if depth + 2 < len(tree_structure):
                 node_json["params"] = Combiner.__determine_params(
                     geometry=tree_structure[depth + 2],
-                    num_branches=len(cluster_groups),
+                    num_branches=last - first,
                     branch_index=branch_counter
                 )
                 branch_counter += 1
 
             # Recursion or leaf cluster?
             if depth < max_depth:
+                # Parents are sorted, the children of a node are the segment with its index
+                parents = nodes[depth + 1]['parents']
                 node_json["children"], leaf_clusters, leaf_cluster_counter = Combiner.__create_ue_cluster_data(
-                    cluster=sub_df,
-                    group_indices=group_indices,
+                    aggregation=aggregation,
                     depth=depth + 1,
-                    max_depth=max_depth,
+                    first=int(np.searchsorted(parents, node_index, side='left')),
+                    last=int(np.searchsorted(parents, node_index, side='right')),
                     tree_structure=tree_structure,
                     leaf_clusters=leaf_clusters,
-                    leaf_cluster_counter=leaf_cluster_counter,
-                    best_of=best_of
+                    leaf_cluster_counter=leaf_cluster_counter
                 )
             else:
                 node_json["leaf_uid"] = leaf_cluster_counter
+                start = nodes[depth]['starts'][node_index]
                 leaf_clusters[leaf_cluster_counter] = Combiner.__create_leaf_cluster_data(
-                    cluster_df=sub_df,
-                    best_of=best_of
+                    aggregation=aggregation,
+                    start=start,
+                    end=start + nodes[depth]['elements'][node_index]
                 )
                 leaf_cluster_counter += 1
             cluster_list.append(node_json)
         return cluster_list, leaf_clusters, leaf_cluster_counter
 
     @staticmethod
-    def __create_leaf_cluster_data(cluster_df, best_of):
-        leaf_df = cluster_df.copy()
-        # Extract normalised geometry
-        normalised_geometry = Combiner.__normalise_data(leaf_df.iloc[:, 0:4])
-        # Extract top features
-        leaf_df['features'] = leaf_df.apply(
-            lambda row: Combiner.__feature_top_shots(row[8:], best_of), axis=1)
-        leaf_df.drop(leaf_df.iloc[:, 1:-1], axis=1, inplace=True)
-        # Join dataframes
-        combined_leaf_df = normalised_geometry.merge(
-            right=leaf_df,
-            how='right',
-            on='media_id'
-        )
-        combined_leaf_df.set_index('media_id', inplace=True)
-        combined_leaf_dict = combined_leaf_df.to_dict(orient='index')
+    def __create_leaf_cluster_data(aggregation, start, end):
         leaf_dict = {}
-        for leaf_id, leaf_data in combined_leaf_dict.items():
-            features = leaf_data['features']
-            geometry = {k: leaf_data[k] for k in leaf_data if k in ['X', 'Y', 'Z']}
-            leaf_dict[leaf_id] = {
-                'geometry': geometry,
+        for media_id, (x, y, z), features in zip(aggregation['media_ids'][start:end],
+                                                 aggregation['geometry'][start:end],
+                                                 aggregation['features'][start:end]):
+            leaf_dict[media_id] = {
+                'geometry': {'X': x, 'Y': y, 'Z': z},
                 'features': features
             }
         return leaf_dict
 
     @staticmethod
-    def process_all_models(cluster_dataframes, vector_dataframes, model_full_names, tree_structure_yaml):
+    def process_all_models(cluster_dataframes, vector_dataframes, model_full_names, tree_structure_yaml,
+                           geometry_precision=None):
         print(f"Combine metadata for all {len(model_full_names)} models:")
         meta_timer = Timer()
 
@@ -186,14 +253,21 @@ class Combiner:
 
             # Run
             group_indices = full_df.columns[4:7].to_list()
-            model_cluster_data, leaf_clusters, leaf_cluster_counter = Combiner.__create_ue_cluster_data(
-                cluster=full_df,
+            feature_summaries = Combiner.__feature_top_shots_batch(full_df.iloc[:, 8:], DEFAULT_BESTOF)
+            aggregation = Combiner.__aggregate_clusters(
+                full_df=full_df,
                 group_indices=group_indices,
+                feature_summaries=feature_summaries,
+                best_of=DEFAULT_BESTOF,
+                geometry_precision=geometry_precision
+            )
+            model_cluster_data, leaf_clusters, leaf_cluster_counter = Combiner.__create_ue_cluster_data(
+                aggregation=aggregation,
                 depth=0,
-                max_depth=len(group_indices) - 1,
+                first=0,
+                last=len(aggregation['nodes'][0]['starts']),
                 tree_structure=tree_structure,
-                leaf_cluster_counter=leaf_cluster_counter,
-                best_of=DEFAULT_BESTOF
+                leaf_cluster_counter=leaf_cluster_counter
             )
             # Append to cluster data
             feature_json['children'] = model_cluster_data
@@ -218,19 +292,109 @@ class Combiner:
         return metadata_df
 
     @staticmethod
-    def __transform_metadata_date(metadata, language):
-        metadata['date'] = Converter.datetime_to_localized_timestring(metadata['date'], language)
-        return metadata
-    
+    def read_changed_metadata_from_database(db_name, watermark_column=None, watermark=None, limit=None):
+        """
+        Read the metadata of all songs changed after the given watermark (all songs if it is None) and the media ids
+        of all songs currently in the database.
+        :param db_name: Name of the database
+        :type db_name: str
+        :param watermark_column: Column with the time of the last change, e.g. updated_at. None uses the xmin of
+        the rows, i.e. the id of the transaction that changed them last
+        :type watermark_column: str | None
+        :param watermark: Watermark of the previous run
+        :type watermark: int | str | None
+        :param limit: If a limit is provided, reduce dataframe size.
+        :type limit: int | None
+        :return: Metadata dataframe of the changed songs, list of all media ids and the new watermark
+        """
+        database = DBAgent(db_name)
+        database.open_connection()
+        print("Fetching changed metadata from database... ", end="")
+        metadata_df = database.fetch_metadata_since_to_dataframe(watermark_column, watermark, limit=limit)
+        media_ids = database.fetch_all_media_ids()
+        print(f"Done. {len(metadata_df)} changed songs.")
+        database.close_connection()
+        if len(metadata_df) > 0:
+            watermark = metadata_df['watermark'].max()
+            watermark = watermark.isoformat() if hasattr(watermark, 'isoformat') else int(watermark)
+            metadata_df = metadata_df.drop('watermark', axis=1)
+        else:
+            metadata_df = pd.DataFrame(columns=['media_id', 'media_path', 'metadata'])
+        return metadata_df, media_ids, watermark
+
     @staticmethod
-    def make_concert_dates_human_readable(metadata_df, language='en'):
-        # Convert dates and re-set index
+    def make_concert_dates_human_readable(metadata_df, languages=('en',)):
+        """
+        Convert the concert dates of all songs to human-readable strings. Every distinct date is formatted once per
+        language. The date in the first language replaces the original date, all languages are stored under dates.
+        :param metadata_df: Metadata dataframe with a metadata column of dictionaries
+        :type metadata_df: pd.DataFrame
+        :param languages: Languages to render, e.g. ['en', 'de', 'fr', 'it']
+        :type languages: list[str] | tuple[str]
+        """
         print("Convert concert dates to human-readable format... ", end="")
-        metadata_df['metadata'] = metadata_df['metadata'].apply(
-            lambda row: Combiner.__transform_metadata_date(metadata=row, language=language))
+        if isinstance(languages, str):
+            languages = [languages]
+        localized_dates = {
+            date: Converter.datetime_to_localized_timestrings(date, languages)
+            for date in {metadata.get('date') for metadata in metadata_df['metadata']}
+            if date is not None
+        }
+        for metadata in metadata_df['metadata']:
+            localized = localized_dates.get(metadata.get('date'))
+            if localized is None:
+                continue
+            metadata['date'] = localized[languages[0]]
+            metadata['dates'] = localized
         print("Done.")
 
     @staticmethod
     def __feature_top_shots(row, best_of):
         top_shots = row.sort_values(ascending=False).head(best_of)
         return " | ".join([f"{k}: {100 * v:.1f} %" for k, v in top_shots.items()])
+
+    @staticmethod
+    def __feature_top_shots_batch(feature_df, best_of):
+        """
+        Create the top features string of every song at once.
+        Selects the best_of highest values per row with a single argpartition over the whole feature matrix and
+        formats the strings column-wise. Rows with ties or missing values among their top values fall back to
+        __feature_top_shots, so that the result is identical to applying it row by row.
+        :param feature_df: Dataframe with one column per class
+        :type feature_df: pd.DataFrame
+        :param best_of: Number of top features per song
+        :type best_of: int
+        :return: Series of feature strings with the index of feature_df
+        """
+        values = feature_df.to_numpy(dtype=np.float64)
+        n_rows, n_columns = values.shape
+        best_of = min(best_of, n_columns)
+        if n_rows == 0 or best_of == 0:
+            return pd.Series("", index=feature_df.index, dtype=object)
+
+        # Select top candidates per row and order them descending
+        top_indices = np.argpartition(-values, best_of - 1, axis=1)[:, :best_of]
+        top_values = np.take_along_axis(values, top_indices, axis=1)
+        order = np.argsort(-top_values, axis=1, kind='stable')
+        top_indices = np.take_along_axis(top_indices, order, axis=1)
+        top_values = np.take_along_axis(top_values, order, axis=1)
+
+        # Ties (within the top values or at the selection boundary) and NaNs make the order ambiguous
+        ambiguous = np.isnan(values).any(axis=1)
+        ambiguous |= (top_values[:, 1:] == top_values[:, :-1]).any(axis=1)
+        ambiguous |= (values >= top_values[:, -1:]).sum(axis=1) > best_of
+
+        # Format all strings column-wise on object arrays
+        class_labels = np.asarray([f"{k}: " for k in feature_df.columns], dtype=object)
+        percentages = 100 * top_values
+        feature_strings = None
+        for i in range(best_of):
+            entries = class_labels[top_indices[:, i]] + np.asarray(
+                ["%.1f %%" % v for v in percentages[:, i].tolist()], dtype=object)
+            feature_strings = entries if feature_strings is None else feature_strings + " | " + entries
+
+        # Resolve ambiguous rows with the row-wise implementation
+        for row_index in np.flatnonzero(ambiguous):
+            feature_strings[row_index] = Combiner.__feature_top_shots(
+                feature_df.iloc[row_index].astype(object), best_of)
+        return pd.Series(feature_strings, index=feature_df.index)
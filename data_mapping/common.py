@@ -4,15 +4,42 @@
 # Import necessary libraries
 import os
 import json
+import gzip
+import hashlib
+import numpy as np
 import pandas as pd
 from typing import Dict
 from helpers.file_handler import FileHandler
+from helpers.io_handler import IOHandler
 
 
 class Mapping:
 
     prefix_delimiter = "-"
     csv_suffix = ".csv"
+    __compression_suffixes = {'gzip': ".gz", 'zstd': ".zst"}
+
+    @staticmethod
+    def verified_compression(compression):
+        """
+        Check the compression formats of the export settings
+        :param compression: List of compression formats, possible values: gzip, zstd
+        :type compression: list[str] | None
+        :return: the supported formats, to be passed as compression to the JSON exports
+        """
+        verified = []
+        for compression_format in compression or []:
+            if compression_format not in Mapping.__compression_suffixes:
+                IOHandler.show_error(f"ERROR: Unknown compression format: {compression_format}")
+                continue
+            if compression_format == 'zstd':
+                try:
+                    import zstandard
+                except ImportError:
+                    IOHandler.show_error("ERROR: zstd compression requires the zstandard package!")
+                    continue
+            verified.append(compression_format)
+        return verified
 
     @staticmethod
     def import_df_from_single_csv(input_file, limit=None, random=False) -> pd.DataFrame:
@@ -119,25 +146,193 @@ class Mapping:
         dataframe.to_csv(output_file, index=index, header=header)
 
     @staticmethod
-    def export_collection_to_json(collection, output_file):
+    def export_collection_to_json(collection, output_file, compression=None):
         """
         Store a collection as JSON file
         :param collection:
         :param output_file:
+        :param compression: Formats of compressed siblings to write next to the file, as returned by
+            verified_compression
         :return:
         """
-        FileHandler.create_folders_if_not_exists(output_file)
-        with open(output_file, 'w') as file:
-            json.dump(collection, file)
+        # Encoding the whole collection at once uses the C encoder of the json module
+        Mapping.__write_json(json.dumps(collection), output_file, compression)
     
     @staticmethod
-    def export_df_to_json(df, output_file):
+    def export_df_to_json(df, output_file, compression=None):
         """
         Store a dataframe as JSON file
         :param df:
         :param output_file:
+        :param compression: Formats of compressed siblings to write next to the file, as returned by
+            verified_compression
+        :return:
+        """
+        Mapping.__write_json(df.to_json(orient='index'), output_file, compression)
+
+    @staticmethod
+    def export_collection_to_json_shards(collection, output_folder, manifest_file, compression=None):
+        """
+        Store every entry of a collection as its own JSON file named after its key and describe the shards in a
+        manifest with file, byte size, checksum and the stats of every entry (if present).
+        Shards whose content did not change since the last export are not rewritten, shards of removed keys are
+        deleted.
+        :param collection: Dictionary with shard keys (e.g. leaf_uid) as keys
+        :type collection: dict
+        :param output_folder: Folder of the shards
+        :type output_folder: str
+        :param manifest_file: Path of the JSON manifest
+        :type manifest_file: str
+        :param compression: Formats of compressed siblings to write next to every shard
+        :type compression: list[str] | None
+        :return: Number of written, unchanged and removed shards
+        """
+        manifest_folder = os.path.dirname(manifest_file)
+        previous_shards = {}
+        if os.path.exists(manifest_file):
+            previous_shards = Mapping.import_dict_from_json(manifest_file).get('shards', {})
+        suffixes = [Mapping.__compression_suffixes[compression_format] for compression_format in compression or []]
+        manifest = {
+            'version': 1,
+            'shards': {},
+        }
+        written = unchanged = 0
+        for key, value in collection.items():
+            key = str(key)
+            content = json.dumps(value)
+            encoded = content.encode()
+            checksum = hashlib.sha1(encoded).hexdigest()
+            shard_file = os.path.join(output_folder, f"{key}.json")
+            entry = {
+                'file': os.path.relpath(shard_file, manifest_folder),
+                'nbytes': len(encoded),
+                'sha1': checksum,
+            }
+            if isinstance(value, dict) and 'songs' in value:
+                entry['n_songs'] = len(value['songs'])
+            if isinstance(value, dict) and 'stats' in value:
+                entry['stats'] = value['stats']
+            manifest['shards'][key] = entry
+            previous = previous_shards.get(key)
+            if previous is not None and previous.get('sha1') == checksum and \
+                    all(os.path.exists(shard_file + suffix) for suffix in [""] + suffixes):
+                unchanged += 1
+                continue
+            Mapping.__write_json(content, shard_file, compression)
+            written += 1
+        # Delete shards of keys that no longer exist
+        removed = 0
+        for key, previous in previous_shards.items():
+            if key in manifest['shards']:
+                continue
+            Mapping.remove_json_file(os.path.join(manifest_folder, previous['file']))
+            removed += 1
+        Mapping.__write_json(json.dumps(manifest), manifest_file, compression)
+        return written, unchanged, removed
+
+    @staticmethod
+    def remove_json_file(output_file):
+        """
+        Delete a JSON file together with its compressed siblings, missing files are ignored
+        :param output_file: Path of the JSON file
+        :type output_file: str
+        """
+        for suffix in [""] + list(Mapping.__compression_suffixes.values()):
+            if os.path.exists(output_file + suffix):
+                os.remove(output_file + suffix)
+
+    @staticmethod
+    def import_shards_from_json(manifest_file, keys=None):
+        """
+        Read shards stored with export_collection_to_json_shards
+        :param manifest_file: Path of the JSON manifest
+        :type manifest_file: str
+        :param keys: Keys of the shards to read, all shards if None
+        :type keys: list | None
+        :return: Dictionary with shard keys as keys
+        """
+        manifest_folder = os.path.dirname(manifest_file)
+        shards = Mapping.import_dict_from_json(manifest_file)['shards']
+        if keys is None:
+            keys = shards.keys()
+        return {
+            str(key): Mapping.import_dict_from_json(os.path.join(manifest_folder, shards[str(key)]['file']))
+            for key in keys
+        }
+
+    @staticmethod
+    def __write_json(content, output_file, compression):
+        FileHandler.create_folders_if_not_exists(output_file)
+        content = content.encode()
+        with open(output_file, 'wb') as file:
+            file.write(content)
+        for compression_format in compression or []:
+            if compression_format == 'gzip':
+                compressed = gzip.compress(content, compresslevel=6, mtime=0)
+            else:
+                import zstandard
+                compressed = zstandard.ZstdCompressor(level=9).compress(content)
+            with open(output_file + Mapping.__compression_suffixes[compression_format], 'wb') as file:
+                file.write(compressed)
+
+    @staticmethod
+    def export_arrays_to_binary(arrays, output_file, index_file, attributes=None):
+        """
+        Store numpy arrays back to back in a little-endian binary file and describe them in a small JSON index
+        with dtype, shape and byte offset of every array, so that clients can read or memory-map them directly.
+        :param arrays: Dictionary of arrays with array names as keys
+        :type arrays: dict[str, np.ndarray]
+        :param output_file: Path of the binary file
+        :type output_file: str
+        :param index_file: Path of the JSON index
+        :type index_file: str
+        :param attributes: Additional values to store in the index
+        :type attributes: dict | None
         :return:
         """
         FileHandler.create_folders_if_not_exists(output_file)
-        with open(output_file, 'w') as file:
-            df.to_json(file, orient='index')
+        index = {
+            'version': 1,
+            'data_file': os.path.basename(output_file),
+            'byteorder': 'little',
+            'attributes': attributes if attributes is not None else {},
+            'arrays': {},
+        }
+        offset = 0
+        with open(output_file, 'wb') as file:
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+                file.write(array.tobytes())
+                index['arrays'][name] = {
+                    'dtype': array.dtype.name,
+                    'shape': list(array.shape),
+                    'offset': offset,
+                    'nbytes': array.nbytes,
+                }
+                offset += array.nbytes
+        Mapping.export_collection_to_json(index, index_file)
+
+    @staticmethod
+    def import_arrays_from_binary(index_file, memory_map=True):
+        """
+        Read arrays stored by export_arrays_to_binary
+        :param index_file: Path of the JSON index
+        :type index_file: str
+        :param memory_map: Whether to memory-map the arrays instead of reading them into memory
+        :type memory_map: bool
+        :return: Dictionary of arrays and the attributes stored in the index
+        """
+        index = Mapping.import_dict_from_json(index_file)
+        data_file = os.path.join(os.path.dirname(index_file), index['data_file'])
+        arrays = {}
+        for name, info in index['arrays'].items():
+            dtype = np.dtype(info['dtype']).newbyteorder('<')
+            count = int(np.prod(info['shape']))
+            if count == 0:
+                array = np.zeros(info['shape'], dtype=dtype)
+            elif memory_map:
+                array = np.memmap(data_file, dtype=dtype, mode='r', offset=info['offset'], shape=tuple(info['shape']))
+            else:
+                array = np.fromfile(data_file, dtype=dtype, count=count, offset=info['offset']).reshape(info['shape'])
+            arrays[name] = array
+        return arrays, index['attributes']
@@ -0,0 +1,259 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+
+# Import necessary libraries
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from data_mapping.common import Mapping
+from helpers.errors import DeltaPatchMismatchException
+
+DELTA_PATCH_VERSION = 1
+
+
+class DeltaPatch:
+    """
+    Differences between the artifacts of two mapping runs. Leaf clusters are compared by leaf_uid and their songs,
+    song metadata and containing clusters by media_id, so that the size of a patch scales with the number of changes.
+    Every patch records checksums of the artifacts it applies to and of the artifacts it produces. The checksums are
+    computed on the parsed content with sorted keys, so they do not depend on key order or number formatting.
+    """
+
+    @staticmethod
+    def artifact_files(settings):
+        """
+        File names of the artifacts covered by delta patches
+        :param settings: Settings of the config file
+        :type settings: dict
+        :return: Dictionary with artifact names as keys and file names as values
+        """
+        return {
+            'branches': settings['branching_filenames']['branches_filename'],
+            'leaves': settings['branching_filenames']['leaves_filename'],
+            'metadata': settings['metadata']['metadata_filename'],
+            'containing_clusters': settings['preprocessor']['containing_clusters_filename'],
+            'relations': settings['preprocessor']['cluster_relations_filename'],
+        }
+
+    @staticmethod
+    def read_artifacts(folder, settings):
+        """
+        Read all existing artifacts of a mapping run
+        :param folder: Output folder of the run
+        :type folder: str
+        :param settings: Settings of the config file
+        :type settings: dict
+        :return: Dictionary with artifact names as keys
+        """
+        artifacts = {}
+        for name, file_name in DeltaPatch.artifact_files(settings).items():
+            file_path = os.path.join(folder, file_name)
+            if not os.path.exists(file_path):
+                continue
+            if name == 'relations':
+                artifacts[name] = pd.read_csv(file_path, header=None).to_numpy(dtype=np.float64)
+            else:
+                artifacts[name] = Mapping.import_dict_from_json(file_path)
+        return artifacts
+
+    @staticmethod
+    def create(previous_artifacts, artifacts):
+        """
+        Compare the artifacts of two runs
+        :param previous_artifacts: Artifacts of the previous run as read by read_artifacts
+        :type previous_artifacts: dict
+        :param artifacts: Artifacts of the current run as read by read_artifacts
+        :type artifacts: dict
+        :return: delta patch
+        """
+        print("Create delta patch... ", end="")
+        patch = {
+            'version': DELTA_PATCH_VERSION,
+            'base': {name: DeltaPatch.checksum(value) for name, value in previous_artifacts.items()},
+            'target': {name: DeltaPatch.checksum(value) for name, value in artifacts.items()},
+        }
+        for name, value in artifacts.items():
+            previous = previous_artifacts.get(name)
+            if previous is None:
+                patch[name] = {'replace': DeltaPatch.__json_ready(value)}
+            elif patch['base'][name] == patch['target'][name]:
+                continue
+            elif name == 'leaves':
+                patch[name] = DeltaPatch.__diff_leaves(previous, value)
+            elif name in ('metadata', 'containing_clusters'):
+                patch[name] = DeltaPatch.__diff_by_key(previous, value)
+            elif name == 'relations' and previous.shape == value.shape:
+                changed = ~((previous == value) | (np.isnan(previous) & np.isnan(value)))
+                rows, columns = np.nonzero(changed)
+                patch[name] = {'cells': [[int(i), int(j), DeltaPatch.__json_ready(value[i, j])]
+                                         for i, j in zip(rows, columns)]}
+            else:
+                patch[name] = {'replace': DeltaPatch.__json_ready(value)}
+        patch['summary'] = DeltaPatch.__summary(patch)
+        print("Done.")
+        return patch
+
+    @staticmethod
+    def apply(patch, artifacts):
+        """
+        Apply a delta patch to the artifacts of the run it was created from
+        :param patch: Delta patch
+        :type patch: dict
+        :param artifacts: Artifacts as read by read_artifacts, will be updated in place
+        :type artifacts: dict
+        :return: updated artifacts
+        """
+        for name, checksum in patch['base'].items():
+            if name not in artifacts or DeltaPatch.checksum(artifacts[name]) != checksum:
+                raise DeltaPatchMismatchException(name, "does not match the base of the patch")
+        for name in patch['target'].keys():
+            if name not in patch:
+                continue
+            changes = patch[name]
+            if 'replace' in changes:
+                artifacts[name] = changes['replace']
+            elif name == 'leaves':
+                DeltaPatch.__apply_leaves(artifacts[name], changes)
+            elif name in ('metadata', 'containing_clusters'):
+                for key in changes['removed']:
+                    del artifacts[name][key]
+                artifacts[name].update(changes['upserted'])
+            elif name == 'relations':
+                for i, j, value in changes['cells']:
+                    artifacts[name][i, j] = np.nan if value is None else value
+        for name in list(artifacts.keys()):
+            if name not in patch['target']:
+                del artifacts[name]
+            elif name == 'relations':
+                artifacts[name] = np.asarray(
+                    [[np.nan if value is None else value for value in row] for row in artifacts[name]],
+                    dtype=np.float64
+                ).reshape(np.shape(artifacts[name]))
+        for name, checksum in patch['target'].items():
+            if DeltaPatch.checksum(artifacts[name]) != checksum:
+                raise DeltaPatchMismatchException(name, "does not match the target of the patch after applying it")
+        return artifacts
+
+    @staticmethod
+    def write_artifacts(artifacts, folder, settings, compression=None):
+        """
+        Store artifacts under the file names of a mapping run, files of artifacts that are not part of artifacts are
+        deleted
+        :param artifacts: Artifacts as returned by apply
+        :type artifacts: dict
+        :param folder: Output folder
+        :type folder: str
+        :param settings: Settings of the config file
+        :type settings: dict
+        :param compression: Formats of compressed siblings to write next to the JSON files
+        :type compression: list[str] | None
+        """
+        for name, file_name in DeltaPatch.artifact_files(settings).items():
+            file_path = os.path.join(folder, file_name)
+            if name not in artifacts:
+                # The artifact was removed by the patch, a stale file would no longer match the target
+                if name == 'relations':
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                else:
+                    Mapping.remove_json_file(file_path)
+            elif name == 'relations':
+                Mapping.export_df_to_csv(pd.DataFrame(artifacts[name]), file_path, index=False, header=False)
+            else:
+                Mapping.export_collection_to_json(artifacts[name], file_path, compression)
+
+    @staticmethod
+    def checksum(value):
+        """
+        Checksum of an artifact that does not depend on key order or number formatting
+        :param value: Parsed artifact
+        :type value: dict | np.ndarray
+        :return: sha1 hex digest
+        """
+        if isinstance(value, np.ndarray):
+            array = np.ascontiguousarray(value, dtype=np.float64)
+            content = json.dumps(list(array.shape)).encode() + array.tobytes()
+        else:
+            content = json.dumps(value, sort_keys=True).encode()
+        return hashlib.sha1(content).hexdigest()
+
+    @staticmethod
+    def __diff_by_key(previous, current):
+        return {
+            'upserted': {key: value for key, value in current.items()
+                         if key not in previous or previous[key] != value},
+            'removed': [key for key in previous.keys() if key not in current],
+        }
+
+    @staticmethod
+    def __diff_leaves(previous, current):
+        changes = {
+            'added': {uid: leaf for uid, leaf in current.items() if uid not in previous},
+            'removed': [uid for uid in previous.keys() if uid not in current],
+            'stats': {},
+            'songs': {'added': {}, 'moved': {}, 'changed': {}, 'removed': {}},
+        }
+        previous_songs = {media_id for leaf in previous.values() for media_id in leaf['songs']}
+        for uid, leaf in current.items():
+            if uid not in previous:
+                continue
+            previous_leaf = previous[uid]
+            if leaf.get('stats') != previous_leaf.get('stats'):
+                changes['stats'][uid] = leaf.get('stats')
+            songs, old_songs = leaf['songs'], previous_leaf['songs']
+            removed = [media_id for media_id in old_songs if media_id not in songs]
+            if removed:
+                changes['songs']['removed'][uid] = removed
+            for media_id, song in songs.items():
+                if media_id in old_songs:
+                    kind = 'changed' if old_songs[media_id] != song else None
+                else:
+                    kind = 'moved' if media_id in previous_songs else 'added'
+                if kind is not None:
+                    changes['songs'][kind].setdefault(uid, {})[media_id] = song
+        return changes
+
+    @staticmethod
+    def __apply_leaves(leaves, changes):
+        for uid in changes['removed']:
+            del leaves[uid]
+        leaves.update(changes['added'])
+        for uid, stats in changes['stats'].items():
+            leaves[uid]['stats'] = stats
+        for uid, media_ids in changes['songs']['removed'].items():
+            for media_id in media_ids:
+                del leaves[uid]['songs'][media_id]
+        for kind in ('added', 'moved', 'changed'):
+            for uid, songs in changes['songs'][kind].items():
+                leaves[uid]['songs'].update(songs)
+
+    @staticmethod
+    def __summary(patch):
+        summary = {}
+        leaves = patch.get('leaves')
+        if leaves is not None and 'replace' not in leaves:
+            summary['leaves_added'] = len(leaves['added'])
+            summary['leaves_removed'] = len(leaves['removed'])
+            summary['stats_changed'] = len(leaves['stats'])
+            for kind, songs in leaves['songs'].items():
+                summary[f"songs_{kind}"] = sum(len(values) for values in songs.values())
+        metadata = patch.get('metadata')
+        if metadata is not None and 'replace' not in metadata:
+            summary['metadata_upserted'] = len(metadata['upserted'])
+            summary['metadata_removed'] = len(metadata['removed'])
+        relations = patch.get('relations')
+        if relations is not None and 'cells' in relations:
+            summary['relations_changed'] = len(relations['cells'])
+        summary['replaced'] = [name for name in patch['target'] if 'replace' in patch.get(name, {})]
+        return summary
+
+    @staticmethod
+    def __json_ready(value):
+        # NaN is not valid JSON
+        if isinstance(value, np.ndarray):
+            return [[None if np.isnan(v) else float(v) for v in row] for row in value]
+        if isinstance(value, (float, np.floating)):
+            return None if np.isnan(value) else float(value)
+        return value
@@ -0,0 +1,153 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+
+# Import necessary libraries
+import numpy as np
+from itertools import chain
+from data_mapping.common import Mapping
+
+# Number of set bits for every byte value
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class MembershipIndex:
+    """
+    Packed bitsets mapping every leaf cluster to its member songs.
+    Bit i % 64 of word i // 64 in the row of a cluster is set if song i belongs to the cluster. Leaf clusters of the
+    same model form a group: group g covers the leaf ids groups[g][0] to groups[g][1].
+    """
+
+    def __init__(self, bitsets, media_ids, groups):
+        self.bitsets = bitsets
+        self.media_ids = media_ids
+        self.groups = groups
+
+    @staticmethod
+    def from_containing_clusters(containing_clusters, groups):
+        """
+        Build the index from the containing clusters of the metadata stage
+        :param containing_clusters: Dictionary with media ids as keys and the list of containing clusters as values
+        :type containing_clusters: dict[str, list[int]]
+        :param groups: First and last leaf id of every model, as returned by groups_from_branch_clusters
+        :type groups: list[list[int]]
+        :return: index
+        """
+        print("Build cluster membership index... ", end="")
+        media_ids = list(containing_clusters.keys())
+        clusters_per_song = list(containing_clusters.values())
+        n_per_song = np.fromiter((len(song_clusters) for song_clusters in clusters_per_song), dtype=np.int64,
+                                 count=len(clusters_per_song))
+        cluster_ids = np.fromiter(chain.from_iterable(clusters_per_song), dtype=np.int64, count=n_per_song.sum())
+        song_ids = np.repeat(np.arange(len(media_ids)), n_per_song)
+        # Set one bit per song and cluster
+        n_words = (len(media_ids) + 63) // 64
+        bitsets = np.zeros((cluster_ids.max() + 1, n_words), dtype=np.uint64)
+        np.bitwise_or.at(
+            bitsets,
+            (cluster_ids, song_ids // 64),
+            np.left_shift(np.uint64(1), (song_ids % 64).astype(np.uint64))
+        )
+        print("Done.")
+        return MembershipIndex(bitsets, media_ids, groups)
+
+    @staticmethod
+    def groups_from_branch_clusters(branch_clusters):
+        """
+        Leaf id range of every model of the branching stage, songs that are not part of every model do not shift them
+        :param branch_clusters: Branch cluster geometry of the branching stage, one child per model
+        :type branch_clusters: dict
+        :return: list with the first and last leaf id of every model
+        """
+        def leaf_uids(node):
+            if 'leaf_uid' in node:
+                return [node['leaf_uid']]
+            return list(chain.from_iterable(leaf_uids(child) for child in node.get('children', [])))
+
+        groups = []
+        for model_node in branch_clusters['children']:
+            uids = leaf_uids(model_node)
+            if uids:
+                groups.append([int(min(uids)), int(max(uids))])
+        return groups
+
+    @staticmethod
+    def load(index_file, memory_map=True):
+        """
+        Load an index stored with export
+        :param index_file: Path of the JSON index
+        :type index_file: str
+        :param memory_map: Whether to memory-map the bitsets instead of reading them into memory
+        :type memory_map: bool
+        :return: index
+        """
+        arrays, attributes = Mapping.import_arrays_from_binary(index_file, memory_map)
+        return MembershipIndex(arrays['bitsets'], attributes['media_ids'], attributes['groups'])
+
+    def export(self, output_file, index_file):
+        """
+        Store the bitsets in a binary file and media ids and groups in its JSON index
+        :param output_file: Path of the binary file
+        :type output_file: str
+        :param index_file: Path of the JSON index
+        :type index_file: str
+        """
+        Mapping.export_arrays_to_binary(
+            arrays={'bitsets': self.bitsets},
+            output_file=output_file,
+            index_file=index_file,
+            attributes={
+                'format': 'bitset',
+                'n_songs': len(self.media_ids),
+                'media_ids': self.media_ids,
+                'groups': self.groups,
+            }
+        )
+
+    def songs_in(self, *cluster_ids):
+        """
+        Intersect the member songs of the given clusters
+        :param cluster_ids: Leaf cluster ids
+        :return: bitset of the songs contained in all clusters, all songs if no cluster is given
+        """
+        # Bits above the number of songs are never set, also not for the intersection of no clusters
+        valid = np.zeros(self.bitsets.shape[1] * 64, dtype=np.uint8)
+        valid[:len(self.media_ids)] = 1
+        mask = np.packbits(valid, bitorder='little').view(np.uint64)
+        if not cluster_ids:
+            return mask
+        return np.bitwise_and.reduce(self.bitsets[list(cluster_ids)], axis=0) & mask
+
+    @staticmethod
+    def count(bitset):
+        """
+        Count the songs in a bitset or in every row of a matrix of bitsets
+        :param bitset: Bitset(s) of dtype uint64
+        :type bitset: np.ndarray
+        :return: number of songs
+        """
+        return POPCOUNT_TABLE[bitset.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+    def media_ids_of(self, bitset):
+        """
+        List the media ids of the songs in a bitset
+        :param bitset: Bitset of dtype uint64
+        :type bitset: np.ndarray
+        :return: list of media ids
+        """
+        bits = np.unpackbits(bitset.view(np.uint8), bitorder='little')[:len(self.media_ids)]
+        return [self.media_ids[i] for i in np.flatnonzero(bits)]
+
+    def distribution(self, cluster_ids, group):
+        """
+        Distribution of the songs contained in all given clusters over the leaf clusters of one group, e.g. how the
+        songs of a genre cluster and a mood cluster spread over the instrument clusters.
+        :param cluster_ids: Leaf cluster ids to intersect
+        :type cluster_ids: list[int]
+        :param group: Index of the group (model) to distribute over
+        :type group: int
+        :return: Dictionary with leaf cluster ids as keys and number of songs as values
+        """
+        first, last = self.groups[group]
+        selection = self.songs_in(*cluster_ids)
+        counts = MembershipIndex.count(self.bitsets[first:last + 1] & selection)
+        return {first + i: int(n) for i, n in enumerate(counts) if n > 0}
@@ -4,6 +4,11 @@
 # Import necessary libraries
 import pandas as pd
 import numpy as np
+from itertools import chain
+from scipy import sparse
+
+# Metadata fields whose values are replaced by references into a dictionary when interning
+INTERNED_METADATA_FIELDS = ['title', 'concert_name', 'date', 'location']
 
 
 class Preprocessor:
@@ -38,28 +43,107 @@ class Preprocessor:
 
         return clusters_per_leaf, extended_metadata_df
     
+    @staticmethod
+    def patch_metadata(previous_metadata, changed_metadata_df, changed_media_ids, media_ids):
+        """
+        Patch the metadata of a previous run with the changed songs. The result equals a full run: songs of unchanged
+        rows keep their previous metadata, songs that were deleted from the database lose it.
+        :param previous_metadata: Metadata of the previous run as exported, with media ids as keys
+        :type previous_metadata: dict
+        :param changed_metadata_df: Output of add_containing_clusters for the changed songs, covering all songs of the
+        leaf clusters
+        :type changed_metadata_df: pd.DataFrame
+        :param changed_media_ids: Media ids of the changed songs
+        :type changed_media_ids: list
+        :param media_ids: Media ids of all songs in the database
+        :type media_ids: list
+        :return: patched metadata dataframe
+        """
+        print("Patch metadata of previous run... ", end="")
+        previous_df = pd.DataFrame.from_dict(previous_metadata, orient='index', columns=['media_path', 'metadata'])
+        song_ids = changed_metadata_df.index.astype(str)
+        previous_df = previous_df.reindex(song_ids)
+        previous_df.index = changed_metadata_df.index
+        keep = ~song_ids.isin([str(media_id) for media_id in changed_media_ids]) & \
+            song_ids.isin([str(media_id) for media_id in media_ids])
+        patched_df = changed_metadata_df.copy()
+        for column in ('media_path', 'metadata'):
+            patched_df[column] = patched_df[column].astype(object).where(~keep, previous_df[column])
+        print("Done.")
+        return patched_df
+
     @staticmethod
     def calculate_cluster_relations(containing_clusters):
         print("Calculate all cluster relations... ", end="")
-        clusters_per_song = np.array(list(containing_clusters.values()))
-        # Preparation
-        n_clusters = clusters_per_song.max() - clusters_per_song.min() + 1
-        n_relations = clusters_per_song.shape[1]
-        
         # Count occurrences of songs in pairwise clusters
-        relation_matrix = np.zeros((n_clusters, n_clusters), dtype=float)
-        for song_clusters in clusters_per_song:
-            for i in range(n_relations):
-                for j in range(n_relations):
-                    relation_matrix[song_clusters[i], song_clusters[j]] += 1
+        relation_matrix = Preprocessor.count_cluster_cooccurrences(containing_clusters).toarray()
         # Now normalise it
-        relation_matrix = np.array([row / max(row) for row in relation_matrix])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            relation_matrix = relation_matrix / relation_matrix.max(axis=1, keepdims=True)
         relation_df = pd.DataFrame(relation_matrix)
         
         print("Done.")
 
         return relation_df
 
+    @staticmethod
+    def calculate_top_cluster_relations(containing_clusters, top_k):
+        """
+        Keep the top_k strongest relations of every cluster to other clusters, normalised like
+        calculate_cluster_relations, in CSR layout: the relations of cluster i are indices[indptr[i]:indptr[i + 1]]
+        with weights[indptr[i]:indptr[i + 1]], ordered by descending weight.
+        :param containing_clusters: Dictionary with media ids as keys and the list of containing clusters as values
+        :type containing_clusters: dict[str, list[int]]
+        :param top_k: Maximum number of relations per cluster
+        :type top_k: int
+        :return: Dictionary with the arrays indptr, indices and weights
+        """
+        print(f"Calculate top {top_k} relations per cluster... ", end="")
+        cooccurrences = Preprocessor.count_cluster_cooccurrences(containing_clusters).tocoo()
+        n_clusters = cooccurrences.shape[0]
+        row_max = np.zeros(n_clusters)
+        np.maximum.at(row_max, cooccurrences.row, cooccurrences.data)
+        # Relations of a cluster to itself are always 1.0 and therefore omitted
+        off_diagonal = cooccurrences.row != cooccurrences.col
+        rows = cooccurrences.row[off_diagonal]
+        columns = cooccurrences.col[off_diagonal]
+        weights = cooccurrences.data[off_diagonal] / row_max[rows]
+        # Order by cluster, then by descending weight and keep the first top_k entries of every cluster
+        order = np.lexsort((columns, -weights, rows))
+        rows, columns, weights = rows[order], columns[order], weights[order]
+        row_starts = np.searchsorted(rows, np.arange(n_clusters))
+        keep = np.arange(rows.shape[0]) - row_starts[rows] < top_k
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(rows[keep], minlength=n_clusters))))
+        print("Done.")
+        return {
+            'indptr': indptr.astype(np.uint32),
+            'indices': columns[keep].astype(np.uint32),
+            'weights': weights[keep].astype(np.float32),
+        }
+
+    @staticmethod
+    def count_cluster_cooccurrences(containing_clusters):
+        """
+        Count the songs shared by every pair of clusters as M.T @ M of the sparse song x cluster incidence matrix M.
+        The diagonal holds the number of songs per cluster.
+        :param containing_clusters: Dictionary with media ids as keys and the list of containing clusters as values
+        :type containing_clusters: dict[str, list[int]]
+        :return: Sparse matrix of shape (number of clusters, number of clusters)
+        :rtype: sparse.csr_matrix
+        """
+        clusters_per_song = list(containing_clusters.values())
+        n_per_song = np.fromiter((len(song_clusters) for song_clusters in clusters_per_song), dtype=np.int64,
+                                 count=len(clusters_per_song))
+        cluster_ids = np.fromiter(chain.from_iterable(clusters_per_song), dtype=np.int64, count=n_per_song.sum())
+        song_ids = np.repeat(np.arange(len(clusters_per_song)), n_per_song)
+        # Preparation
+        n_clusters = cluster_ids.max() - cluster_ids.min() + 1
+        incidence = sparse.csr_matrix(
+            (np.ones(cluster_ids.shape[0], dtype=float), (song_ids, cluster_ids)),
+            shape=(len(clusters_per_song), n_clusters)
+        )
+        return (incidence.T @ incidence).tocsr()
+
     @staticmethod
     def append_stats_to_leaf_clusters(leaf_cluster_geometry_dict):
         print("Appending statistics to all leaf clusters... ", end="")
@@ -94,3 +178,57 @@ class Preprocessor:
         print("Done.")
 
         return leaf_cluster_extended_dict
+
+    @staticmethod
+    def intern_metadata(metadata_df):
+        """
+        Dictionary-encode the metadata of all songs: repeated strings (concert names, locations, dates, musicians, ...)
+        are stored once per field in a dictionary and referenced by their position, -1 stands for missing values.
+        Songs are stored column-wise in the order of metadata_df, musicians as one flat list with offsets per song.
+        :param metadata_df: Metadata dataframe with media_id as index and media_path, metadata and clusters as columns
+        :type metadata_df: pd.DataFrame
+        :return: Dictionary with the dictionaries per field and the song columns
+        """
+        print("Intern song metadata... ", end="")
+        metadata = pd.DataFrame(
+            [row if isinstance(row, dict) else {} for row in metadata_df['metadata']],
+            columns=INTERNED_METADATA_FIELDS + ['dates', 'duration', 'musicians']
+        )
+        dictionaries = {}
+        songs = {
+            'media_id': [str(media_id) for media_id in metadata_df.index],
+            'media_path': Preprocessor.__none_for_missing(metadata_df['media_path']),
+        }
+        for field in INTERNED_METADATA_FIELDS:
+            codes, uniques = pd.factorize(metadata[field])
+            dictionaries[field] = uniques.tolist()
+            songs[field] = codes.tolist()
+        # Localized dates share the references of the date field: one dictionary per language
+        date_codes = np.array(songs['date'], dtype=np.int64)
+        if metadata['dates'].notna().any():
+            _, first_rows = np.unique(date_codes, return_index=True)
+            first_dates = [metadata['dates'].iat[row] for row, code in zip(first_rows, np.unique(date_codes))
+                           if code >= 0]
+            languages = first_dates[0].keys() if first_dates else []
+            dictionaries['dates'] = {language: [dates[language] for dates in first_dates] for language in languages}
+        songs['duration'] = Preprocessor.__none_for_missing(metadata['duration'])
+        # Musicians are lists: intern every musician on its own and store the references of all songs in one list,
+        # the musicians of song i are musicians[musicians_offsets[i]:musicians_offsets[i + 1]]
+        musicians_per_song = [musicians if isinstance(musicians, list) else [] for musicians in metadata['musicians']]
+        codes, uniques = pd.factorize(pd.Series(list(chain.from_iterable(musicians_per_song)), dtype=object))
+        dictionaries['musicians'] = uniques.tolist()
+        songs['musicians'] = codes.tolist()
+        songs['musicians_offsets'] = np.cumsum([0] + [len(musicians) for musicians in musicians_per_song]).tolist()
+        if 'clusters' in metadata_df.columns:
+            songs['clusters'] = [clusters if isinstance(clusters, list) else [] for clusters in metadata_df['clusters']]
+        print("Done.")
+        return {
+            'version': 1,
+            'dictionaries': dictionaries,
+            'songs': songs,
+        }
+
+    @staticmethod
+    def __none_for_missing(series):
+        # NaN is not valid JSON
+        return series.astype(object).where(series.notna(), None).tolist()
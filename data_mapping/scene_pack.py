@@ -0,0 +1,249 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+
+# Import necessary libraries
+import json
+import numpy as np
+from helpers.file_handler import FileHandler
+from helpers.errors import InvalidScenePackException
+
+# File layout:
+# header | offset table (one entry per section) | sections, each aligned to SECTION_ALIGNMENT bytes
+SCENE_PACK_MAGIC = b"SNKPACK"
+SCENE_PACK_VERSION = 1
+SECTION_ALIGNMENT = 64
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('n_sections', '<u4'),
+    ('table_offset', '<u8'),
+    ('reserved', '<u8'),
+])
+TABLE_ENTRY_DTYPE = np.dtype([
+    ('name', 'S24'),
+    ('dtype', 'S8'),
+    ('offset', '<u8'),
+    ('nbytes', '<u8'),
+    ('rows', '<u8'),
+    ('cols', '<u8'),
+])
+
+# Fixed column order of the float sections
+BRANCH_PARAMS = ['length', 'start_tangent.X', 'start_tangent.Y', 'start_tangent.Z', 'end_tangent.X',
+                 'end_tangent.Y', 'end_tangent.Z', 'start_width', 'end_width', 'rot_y', 'rot_z', 'rot_children']
+METADATA_FIELDS = ['title', 'concert_name', 'date', 'location', 'duration', 'musicians']
+
+
+class ScenePack:
+    """
+    Single binary container of everything the immersive client loads at startup: the branch tree, the leaf geometry
+    as float32 arrays, the song metadata as indices into one string table and the cluster relations.
+    A header and an offset table with name, dtype, byte offset and shape of every section precede the sections, so
+    that any section can be memory-mapped without parsing the rest of the file. Strings are stored once in
+    string_data and referenced by their index into string_offsets (-1 if missing).
+    """
+
+    def __init__(self, sections, attributes):
+        self.sections = sections
+        self.attributes = attributes
+
+    @staticmethod
+    def from_collections(branch_clusters, leaf_clusters, song_metadata=None, cluster_relations=None):
+        """
+        Build the scene pack from the outputs of the branching, metadata and preprocess stages
+        :param branch_clusters: Branch tree as exported by the branching stage
+        :type branch_clusters: dict
+        :param leaf_clusters: Leaf clusters with stats as exported by the branching stage
+        :type leaf_clusters: dict
+        :param song_metadata: Song metadata as exported by the metadata stage
+        :type song_metadata: dict | None
+        :param cluster_relations: Cluster relation matrix of the preprocess stage
+        :type cluster_relations: pd.DataFrame | np.ndarray | None
+        :return: scene pack
+        """
+        print("Build scene pack... ", end="")
+        strings = {}
+
+        def intern(value):
+            if value is None:
+                return -1
+            if not isinstance(value, str):
+                value = json.dumps(value)
+            return strings.setdefault(value, len(strings))
+
+        sections = {}
+        attributes = {
+            'branch_params': BRANCH_PARAMS,
+            'metadata_fields': METADATA_FIELDS,
+        }
+        # Branch tree in depth-first order, parents precede their children
+        parents, elements, leaf_uids, metadata, params = [], [], [], [], []
+        stack = [(branch_clusters, -1)]
+        while stack:
+            node, parent = stack.pop()
+            parents.append(parent)
+            elements.append(node.get('elements', -1))
+            leaf_uids.append(node.get('leaf_uid', -1))
+            metadata.append(intern(node.get('metadata')))
+            node_params = node.get('params', {})
+            params.append([
+                ScenePack.__nested_value(node_params, name) for name in BRANCH_PARAMS
+            ])
+            node_index = len(parents) - 1
+            stack.extend((child, node_index) for child in reversed(node.get('children', [])))
+        sections['branch_parent'] = np.array(parents, dtype=np.int32)
+        sections['branch_elements'] = np.array(elements, dtype=np.int32)
+        sections['branch_leaf_uid'] = np.array(leaf_uids, dtype=np.int32)
+        sections['branch_metadata'] = np.array(metadata, dtype=np.int32)
+        sections['branch_params'] = np.array(params, dtype=np.float32).reshape(-1, len(BRANCH_PARAMS))
+
+        # Leaf geometry: songs of leaf i are the rows leaf_song_offsets[i] to leaf_song_offsets[i + 1]
+        stats_names = sorted({name for leaf in leaf_clusters.values() for name in leaf.get('stats', {})})
+        attributes['leaf_stats'] = stats_names
+        leaf_offsets = [0]
+        media_ids, geometry, features, stats = [], [], [], []
+        for leaf in leaf_clusters.values():
+            songs = leaf['songs'] if 'songs' in leaf else leaf
+            for media_id, song in songs.items():
+                media_ids.append(intern(str(media_id)))
+                geometry.append((song['geometry']['X'], song['geometry']['Y'], song['geometry']['Z']))
+                features.append(intern(song.get('features')))
+            leaf_offsets.append(len(media_ids))
+            stats.append([leaf.get('stats', {}).get(name, np.nan) for name in stats_names])
+        sections['leaf_uid'] = np.array([int(leaf_uid) for leaf_uid in leaf_clusters.keys()], dtype=np.int32)
+        sections['leaf_song_offsets'] = np.array(leaf_offsets, dtype=np.uint32)
+        sections['leaf_stats'] = np.array(stats, dtype=np.float32).reshape(-1, len(stats_names))
+        sections['song_media_id'] = np.array(media_ids, dtype=np.int32)
+        sections['song_geometry'] = np.array(geometry, dtype=np.float32).reshape(-1, 3)
+        sections['song_features'] = np.array(features, dtype=np.int32)
+
+        if song_metadata is not None:
+            # The metadata stage exports the songs keyed by media_id
+            media_ids = [str(row.get('media_id', media_id)) for media_id, row in song_metadata.items()]
+            rows = list(song_metadata.values())
+            n_models = max((len(row.get('clusters') or []) for row in rows), default=0)
+            clusters = np.full((len(rows), n_models), -1, dtype=np.int32)
+            for i, row in enumerate(rows):
+                row_clusters = row.get('clusters') or []
+                clusters[i, :len(row_clusters)] = row_clusters
+            sections['metadata_media_id'] = np.array([intern(media_id) for media_id in media_ids], dtype=np.int32)
+            sections['metadata_media_path'] = np.array([intern(row.get('media_path')) for row in rows],
+                                                       dtype=np.int32)
+            sections['metadata_fields'] = np.array(
+                [[intern((row.get('metadata') or {}).get(name)) for name in METADATA_FIELDS] for row in rows],
+                dtype=np.int32
+            ).reshape(-1, len(METADATA_FIELDS))
+            sections['metadata_clusters'] = clusters
+
+        if cluster_relations is not None:
+            sections['relations'] = np.asarray(cluster_relations, dtype=np.float32)
+
+        # String table
+        encoded = [value.encode() for value in strings.keys()]
+        string_offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+        np.cumsum([len(value) for value in encoded], out=string_offsets[1:])
+        sections['string_offsets'] = string_offsets
+        sections['string_data'] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        sections['attributes'] = np.frombuffer(json.dumps(attributes).encode(), dtype=np.uint8)
+        print("Done.")
+        return ScenePack(sections, attributes)
+
+    @staticmethod
+    def load(pack_file, memory_map=True):
+        """
+        Open a scene pack stored with export
+        :param pack_file: Path of the scene pack
+        :type pack_file: str
+        :param memory_map: Whether to memory-map the sections instead of reading them into memory
+        :type memory_map: bool
+        :return: scene pack
+        """
+        if memory_map:
+            buffer = np.memmap(pack_file, dtype=np.uint8, mode='r')
+        else:
+            buffer = np.fromfile(pack_file, dtype=np.uint8)
+        header = buffer[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        if header['magic'] != SCENE_PACK_MAGIC:
+            raise InvalidScenePackException(pack_file, "missing magic number")
+        if header['version'] > SCENE_PACK_VERSION:
+            raise InvalidScenePackException(pack_file, f"version {header['version']} is not supported")
+        table_start = int(header['table_offset'])
+        table_end = table_start + int(header['n_sections']) * TABLE_ENTRY_DTYPE.itemsize
+        table = buffer[table_start:table_end].view(TABLE_ENTRY_DTYPE)
+        sections = {}
+        for entry in table:
+            offset = int(entry['offset'])
+            section = buffer[offset:offset + int(entry['nbytes'])].view(np.dtype(entry['dtype'].decode()))
+            if entry['cols'] > 0:
+                section = section.reshape(int(entry['rows']), int(entry['cols']))
+            sections[entry['name'].decode()] = section
+        attributes = json.loads(sections['attributes'].tobytes())
+        return ScenePack(sections, attributes)
+
+    def export(self, output_file):
+        """
+        Store the scene pack in a single binary file
+        :param output_file: Path of the scene pack
+        :type output_file: str
+        """
+        FileHandler.create_folders_if_not_exists(output_file)
+        table = np.zeros(len(self.sections), dtype=TABLE_ENTRY_DTYPE)
+        offset = ScenePack.__align(HEADER_DTYPE.itemsize + table.nbytes)
+        arrays = []
+        for i, (name, array) in enumerate(self.sections.items()):
+            array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+            table[i] = (
+                name.encode(),
+                array.dtype.str.encode(),
+                offset,
+                array.nbytes,
+                array.shape[0],
+                array.shape[1] if array.ndim == 2 else 0
+            )
+            arrays.append((offset, array))
+            offset = ScenePack.__align(offset + array.nbytes)
+        header = np.array([(SCENE_PACK_MAGIC, SCENE_PACK_VERSION, len(self.sections), HEADER_DTYPE.itemsize, 0)],
+                          dtype=HEADER_DTYPE)
+        with open(output_file, 'wb') as file:
+            file.write(header.tobytes())
+            file.write(table.tobytes())
+            for array_offset, array in arrays:
+                file.write(b"\0" * (array_offset - file.tell()))
+                file.write(array.tobytes())
+
+    def string(self, index):
+        """
+        Read one string of the string table
+        :param index: Index into the string table
+        :type index: int
+        :return: string, None for -1
+        """
+        if index < 0:
+            return None
+        start, end = self.sections['string_offsets'][index:index + 2]
+        return self.sections['string_data'][int(start):int(end)].tobytes().decode()
+
+    def leaf(self, position):
+        """
+        Read the songs of one leaf cluster
+        :param position: Position of the leaf in the leaf_uid section
+        :type position: int
+        :return: media ids, geometry view of shape (number of songs, 3) and feature strings
+        """
+        start, end = (int(i) for i in self.sections['leaf_song_offsets'][position:position + 2])
+        media_ids = [self.string(i) for i in self.sections['song_media_id'][start:end]]
+        features = [self.string(i) for i in self.sections['song_features'][start:end]]
+        return media_ids, self.sections['song_geometry'][start:end], features
+
+    @staticmethod
+    def __nested_value(params, name):
+        value = params
+        for key in name.split("."):
+            if not isinstance(value, dict) or key not in value:
+                return np.nan
+            value = value[key]
+        return value
+
+    @staticmethod
+    def __align(offset):
+        return -(-offset // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
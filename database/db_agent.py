@@ -6,6 +6,7 @@ from database.postgres_db import Database
 from database.query_factory import QueryFactory
 from helpers.timer import Timer
 from helpers.io_handler import IOHandler, Color
+from helpers.tracing import Tracer
 
 
 class DBAgent:
@@ -53,6 +54,30 @@ class DBAgent:
         query = QueryFactory.fetch_all_metadata()
         return self.__fetch_all_to_dataframe(query, batch_size, limit)
     
+    def fetch_metadata_since_to_dataframe(self, watermark_column=None, watermark=None, batch_size=10000, limit=None):
+        query = QueryFactory.fetch_metadata_since(watermark_column, watermark)
+        return self.__fetch_all_to_dataframe(query, batch_size, limit)
+
+    def fetch_feature_fingerprints(self):
+        query = QueryFactory.fetch_feature_fingerprints()
+        fingerprints = {}
+        for row in self.database.fetch_all(query):
+            entry = fingerprints.setdefault(row['media_path'], {'media_id': row['media_id'], 'fingerprints': {}})
+            entry['fingerprints'][row['model_name']] = row['fingerprint']
+        return fingerprints
+
+    def fetch_media_durations(self):
+        query = QueryFactory.fetch_media_durations()
+        return {row['media_path']: row['duration'] for row in self.database.fetch_all(query)}
+
+    def fetch_all_media_ids(self):
+        query = QueryFactory.fetch_all_media_ids()
+        return [row['media_id'] for row in self.database.fetch_all(query)]
+
+    def check_if_feature_column_exists(self, key):
+        query = QueryFactory.feature_column_exists(key)
+        return self.database.fetch_one(query)['present']
+
     # Read Helpers
     def __fetch_all_to_dataframe(self, query, batch_size, limit):
         df = pd.DataFrame()
@@ -88,13 +113,22 @@ class DBAgent:
 
     def add_feature_entry(self, feature):
         (query, values) = QueryFactory.add_feature_entry(feature)
-        (success, message) = self.database.execute(query, values)
+        with Tracer.span("db_write", media_id=feature.get('media_id'), model=feature.get('model_name')):
+            (success, message) = self.database.execute(query, values)
         if not success:
             IOHandler.print_color(message=f"ERROR: {message}", color=Color.RED)
         return success
 
     def update_feature_entry_for(self, feature, model_name, media_id):
         (query, values) = QueryFactory.update_feature_entry_for(feature, model_name, media_id)
+        with Tracer.span("db_write", media_id=media_id, model=model_name):
+            (success, message) = self.database.execute(query, values)
+        if not success:
+            IOHandler.print_color(message=f"ERROR: {message}", color=Color.RED)
+        return success
+
+    def update_fingerprint_for(self, fingerprint, media_id):
+        (query, values) = QueryFactory.update_fingerprint_for(fingerprint, media_id)
         (success, message) = self.database.execute(query, values)
         if not success:
             IOHandler.print_color(message=f"ERROR: {message}", color=Color.RED)
@@ -78,6 +78,75 @@ class QueryFactory:
                 "'musicians', metadata->'musicians'"
                 f") AS metadata FROM {TABLE_MEDIA} ORDER BY media_id")
 
+    @staticmethod
+    def fetch_metadata_since(watermark_column=None, watermark=None):
+        """
+        Same as fetch_all_metadata plus a watermark column, restricted to rows whose watermark is greater than the given
+        one. The watermark is the transaction id of the last change (xmin) or the given column, e.g. updated_at.
+        xmin misses rows of transactions that were still open at the previous read and wraps around, prefer a column.
+        """
+        if watermark_column:
+            watermark_expression = sql.Identifier(watermark_column)
+        else:
+            watermark_expression = sql.SQL("xmin::text::bigint")
+        if watermark is None:
+            condition = sql.SQL("")
+        else:
+            condition = sql.SQL(" WHERE {watermark} > {value}").format(
+                watermark=watermark_expression,
+                value=sql.Literal(watermark)
+            )
+        return sql.SQL(
+            "SELECT media_id, media_path, json_build_object("
+            "'title', metadata->'title',"
+            "'concert_name', metadata->'concert_name',"
+            "'date', (metadata->>'date')::date,"
+            "'location', metadata->'location',"
+            "'duration', (media_info->>'duration')::float,"
+            "'musicians', metadata->'musicians'"
+            ") AS metadata, {watermark} AS watermark FROM {table}{condition} ORDER BY media_id"
+        ).format(
+            watermark=watermark_expression,
+            table=sql.Identifier(TABLE_MEDIA),
+            condition=condition
+        )
+
+    @staticmethod
+    def fetch_feature_fingerprints():
+        return sql.SQL(
+            "SELECT m.{path} AS media_path, f.{media_id} AS media_id, f.{model_name} AS model_name, "
+            "f.{fingerprint} AS fingerprint "
+            "FROM {features} f JOIN {media} m ON m.media_id = f.{media_id}"
+        ).format(
+            path=sql.Identifier(TABLE_MEDIA_KEYS['path_to_file']),
+            media_id=sql.Identifier(TABLE_FEATURES_KEYS['media_id']),
+            model_name=sql.Identifier(TABLE_FEATURES_KEYS['model_name']),
+            fingerprint=sql.Identifier(TABLE_FEATURES_KEYS['fingerprint']),
+            features=sql.Identifier(TABLE_FEATURES),
+            media=sql.Identifier(TABLE_MEDIA),
+        )
+
+    @staticmethod
+    def fetch_media_durations():
+        return sql.SQL("SELECT {path} AS media_path, (media_info->>'duration')::float AS duration FROM {table}").format(
+            path=sql.Identifier(TABLE_MEDIA_KEYS['path_to_file']),
+            table=sql.Identifier(TABLE_MEDIA),
+        )
+
+    @staticmethod
+    def fetch_all_media_ids():
+        return sql.SQL("SELECT media_id FROM {table}").format(table=sql.Identifier(TABLE_MEDIA))
+
+    @staticmethod
+    def feature_column_exists(key):
+        return sql.SQL(
+            "SELECT COUNT(*) > 0 AS present FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = {table} AND column_name = {column}"
+        ).format(
+            table=sql.Literal(TABLE_FEATURES),
+            column=sql.Literal(TABLE_FEATURES_KEYS[key]),
+        )
+
     # *************************
     # Calculate
     # **************************
@@ -117,6 +186,17 @@ class QueryFactory:
         )
         return query, query_values
     
+    @staticmethod
+    def update_fingerprint_for(fingerprint, media_id):
+        query = sql.SQL("UPDATE {table} SET {fingerprint} = {value} WHERE {key} = {media_id}").format(
+            table=sql.Identifier(TABLE_FEATURES),
+            fingerprint=sql.Identifier(TABLE_FEATURES_KEYS['fingerprint']),
+            value=sql.Placeholder(),
+            key=sql.Identifier(TABLE_FEATURES_KEYS['media_id']),
+            media_id=media_id
+        )
+        return query, [Jsonb(fingerprint)]
+
     # *************************
     # Internal helper functions
     # **************************
@@ -0,0 +1,147 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+
+import os
+import json
+import base64
+import numpy as np
+from helpers.file_handler import FileHandler
+
+AUDIO_FINGERPRINT_SAMPLE_RATE = 16000
+FRAME_SIZE = 4096
+HOP_SIZE = 2048
+# 16 log-spaced bands between 100 Hz and 7 kHz
+BAND_EDGES = np.geomspace(100, 7000, 17)
+DYNAMIC_RANGE_DB = 60
+MAX_FRAME_SHIFT = 2
+
+
+class AudioFingerprint:
+    """
+    Coarse spectral envelope of the first minute of a recording: the energy of 16 bands every 128 ms, in dB relative to
+    the loudest band and quantized to one byte. Decoding the same performance from a re-export gives nearly the same
+    envelope, also with a different gain or encoder delay, while different recordings are only weakly correlated.
+    """
+
+    def __init__(self, envelope, duration):
+        self.envelope = envelope
+        self.duration = duration
+
+    @staticmethod
+    def from_audio(audio, sample_rate=AUDIO_FINGERPRINT_SAMPLE_RATE, seconds=60):
+        """
+        Compute the fingerprint of a mono signal
+        :param audio: Audio signal
+        :type audio: np.ndarray
+        :param sample_rate: Sample rate of the signal
+        :type sample_rate: int
+        :param seconds: Length of the fingerprinted part at the start of the signal
+        :type seconds: float
+        :return: fingerprint
+        """
+        duration = len(audio) / sample_rate
+        signal = np.asarray(audio[:int(seconds * sample_rate)], dtype=np.float32)
+        n_bands = len(BAND_EDGES) - 1
+        if len(signal) < FRAME_SIZE:
+            return AudioFingerprint(np.zeros((0, n_bands), dtype=np.uint8), duration)
+        frames = np.lib.stride_tricks.sliding_window_view(signal, FRAME_SIZE)[::HOP_SIZE]
+        spectrum = np.abs(np.fft.rfft(frames * np.hanning(FRAME_SIZE).astype(np.float32), axis=1)) ** 2
+        band_index = np.searchsorted(BAND_EDGES, np.fft.rfftfreq(FRAME_SIZE, 1 / sample_rate), side='right') - 1
+        in_bands = (band_index >= 0) & (band_index < n_bands)
+        energies = np.zeros((spectrum.shape[0], n_bands), dtype=np.float64)
+        np.add.at(energies.T, band_index[in_bands], spectrum[:, in_bands].T)
+        decibels = 10 * np.log10(energies + 1e-10)
+        decibels = np.clip(decibels - decibels.max() + DYNAMIC_RANGE_DB, 0, DYNAMIC_RANGE_DB)
+        return AudioFingerprint(np.round(decibels * 255 / DYNAMIC_RANGE_DB).astype(np.uint8), duration)
+
+    def similarity(self, other):
+        """
+        Correlation of two envelopes, maximised over small frame shifts for encoder delays
+        :param other: Fingerprint to compare with
+        :type other: AudioFingerprint
+        :return: correlation between -1 and 1
+        """
+        best = -1.0
+        for shift in range(-MAX_FRAME_SHIFT, MAX_FRAME_SHIFT + 1):
+            a = self.envelope[max(shift, 0):]
+            b = other.envelope[max(-shift, 0):]
+            n = min(len(a), len(b))
+            if n == 0:
+                continue
+            a = a[:n].astype(np.float64) - a[:n].mean()
+            b = b[:n].astype(np.float64) - b[:n].mean()
+            norm = np.sqrt((a * a).sum() * (b * b).sum())
+            if norm > 0:
+                best = max(best, float((a * b).sum() / norm))
+        return best
+
+    def to_dict(self):
+        return {'duration': self.duration, 'envelope': base64.b64encode(self.envelope.tobytes()).decode()}
+
+    @staticmethod
+    def from_dict(values):
+        envelope = np.frombuffer(base64.b64decode(values['envelope']), dtype=np.uint8)
+        return AudioFingerprint(envelope.reshape(-1, len(BAND_EDGES) - 1), values['duration'])
+
+
+class AudioFingerprintIndex:
+    """
+    Audio fingerprints of all tagged recordings, appended to a JSON lines file with one {media_id, duration, envelope}
+    object per line. Candidates for a match are looked up by duration first.
+    """
+
+    def __init__(self, index_file, seconds=60, min_similarity=0.9, duration_tolerance=1.0):
+        self.index_file = index_file
+        self.seconds = seconds
+        self.min_similarity = min_similarity
+        self.duration_tolerance = duration_tolerance
+        self.fingerprints = {}
+        self.by_duration = {}
+        if os.path.exists(index_file):
+            with open(index_file, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.__add(entry['media_id'], AudioFingerprint.from_dict(entry))
+
+    def find(self, fingerprint, exclude=None):
+        """
+        Find a tagged recording identical to the given one
+        :param fingerprint: Fingerprint of the recording, computed over the first index.seconds seconds
+        :type fingerprint: AudioFingerprint
+        :param exclude: Media id to ignore, e.g. the recording itself
+        :type exclude: str | None
+        :return: media id and similarity of the best match, (None, None) if there is none
+        """
+        best_media_id, best_similarity = None, None
+        first = int(np.floor(fingerprint.duration - self.duration_tolerance))
+        last = int(np.floor(fingerprint.duration + self.duration_tolerance))
+        for bucket in range(first, last + 1):
+            for media_id in self.by_duration.get(bucket, []):
+                candidate = self.fingerprints[media_id]
+                if media_id == exclude or abs(candidate.duration - fingerprint.duration) > self.duration_tolerance:
+                    continue
+                similarity = fingerprint.similarity(candidate)
+                if similarity >= self.min_similarity and (best_similarity is None or similarity > best_similarity):
+                    best_media_id, best_similarity = media_id, similarity
+        return best_media_id, best_similarity
+
+    def add(self, media_id, fingerprint):
+        """
+        Register the fingerprint of a tagged recording, replacing an earlier one of the same media id
+        :param media_id: Media id of the recording
+        :type media_id: str
+        :param fingerprint: Fingerprint of the recording
+        :type fingerprint: AudioFingerprint
+        """
+        self.__add(media_id, fingerprint)
+        FileHandler.create_folders_if_not_exists(self.index_file)
+        with open(self.index_file, 'a') as f:
+            f.write(json.dumps({'media_id': media_id, **fingerprint.to_dict()}) + "\n")
+
+    def __add(self, media_id, fingerprint):
+        # Later lines of the file replace earlier ones
+        if media_id in self.fingerprints:
+            self.by_duration[int(np.floor(self.fingerprints[media_id].duration))].remove(media_id)
+        self.fingerprints[media_id] = fingerprint
+        self.by_duration.setdefault(int(np.floor(fingerprint.duration)), []).append(media_id)
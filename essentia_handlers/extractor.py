@@ -3,14 +3,18 @@
 
 import csv
 import os
-import matplotlib.pyplot as plt
 from helpers.timer import Timer
 from helpers.file_handler import FileHandler
 from helpers.io_handler import IOHandler, Color
 from helpers.errors import NoAudioException
+from helpers.lazy_import import LazyImport
+from helpers.tracing import Tracer
 from models.models import Model
 import numpy as np
 
+# Loaded on first use, only taggers that plot need matplotlib
+plt = LazyImport("matplotlib.pyplot")
+
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
 # Define window size for max-pooling
@@ -154,7 +158,8 @@ class Extractor:
     def __get_activations_max_pooling(self, model: Model):
         if not self.__feature_exists(model, 'max-pooling'):
             activations = self.__get_activations(model)
-            self.features[model.shortname]['max-pooling'] = Extractor.apply_max_pooling(activations)
+            with Tracer.span("pool", media_id=self.media.media_id, model=model.shortname):
+                self.features[model.shortname]['max-pooling'] = Extractor.apply_max_pooling(activations)
         return self.features[model.shortname]['max-pooling']
 
     def __get_activations_max_pooling_means(self, model: Model):
@@ -173,7 +178,9 @@ class Extractor:
         if ems and ems in self.embeddings.keys():
             IOHandler.print_color(f"Saving time for {ems}", color=Color.YELLOW)
             cached_embeddings = self.embeddings[ems]
-        predictions, embeddings = model.extract_features_from(self.media, cached_embeddings)
+        with Tracer.span(f"infer[{model.shortname}]", media_id=self.media.media_id,
+                         audio_seconds=self.media.get_duration_secs(), cached_embeddings=cached_embeddings is not None):
+            predictions, embeddings = model.extract_features_from(self.media, cached_embeddings)
         if ems:
             self.embeddings[ems] = embeddings
         return predictions
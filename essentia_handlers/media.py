@@ -3,14 +3,18 @@
 
 import os
 import errno
-import essentia.standard as es
-import matplotlib.pyplot as plt
 import numpy as np
 from helpers.timer import Timer
 from helpers.file_handler import FileHandler
 from helpers.converter import Converter
 from helpers.io_handler import IOHandler, Color
 from helpers.errors import NoAudioException
+from helpers.lazy_import import LazyImport
+from helpers.tracing import Tracer
+
+# Loaded on first use: essentia pulls in TensorFlow, matplotlib is only needed for plots
+es = LazyImport("essentia.standard")
+plt = LazyImport("matplotlib.pyplot")
 
 
 class Media:
@@ -92,7 +96,9 @@ class Media:
             raise OSError(errno.ENOENT, "File not found", self.media_file_path)
         self.timer.reset()
         try:
-            audio_signal = es.MonoLoader(sampleRate=sample_rate, filename=self.media_file_path)()
+            with Tracer.span("decode", media_id=self.media_id, sample_rate=sample_rate):
+                audio_signal = es.MonoLoader(sampleRate=sample_rate, filename=self.media_file_path)()
+                Tracer.set_attributes(audio_seconds=len(audio_signal) / sample_rate)
             # Verify that audio signal is not null
             if audio_signal.any():
                 self.audio[sample_rate] = audio_signal
@@ -4,16 +4,25 @@
 import os
 from essentia_handlers.media import Media
 from essentia_handlers.extractor import Extractor
+from essentia_handlers.audio_fingerprint import AudioFingerprint, AudioFingerprintIndex, AUDIO_FINGERPRINT_SAMPLE_RATE
 from database.db_agent import DBAgent
 from models.models import Model
 from abc import ABC, abstractmethod
 from helpers.timer import Timer
 from helpers.io_handler import IOHandler, Color
 from helpers.logger import Logger
+from helpers.tracing import Tracer
 from helpers.errors import NoAudioException, UnknownTaggerException
 
 
+# Columns copied from the feature rows of an identical recording
+REUSED_FEATURE_KEYS = ['feature_type', 'version', 'model_name', 'model_params', 'data']
+
+
 class Tagger(ABC):
+    # Models whose features process_song writes to the database, used for change detection and deduplication
+    db_model_names = []
+
     def __init__(self):
         self.media_file_path = None
         self.media = None
@@ -23,6 +32,10 @@ class Tagger(ABC):
         self.extractor = None
         self.output_folder = None
         self.logger = None
+        self.fingerprint = None
+        self.replace_features = False
+        self.fingerprint_index = None
+        self.audio_fingerprint = None
     
     @staticmethod
     def get_instance(tagger_type: str) -> 'Tagger':
@@ -44,13 +57,16 @@ class Tagger(ABC):
     def process_song(self, **kwargs):
         pass
     
-    def init(self, media_file_path: str, media_data: dict, output_folder: str, db_agent: DBAgent):
+    def init(self, media_file_path: str, media_data: dict, output_folder: str, db_agent: DBAgent,
+             fingerprint: dict = None, replace_features=False):
         """
         Define behaviour of and attach data to the tagger
         :param media_file_path: Path to media file that will be examined
         :param media_data: Metadata for embedded media, received from database query
         :param output_folder: Path to folder where output data shall be stored
         :param db_agent: Database agent that handles queries
+        :param fingerprint: Fingerprint of the media file, stored alongside the features
+        :param replace_features: If set to True, the media file changed and existing features are replaced
         """
         self.media_file_path = media_file_path
         self.media = Media(media_data, media_file_path)
@@ -58,6 +74,9 @@ class Tagger(ABC):
         self.ml_models_dict = {}
         self.db_agent = db_agent
         self.extractor = Extractor(self.media)
+        self.fingerprint = fingerprint
+        self.replace_features = replace_features
+        self.audio_fingerprint = None
         self.output_folder = os.path.join(output_folder, os.path.dirname(media_data['media_path']),
                                           self.media.media_id, "./")
 
@@ -68,6 +87,62 @@ class Tagger(ABC):
         """
         self.logger = logger
 
+    def attach_fingerprint_index(self, fingerprint_index: AudioFingerprintIndex):
+        """
+        Attach the audio fingerprints of tagged recordings in order to reuse the features of identical recordings
+        :param fingerprint_index: Audio fingerprint index to look up and register recordings
+        """
+        self.fingerprint_index = fingerprint_index
+
+    def reuse_features_of_identical_recording(self) -> bool:
+        """
+        Copy the database features of an already tagged recording of the same performance, e.g. a re-export under
+        another media path, instead of extracting them again. The copied rows name the source media id and the
+        similarity in model_params.reused_from. The audio is decoded with the sample rate of the models,
+        so the decode is reused for the extraction if no identical recording is found.
+        :return: True if the features were reused
+        """
+        if self.fingerprint_index is None or not self.db_model_names:
+            return False
+        try:
+            audio = self.media.get_audio_version(AUDIO_FINGERPRINT_SAMPLE_RATE)
+        except (OSError, NoAudioException):
+            return False
+        with Tracer.span("fingerprint", media_id=self.media.media_id):
+            self.audio_fingerprint = AudioFingerprint.from_audio(audio, AUDIO_FINGERPRINT_SAMPLE_RATE,
+                                                                 self.fingerprint_index.seconds)
+            media_id, similarity = self.fingerprint_index.find(self.audio_fingerprint, exclude=self.media.media_id)
+        if media_id is None:
+            return False
+        rows = {row['model_name']: row for row in self.db_agent.fetch_feature_entries_for_media(media_id)}
+        model_names = [self.attach_model(name).display_name for name in self.db_model_names]
+        if any(name not in rows for name in model_names):
+            return False
+        for model_name in model_names:
+            feature = {key: rows[model_name][key] for key in REUSED_FEATURE_KEYS}
+            feature['media_id'] = self.media.media_id
+            # Record the source of the copy, so reused rows can be audited and deleted to extract them again
+            feature['model_params'] = {**(feature['model_params'] or {}),
+                                       'reused_from': {'media_id': media_id, 'similarity': round(similarity, 4)}}
+            if self.fingerprint is not None:
+                feature['fingerprint'] = self.fingerprint
+            if self.db_agent.check_if_model_feature_exists_for(model_name, self.media.media_id):
+                self.db_agent.update_feature_entry_for(feature, model_name, self.media.media_id)
+            else:
+                self.db_agent.add_feature_entry(feature)
+        IOHandler.print_color(message=f"Reused features of identical recording '{media_id}' for {self.media.title} "
+                                      f"(similarity {similarity:.3f})", color=Color.YELLOW, enforce=True)
+        self.__add_message_to_logger(f"Reused features of identical recording {media_id} "
+                                     f"(similarity {similarity:.3f})")
+        return True
+
+    def register_audio_fingerprint(self):
+        """
+        Add the audio fingerprint of the current recording to the index once it was tagged
+        """
+        if self.fingerprint_index is not None and self.audio_fingerprint is not None:
+            self.fingerprint_index.add(self.media.media_id, self.audio_fingerprint)
+
     def attach_model(self, model_name: str) -> Model:
         """
         Attach selected ML model to the tagger
@@ -101,7 +176,8 @@ class Tagger(ABC):
         """
         Plot waveform for audio of media file and store it as an image
         """
-        success, message = self.media.export_waveform(self.output_folder)
+        with Tracer.span("plot", media_id=self.media.media_id, model="waveform"):
+            success, message = self.media.export_waveform(self.output_folder)
         if not success:
             self.__add_error_to_logger(message)
 
@@ -120,6 +196,7 @@ class Tagger(ABC):
         :param sorted_means: Whether to sort features by mean values over whole song (descending)
         """
         model = self.attach_model(model_name)
+        skip_if_in_db = skip_if_in_db and not self.replace_features
         if model:
             if (skip_if_in_db and
                     self.db_agent.check_if_model_feature_exists_for(model.display_name, self.media.media_id)):
@@ -128,12 +205,13 @@ class Tagger(ABC):
                                       color=Color.YELLOW)
                 self.__add_message_to_logger(f"Skipped plotting for {model.display_name}, already in database")
             else:
-                success, message = self.extractor.plot_features_for(
-                    model=model,
-                    output_folder=self.output_folder,
-                    max_pooling=max_pooling,
-                    sorted_means=sorted_means
-                )
+                with Tracer.span("plot", media_id=self.media.media_id, model=model.shortname):
+                    success, message = self.extractor.plot_features_for(
+                        model=model,
+                        output_folder=self.output_folder,
+                        max_pooling=max_pooling,
+                        sorted_means=sorted_means
+                    )
                 if not success:
                     self.__add_error_to_logger(message)
         else:
@@ -150,6 +228,7 @@ class Tagger(ABC):
         :param sorted_means: Whether to sort features by mean values over whole song (descending)
         """
         model = self.attach_model(model_name)
+        skip_if_in_db = skip_if_in_db and not self.replace_features
         if model:
             if (skip_if_in_db and
                     self.db_agent.check_if_model_feature_exists_for(model.display_name, self.media.media_id)):
@@ -182,6 +261,7 @@ class Tagger(ABC):
         :param sorted_means: Whether to sort features by mean values over whole song (descending)
         """
         model = self.attach_model(model_name)
+        skip_if_in_db = skip_if_in_db and not self.replace_features
         if model:
             if (skip_if_in_db and
                     self.db_agent.check_if_model_feature_exists_for(model.display_name, self.media.media_id)):
@@ -197,8 +277,8 @@ class Tagger(ABC):
                 try:
                     if self.db_agent.check_if_model_feature_exists_for(model.display_name, self.media.media_id):
                         # Feature is already in database => Update or skip
-                        if overwrite:
-                            feature = self.extractor.get_db_features_for(model, max_pooling, sorted_means)
+                        if overwrite or self.replace_features:
+                            feature = self.__db_features_for(model, max_pooling, sorted_means)
                             query_success = self.db_agent.update_feature_entry_for(feature, model.display_name,
                                                                                    self.media.media_id)
                         else:
@@ -209,7 +289,7 @@ class Tagger(ABC):
                             self.__add_message_to_logger(
                                 f"Skipped database writing for {model.display_name}, already in database")
                     else:
-                        feature = self.extractor.get_db_features_for(model, max_pooling, sorted_means)
+                        feature = self.__db_features_for(model, max_pooling, sorted_means)
                         query_success = self.db_agent.add_feature_entry(feature)
                 except OSError:
                     IOHandler.print_color(
@@ -235,6 +315,12 @@ class Tagger(ABC):
                                   color=Color.RED)
             self.__add_error_to_logger(f"Could not write features to database, model '{model_name}' does not exist")
 
+    def __db_features_for(self, model: Model, max_pooling: bool, sorted_means: bool):
+        feature = self.extractor.get_db_features_for(model, max_pooling, sorted_means)
+        if self.fingerprint is not None:
+            feature['fingerprint'] = self.fingerprint
+        return feature
+
     def __add_error_to_logger(self, message):
         if self.logger is not None:
             self.logger.add_error(message)
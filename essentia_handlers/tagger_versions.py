@@ -12,6 +12,12 @@ ALL_MODELS = [
 
 
 class PerformanceTagger(Tagger):
+    db_model_names = [
+        "mtg_jamendo_instrument-discogs-effnet-1",
+        "mtg_jamendo_genre-discogs-effnet-1",
+        "mtg_jamendo_moodtheme-discogs-effnet-1",
+    ]
+
     def process_song(self, **kwargs):
         self.inform_user(**kwargs)
 
@@ -58,6 +64,8 @@ class PoolingDemo(Tagger):
 
 
 class NewProcess(Tagger):
+    db_model_names = PerformanceTagger.db_model_names
+
     def process_song(self, **kwargs):
         self.inform_user(**kwargs)
         self.plot_waveform()
@@ -0,0 +1,110 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+
+import os
+import hashlib
+
+PARTIAL_HASH_BYTES = 1 << 16
+
+
+class ChangeDetector:
+    """
+    Decides which media files have to be (re-)extracted by comparing their fingerprint (size, mtime and a hash over the
+    first and last bytes) with the fingerprints stored alongside their feature rows. The stored fingerprints of the
+    whole archive are fetched with a single query, so unchanged files are skipped without touching the database.
+    """
+    NEW = "new"
+    CHANGED = "changed"
+    TOUCHED = "touched"
+    UNCHANGED = "unchanged"
+
+    def __init__(self, stored_fingerprints, model_names, hash_bytes=PARTIAL_HASH_BYTES):
+        """
+        :param stored_fingerprints: Dictionary with media paths as keys and the media id and the fingerprint per model
+            name as values, as returned by DBAgent.fetch_feature_fingerprints
+        :type stored_fingerprints: dict
+        :param model_names: Names of the models whose features the tagger writes to the database
+        :type model_names: list[str]
+        :param hash_bytes: Number of bytes hashed at the start and at the end of every file
+        :type hash_bytes: int
+        """
+        self.stored_fingerprints = stored_fingerprints
+        self.model_names = model_names
+        self.hash_bytes = hash_bytes
+
+    def classify(self, rel_media_path, abs_media_path):
+        """
+        Compare a media file with its stored fingerprints
+        NEW: features are missing for at least one model
+        CHANGED: the content differs from the one the features were extracted from
+        TOUCHED: only the mtime changed, or the rows have no fingerprint yet; the stored fingerprint has to be updated
+        UNCHANGED: nothing to do
+        :param rel_media_path: Media path relative to the media folder, as stored in the media table
+        :type rel_media_path: str
+        :param abs_media_path: Path of the media file on disk
+        :type abs_media_path: str
+        :return: status, current fingerprint (None if the file is missing) and media id (None for new files)
+        """
+        try:
+            stat = os.stat(abs_media_path)
+        except OSError:
+            return ChangeDetector.NEW, None, None
+        entry = self.stored_fingerprints.get(rel_media_path)
+        if entry is None or any(name not in entry['fingerprints'] for name in self.model_names):
+            return ChangeDetector.NEW, self.fingerprint(abs_media_path, stat), None
+        stored = [entry['fingerprints'][name] for name in self.model_names]
+        if self.__matches_stat(stored, stat):
+            return ChangeDetector.UNCHANGED, None, entry['media_id']
+        fingerprint = self.fingerprint(abs_media_path, stat)
+        # Rows written before fingerprints existed are assumed to belong to the file as it is
+        if all(stored_fingerprint is None or (stored_fingerprint['size'] == fingerprint['size']
+                                              and stored_fingerprint['partial_hash'] == fingerprint['partial_hash'])
+               for stored_fingerprint in stored):
+            return ChangeDetector.TOUCHED, fingerprint, entry['media_id']
+        return ChangeDetector.CHANGED, fingerprint, entry['media_id']
+
+    def is_unchanged(self, rel_media_path, abs_media_path):
+        """
+        Cheap check with os.stat only, True if classify would return UNCHANGED
+        :param rel_media_path: Media path relative to the media folder, as stored in the media table
+        :type rel_media_path: str
+        :param abs_media_path: Path of the media file on disk
+        :type abs_media_path: str
+        :return: True if size and mtime match the stored fingerprints of all models
+        """
+        entry = self.stored_fingerprints.get(rel_media_path)
+        if entry is None or any(name not in entry['fingerprints'] for name in self.model_names):
+            return False
+        try:
+            stat = os.stat(abs_media_path)
+        except OSError:
+            return False
+        return self.__matches_stat([entry['fingerprints'][name] for name in self.model_names], stat)
+
+    def fingerprint(self, file_path, stat=None):
+        """
+        Size, mtime and partial hash of a file
+        :param file_path: Path of the file
+        :type file_path: str
+        :param stat: Result of os.stat for the file, if already available
+        :type stat: os.stat_result | None
+        :return: fingerprint
+        """
+        if stat is None:
+            stat = os.stat(file_path)
+        sha1 = hashlib.sha1(str(stat.st_size).encode())
+        with open(file_path, 'rb') as f:
+            sha1.update(f.read(self.hash_bytes))
+            if stat.st_size > 2 * self.hash_bytes:
+                f.seek(-self.hash_bytes, os.SEEK_END)
+            sha1.update(f.read(self.hash_bytes))
+        return {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'partial_hash': sha1.hexdigest(),
+        }
+
+    @staticmethod
+    def __matches_stat(stored, stat):
+        return all(fingerprint is not None and fingerprint['size'] == stat.st_size
+                   and fingerprint['mtime'] == stat.st_mtime_ns for fingerprint in stored)
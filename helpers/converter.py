@@ -2,7 +2,8 @@
 #  All rights reserved.
 
 import datetime
-import locale
+from functools import lru_cache
+from babel import dates
 
 locale_codes = {
     'de': 'de_CH.UTF-8',
@@ -20,17 +21,40 @@ class Converter:
         return datetime_object.strftime("%d.%m.%Y")
     
     @staticmethod
+    @lru_cache(maxsize=None)
     def datetime_to_localized_timestring(dt, language='en'):
+        """
+        Format a date like strftime('%A, %e. %B %Y') in the given language, e.g. 'Montag,  7. Juli 2019'.
+        Weekday and month names are taken from the CLDR data of Babel instead of switching the process-wide locale,
+        so the conversion is thread-safe. Results are memoized, every distinct date is formatted once per language.
+        :param dt: Date in ISO format (YYYY-MM-DD)
+        :type dt: str
+        :param language: One of the keys of locale_codes, falls back to English
+        :type language: str
+        :return: localized date
+        """
         datetime_object = datetime.datetime.strptime(dt, '%Y-%m-%d')
-        if language in locale_codes:
-            lc = locale_codes[language]
-        else:
-            lc = locale_codes['en']
-        previous = locale.getlocale(locale.LC_TIME)
-        locale.setlocale(locale.LC_TIME, lc)
-        local_date = datetime_object.strftime('%A, %e. %B %Y')
-        locale.setlocale(locale.LC_TIME, previous)
-        return local_date
+        day_names, month_names = Converter.__localized_names(language)
+        return (f"{day_names[datetime_object.weekday()]}, {datetime_object.day:>2}. "
+                f"{month_names[datetime_object.month]} {datetime_object.year}")
+
+    @staticmethod
+    def datetime_to_localized_timestrings(dt, languages):
+        """
+        Format a date in several languages at once
+        :param dt: Date in ISO format (YYYY-MM-DD)
+        :type dt: str
+        :param languages: Keys of locale_codes
+        :type languages: list[str]
+        :return: Dictionary with languages as keys and localized dates as values
+        """
+        return {language: Converter.datetime_to_localized_timestring(dt, language) for language in languages}
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def __localized_names(language):
+        lc = locale_codes.get(language, locale_codes['en'])
+        return dates.get_day_names('wide', locale=lc), dates.get_month_names('wide', locale=lc)
 
     @staticmethod
     def file_creation_string(datetime_object=None):
@@ -23,3 +23,41 @@ class UnknownTaggerException(Exception):
     def __init__(self, tagger):
         self.message = f"Unknown tagger: {tagger}"
         super().__init__(self.message)
+
+
+class UnknownClusteringMethodException(Exception):
+    """
+    Exception raised if clustering method in config file is unknown.
+
+    Parameters:
+        method(str): Name of the clustering method from config file
+    """
+    def __init__(self, method):
+        self.message = f"Unknown clustering method: {method}"
+        super().__init__(self.message)
+
+
+class InvalidScenePackException(Exception):
+    """
+    Exception raised if a file is not a scene pack or its version is not supported.
+
+    Parameters:
+        file(str): path to the scene pack
+        reason(str): what is wrong with the file
+    """
+    def __init__(self, file, reason):
+        self.message = f"Invalid scene pack {file}: {reason}"
+        super().__init__(self.message)
+
+
+class DeltaPatchMismatchException(Exception):
+    """
+    Exception raised if a delta patch does not fit the artifacts it is applied to.
+
+    Parameters:
+        artifact(str): name of the artifact
+        reason(str): what does not match
+    """
+    def __init__(self, artifact, reason):
+        self.message = f"Artifact {artifact} {reason}"
+        super().__init__(self.message)
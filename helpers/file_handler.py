@@ -2,8 +2,10 @@
 #  All rights reserved.
 
 import os
-import re
+import json
+import hashlib
 import yaml
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from helpers.timer import Timer
 from helpers.io_handler import IOHandler
 
@@ -11,39 +13,67 @@ from helpers.io_handler import IOHandler
 script_dir = os.path.dirname(__file__)
 CONFIG_FILE = os.path.normpath(os.path.join(script_dir, '../config.yaml'))
 
+# Media manifest
+MEDIA_SUFFIX = ".mp4"
+MANIFEST_VERSION = 1
+MANIFEST_WORKERS = 16
+
 
 class FileHandler:
-    pass
+    __manifest_refresh = True
+
+    @staticmethod
+    def set_manifest_refresh(refresh: bool):
+        FileHandler.__manifest_refresh = refresh
 
     @staticmethod
-    def create_file_list_from(path, limit=None):
+    def create_file_list_from(path, limit=None, skip=0, manifest_file=None, workers=MANIFEST_WORKERS):
+        """
+        List the media files below path sorted by video name. With a manifest file, the listing is read from the
+        manifest and only directories whose mtime changed since the last run are scanned again.
+        :param path: Media folder
+        :type path: str
+        :param limit: Number of files from the start of the sorted list to stop after
+        :type limit: int | None
+        :param skip: Number of files to skip at the start of the sorted list
+        :type skip: int
+        :param manifest_file: Path of the persisted media manifest, None to scan the whole folder
+        :type manifest_file: str | None
+        :param workers: Number of directories scanned in parallel
+        :type workers: int
+        :return: List of (absolute media path, relative media path, relative output prefix)
+        """
         IOHandler.print_color(message="Creating media files list... ", end="")
         media_timer = Timer()
-        omit_pattern = re.compile('^[.]|^(?!.*[.]mp4$)')
-        file_list = []
-        for (dir_path, subdirectories, file_names) in os.walk(path):
-            for file_name in file_names:
-                if omit_pattern.search(file_name):
-                    continue
-                abs_media_path = os.path.join(dir_path, file_name)
-                rel_media_path = os.path.relpath(abs_media_path, path)
-                rel_output_prefix = re.sub("[.]mp4$", "", rel_media_path)
-                file_params = abs_media_path, rel_media_path, rel_output_prefix
-                file_list.append(file_params)
-        file_list.sort(key=FileHandler.sort_by_video_name)
-        if limit is not None:
-            file_list = file_list[:limit]
+        manifest = FileHandler.read_media_manifest(manifest_file, path)
+        if manifest is None or FileHandler.__manifest_refresh:
+            manifest, changed = FileHandler.__refresh_media_manifest(path, manifest, workers)
+            if manifest_file is not None and changed:
+                FileHandler.__write_media_manifest(manifest_file, manifest)
+        file_list = [
+            (os.path.join(path, rel_media_path), rel_media_path, rel_media_path[:-len(MEDIA_SUFFIX)])
+            for rel_media_path, _, _, _ in manifest['files'][skip:limit]
+        ]
         media_timer.print_seconds()
         return file_list
 
     @staticmethod
-    def sort_by_video_name(x):
-        name = x[2].split("/")[-1]
-        try:
-            name = int(name)
-        except ValueError:
-            name = 0
-        return name
+    def read_media_manifest(manifest_file, path):
+        """
+        Read a media manifest written by create_file_list_from
+        :param manifest_file: Path of the manifest, may be None
+        :type manifest_file: str | None
+        :param path: Media folder the manifest has to belong to
+        :type path: str
+        :return: manifest or None if it does not exist or belongs to another folder
+        """
+        if manifest_file is None or not os.path.exists(manifest_file):
+            return None
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != MANIFEST_VERSION or manifest.get('root') != os.path.abspath(path):
+            return None
+        return manifest
 
     @staticmethod
     def create_folders_if_not_exists(filename):
@@ -57,7 +87,91 @@ class FileHandler:
         with open(filename, "w") as f:
             f.write(content)
     
+    @staticmethod
+    def file_sha1(filename, chunk_size=1 << 20):
+        sha1 = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
     @staticmethod
     def read_config_file():
         with open(CONFIG_FILE, 'r') as yaml_file:
             return yaml.safe_load(yaml_file)
+
+    @staticmethod
+    def __refresh_media_manifest(path, manifest, workers):
+        # Scan the directory tree level by level, every directory in its own task. A directory whose mtime did not
+        # change has the same entries as before, so its files and subdirectories are taken from the manifest.
+        root = os.path.abspath(path)
+        previous = manifest['directories'] if manifest is not None else {}
+        directories = {}
+        changed = manifest is None
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            pending = {pool.submit(FileHandler.__scan_directory, root, "", previous.get(""))}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rel_dir, entry, scanned = future.result()
+                    directories[rel_dir] = entry
+                    changed = changed or scanned
+                    for name in entry['subdirectories']:
+                        rel_subdir = os.path.join(rel_dir, name)
+                        pending.add(pool.submit(FileHandler.__scan_directory, root, rel_subdir,
+                                                previous.get(rel_subdir)))
+        changed = changed or directories.keys() != previous.keys()
+        if not changed:
+            return manifest, False
+        files = [
+            (os.path.join(rel_dir, name), size, mtime, FileHandler.__video_sort_key(name))
+            for rel_dir, entry in directories.items() for name, size, mtime in entry['files']
+        ]
+        # Ties are broken by path so that skip and limit select the same files in every run
+        files.sort(key=lambda file: (file[3], file[0]))
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'root': root,
+            'directories': directories,
+            'files': files,
+        }
+        return manifest, True
+
+    @staticmethod
+    def __scan_directory(root, rel_dir, previous_entry):
+        abs_dir = os.path.join(root, rel_dir)
+        mtime = os.stat(abs_dir).st_mtime_ns
+        if previous_entry is not None and previous_entry['mtime'] == mtime:
+            return rel_dir, previous_entry, False
+        files = []
+        subdirectories = []
+        with os.scandir(abs_dir) as entries:
+            for entry in entries:
+                # Like os.walk, symbolic links to directories are listed but not followed
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        subdirectories.append(entry.name)
+                elif not entry.name.startswith(".") and entry.name.endswith(MEDIA_SUFFIX):
+                    # A dangling symbolic link or a file deleted during the scan is listed like os.walk did, its
+                    # song fails on its own instead of aborting the scan
+                    try:
+                        stat = entry.stat()
+                        files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+                    except OSError:
+                        files.append((entry.name, None, None))
+        return rel_dir, {'mtime': mtime, 'subdirectories': subdirectories, 'files': files}, True
+
+    @staticmethod
+    def __video_sort_key(file_name):
+        try:
+            return int(file_name[:-len(MEDIA_SUFFIX)])
+        except ValueError:
+            return 0
+
+    @staticmethod
+    def __write_media_manifest(manifest_file, manifest):
+        FileHandler.create_folders_if_not_exists(manifest_file)
+        temporary_file = f"{manifest_file}.tmp"
+        with open(temporary_file, 'w') as f:
+            f.write(json.dumps(manifest))
+        os.replace(temporary_file, manifest_file)
@@ -18,24 +18,55 @@ class IOHandler:
         opts, args = getopt.getopt(
             args=argv,
             shortopts="hvi:o:l:s:",
-            longopts=["help", "ifolder=", "ofolder=", "limit=", "skip=", "verbose"]
+            longopts=["help", "ifolder=", "ofolder=", "limit=", "skip=", "verbose", "profile-startup",
+                      "cached-manifest", "trace=", "resume="]
         )
         skip = 0
+        resume_file = None
+        given = {}
         for opt, arg in opts:
             if opt in ("-h", "--help"):
-                print('main.py -i <input folder> -o <output folder> [-l <limit>] [-s <skip>] [-v]')
+                print('main.py -i <input folder> -o <output folder> [-l <limit>] [-s <skip>] [-v] [--profile-startup] '
+                      '[--cached-manifest] [--trace <trace file>] [--resume <journal>]')
                 sys.exit()
             elif opt in ("-i", "--ifolder"):
-                input_folder = arg
+                input_folder = given['input_folder'] = arg
             elif opt in ("-o", "--ofolder"):
-                output_folder = arg
+                output_folder = given['output_folder'] = arg
             elif opt in ("-l", "--limit"):
-                limit = int(arg)
+                limit = given['limit'] = int(arg)
             elif opt in ("-s", "--skip"):
-                skip = int(arg)
+                skip = given['skip'] = int(arg)
             elif opt in ("-v", "--verbose"):
                 IOHandler.set_verbose_mode(True)
-        return input_folder, output_folder, limit, skip
+            elif opt == "--profile-startup":
+                from helpers.startup_profile import StartupProfile
+                StartupProfile.enable()
+            elif opt == "--cached-manifest":
+                from helpers.file_handler import FileHandler
+                FileHandler.set_manifest_refresh(False)
+            elif opt == "--trace":
+                from helpers.tracing import Tracer
+                Tracer.enable(arg)
+            elif opt == "--resume":
+                resume_file = arg
+        if resume_file is not None:
+            # Continue with the arguments of the journaled run
+            from helpers.logger import ExtractionJournal
+            if not os.path.isfile(resume_file):
+                IOHandler.show_error(f"ERROR: Journal does not exist: {resume_file}")
+                sys.exit()
+            run_info, _ = ExtractionJournal.read(resume_file)
+            conflicts = [key for key, value in given.items() if key in run_info and run_info[key] != value]
+            if conflicts:
+                IOHandler.show_error(f"ERROR: The arguments {', '.join(conflicts)} differ from the journaled run, "
+                                     f"omit them to resume: {resume_file}")
+                sys.exit()
+            input_folder = run_info.get('input_folder', input_folder)
+            output_folder = run_info.get('output_folder', output_folder)
+            limit = run_info.get('limit', limit)
+            skip = run_info.get('skip', skip)
+        return input_folder, output_folder, limit, skip, resume_file
     
     @staticmethod
     def verify_folder_exists(path):
@@ -71,12 +102,12 @@ class IOHandler:
 
     @staticmethod
     def read_and_confirm_main_arguments(argv, input_folder="", output_folder="", limit=None):
-        input_folder, output_folder, limit, skip = (IOHandler.read_main_arguments(
+        input_folder, output_folder, limit, skip, resume_file = (IOHandler.read_main_arguments(
             argv, input_folder, output_folder, limit))
         IOHandler.verify_folder_exists(input_folder)
-        if not limit:
+        if not limit and resume_file is None:
             limit = IOHandler.confirm_no_limit()
-        return input_folder, output_folder, limit, skip
+        return input_folder, output_folder, limit, skip, resume_file
 
     @staticmethod
     def print_spacer(color=None, enforce=False):
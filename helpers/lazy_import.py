@@ -0,0 +1,30 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+
+import time
+import importlib
+
+
+class LazyImport:
+    """
+    Stand-in for a module that is imported on first attribute access, e.g. es = LazyImport("essentia.standard").
+    Heavy dependencies (essentia with TensorFlow, matplotlib) are thereby only loaded by code paths that use them.
+    """
+    import_times = {}
+
+    def __init__(self, module_name):
+        self.__module_name = module_name
+        self.__module = None
+
+    def __getattr__(self, name):
+        return getattr(self.__load(), name)
+
+    def is_loaded(self):
+        return self.__module is not None
+
+    def __load(self):
+        if self.__module is None:
+            import_start = time.perf_counter()
+            self.__module = importlib.import_module(self.__module_name)
+            LazyImport.import_times[self.__module_name] = time.perf_counter() - import_start
+        return self.__module
@@ -1,9 +1,18 @@
 #  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
 #  All rights reserved.
 
+import os
 import csv
+import json
+import time
+import threading
 from helpers.converter import Converter
 from helpers.file_handler import FileHandler
+from helpers.tracing import Tracer
+
+JOURNAL_VERSION = 1
+# Songs with these statuses are not processed again by a resumed run, failed songs are retried
+JOURNAL_COMPLETED_STATUSES = ("done", "unchanged")
 
 
 class Logger:
@@ -33,6 +42,15 @@ class ExtractionLogger(Logger):
             'details': []
         }
         super().write_header(self.__log_entry.keys())
+        self.__journal = None
+
+    def attach_journal(self, journal):
+        """
+        Write every committed entry to a journal as well
+        :param journal: Journal of the run
+        :type journal: ExtractionJournal
+        """
+        self.__journal = journal
 
     def reset_values(self):
         self.__log_entry = {k: "" for k in self.__log_entry}
@@ -62,3 +80,152 @@ class ExtractionLogger(Logger):
         if set_timestamp:
             self.set_entry_timestamp()
         super().write_entry(self.__log_entry.values())
+        if self.__journal is not None:
+            self.__journal.record(
+                media_path=self.__log_entry['media_filepath'],
+                status="done" if self.__log_entry['success'] else "failed",
+                index=self.__log_entry['index'],
+                media_id=self.__log_entry['media_id'],
+                details=self.__log_entry['details']
+            )
+
+
+class ExtractionJournal:
+    """
+    Machine-readable journal of an extraction run in JSON lines: a run record with the arguments of the run, followed by
+    one record per song with its status, log details and the time spent per span type (decode, infer[model], ...).
+    Records are buffered and a background thread flushes them with fsync every fsync_interval seconds, also while a
+    long song is processed. After a crash at most the records written in the last fsync_interval seconds are lost and
+    a run resumed from the journal only repeats those songs.
+    """
+
+    def __init__(self, journal_file, run_info=None, fsync_interval=5.0):
+        """
+        Open a new journal or continue an existing one
+        :param journal_file: Path of the journal
+        :type journal_file: str
+        :param run_info: Arguments of the run, written as first record of a new journal
+        :type run_info: dict | None
+        :param fsync_interval: Maximal number of seconds between two flushes to disk
+        :type fsync_interval: float
+        """
+        self.journal_file = journal_file
+        self.fsync_interval = fsync_interval
+        self.__timings = {}
+        self.__song_start = time.perf_counter()
+        FileHandler.create_folders_if_not_exists(journal_file)
+        resumed = os.path.exists(journal_file)
+        if resumed:
+            ExtractionJournal.__truncate_partial_record(journal_file)
+        self.__file = open(journal_file, 'a', buffering=1 << 16)
+        self.__lock = threading.Lock()
+        self.__unsynced = False
+        self.__closed = threading.Event()
+        if resumed:
+            self.__write({'type': "resume", 'timestamp': Converter.current_timestamp()})
+        else:
+            self.__write({'type': "run", 'version': JOURNAL_VERSION, 'timestamp': Converter.current_timestamp(),
+                          **(run_info or {})})
+        Tracer.add_listener(self.__observe_span)
+        self.__sync_thread = threading.Thread(target=self.__sync_periodically, daemon=True)
+        self.__sync_thread.start()
+
+    @staticmethod
+    def journal_file_for(output_folder):
+        return output_folder + "journal-" + Converter.file_creation_string() + ".jsonl"
+
+    @staticmethod
+    def read(journal_file):
+        """
+        Read a journal, ignoring a partially written last record
+        :param journal_file: Path of the journal
+        :type journal_file: str
+        :return: run record and dictionary with media paths as keys and their last song record as values, see
+        JOURNAL_COMPLETED_STATUSES for the songs that do not need to be processed again
+        """
+        run_info = {}
+        songs = {}
+        with open(journal_file, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                if record['type'] == "run":
+                    run_info = record
+                elif record['type'] == "song":
+                    songs[record['media_path']] = record
+        return run_info, songs
+
+    def start_song(self):
+        """
+        Reset the timings, called before a song is processed
+        """
+        self.__timings = {}
+        self.__song_start = time.perf_counter()
+
+    def record(self, media_path, status, **values):
+        """
+        Append the record of a song
+        :param media_path: Media path relative to the media folder
+        :type media_path: str
+        :param status: done, failed or unchanged
+        :type status: str
+        :param values: Additional values of the record, e.g. index, media_id and details
+        """
+        timings = {'total': time.perf_counter() - self.__song_start, **self.__timings}
+        self.__write({'type': "song", 'timestamp': Converter.current_timestamp(), 'media_path': media_path,
+                      'status': status, **values, 'timings': timings})
+        self.__timings = {}
+        self.__song_start = time.perf_counter()
+
+    def close(self):
+        """
+        Flush all buffered records to disk and close the journal
+        """
+        Tracer.remove_listener(self.__observe_span)
+        self.__closed.set()
+        self.__sync_thread.join()
+        with self.__lock:
+            self.__sync()
+            self.__file.close()
+
+    def __write(self, record):
+        with self.__lock:
+            self.__file.write(json.dumps(record, default=str) + "\n")
+            self.__unsynced = True
+
+    def __sync_periodically(self):
+        while not self.__closed.wait(self.fsync_interval):
+            with self.__lock:
+                if self.__unsynced:
+                    self.__sync()
+
+    def __sync(self):
+        # Called with the lock held
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__unsynced = False
+
+    def __observe_span(self, span):
+        if span['name'] != "song":
+            self.__timings[span['name']] = self.__timings.get(span['name'], 0.0) + span['duration']
+
+    @staticmethod
+    def __truncate_partial_record(journal_file):
+        # A record cut off by a crash would be glued to the first record appended after resuming
+        with open(journal_file, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                start = max(0, position - (1 << 16))
+                f.seek(start)
+                block = f.read(position - start)
+                if start + len(block) == end and block.endswith(b"\n"):
+                    return
+                newline = block.rfind(b"\n")
+                if newline >= 0:
+                    f.truncate(start + newline + 1)
+                    return
+                position = start
+            f.truncate(0)
@@ -0,0 +1,139 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+
+import time
+from helpers.tracing import Tracer
+from helpers.lazy_import import LazyImport
+
+# Only loaded if metrics are enabled
+prometheus_client = LazyImport("prometheus_client")
+psutil = LazyImport("psutil")
+
+METRICS_PREFIX = "mjf_extraction"
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+RTF_BUCKETS = [0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2]
+
+
+class Metrics:
+    """
+    Prometheus metrics of an extraction run, served on a local HTTP endpoint and/or written to a textfile for the
+    node_exporter textfile collector. Latencies are taken from the tracing spans (decode, infer[model], db_write, song),
+    so the code paths are only instrumented once.
+    """
+    __enabled = False
+    __registry = None
+    __metrics = {}
+    __textfile = None
+    __textfile_interval = 15
+    __last_textfile_write = 0.0
+
+    @staticmethod
+    def enable(http_port=None, textfile=None, textfile_interval=15):
+        """
+        Create the metrics and start serving them
+        :param http_port: Port of the HTTP endpoint, None for no endpoint
+        :type http_port: int | None
+        :param textfile: Path of the .prom file for node_exporter, None for no textfile
+        :type textfile: str | None
+        :param textfile_interval: Minimal number of seconds between two writes of the textfile
+        :type textfile_interval: float
+        """
+        registry = prometheus_client.CollectorRegistry()
+        histogram, counter, gauge = prometheus_client.Histogram, prometheus_client.Counter, prometheus_client.Gauge
+        Metrics.__metrics = {
+            'songs': counter(f"{METRICS_PREFIX}_songs_processed", "Songs processed",
+                             ['result'], registry=registry),
+            'audio_seconds': counter(f"{METRICS_PREFIX}_audio_seconds_processed", "Seconds of audio processed",
+                                     registry=registry),
+            'song_seconds': histogram(f"{METRICS_PREFIX}_song_seconds", "Processing time per song",
+                                      buckets=LATENCY_BUCKETS, registry=registry),
+            'real_time_factor': histogram(f"{METRICS_PREFIX}_real_time_factor",
+                                          "Processing time divided by audio duration per song",
+                                          buckets=RTF_BUCKETS, registry=registry),
+            'last_real_time_factor': gauge(f"{METRICS_PREFIX}_last_real_time_factor",
+                                           "Real-time factor of the last song", registry=registry),
+            'inference_seconds': histogram(f"{METRICS_PREFIX}_inference_seconds", "Inference latency per model",
+                                           ['model'], buckets=LATENCY_BUCKETS, registry=registry),
+            'decode_seconds': histogram(f"{METRICS_PREFIX}_decode_seconds", "Audio decode latency",
+                                        ['sample_rate'], buckets=LATENCY_BUCKETS, registry=registry),
+            'db_write_seconds': histogram(f"{METRICS_PREFIX}_db_write_seconds", "Feature database write latency",
+                                          buckets=LATENCY_BUCKETS, registry=registry),
+            'queue_depth': gauge(f"{METRICS_PREFIX}_queue_depth", "Number of items waiting in a queue",
+                                 ['queue'], registry=registry),
+            'resident_memory': gauge(f"{METRICS_PREFIX}_resident_memory_bytes", "Resident set size of the process",
+                                     registry=registry),
+        }
+        Metrics.__registry = registry
+        Metrics.__textfile = textfile
+        Metrics.__textfile_interval = textfile_interval
+        Metrics.__enabled = True
+        Tracer.add_listener(Metrics.observe_span)
+        if http_port is not None:
+            prometheus_client.start_http_server(int(http_port), registry=registry)
+
+    @staticmethod
+    def is_enabled():
+        return Metrics.__enabled
+
+    @staticmethod
+    def observe_span(span):
+        """
+        Update the latency metrics from a closed tracing span
+        :param span: Span as closed by Tracer.end_span
+        :type span: dict
+        """
+        name, duration, attributes = span['name'], span['duration'], span['attributes']
+        metrics = Metrics.__metrics
+        if name == "decode":
+            metrics['decode_seconds'].labels(sample_rate=str(attributes.get('sample_rate'))).observe(duration)
+        elif name.startswith("infer["):
+            metrics['inference_seconds'].labels(model=name[len("infer["):-1]).observe(duration)
+        elif name == "db_write":
+            metrics['db_write_seconds'].observe(duration)
+        elif name == "song":
+            audio_seconds = attributes.get('audio_seconds') or 0
+            metrics['songs'].labels(result="reused" if attributes.get('reused') else "extracted").inc()
+            metrics['audio_seconds'].inc(audio_seconds)
+            metrics['song_seconds'].observe(duration)
+            if audio_seconds > 0:
+                metrics['real_time_factor'].observe(duration / audio_seconds)
+                metrics['last_real_time_factor'].set(duration / audio_seconds)
+
+    @staticmethod
+    def count_song(result):
+        """
+        Count a song that was not processed, e.g. because it is unchanged or has no database entry
+        :param result: Label of the song, e.g. 'unchanged' or 'missing_metadata'
+        :type result: str
+        """
+        if Metrics.__enabled:
+            Metrics.__metrics['songs'].labels(result=result).inc()
+
+    @staticmethod
+    def set_queue_depth(queue, depth):
+        """
+        Set the number of items waiting in a queue
+        :param queue: Name of the queue, e.g. 'songs'
+        :type queue: str
+        :param depth: Number of waiting items
+        :type depth: int
+        """
+        if Metrics.__enabled:
+            Metrics.__metrics['queue_depth'].labels(queue=queue).set(depth)
+
+    @staticmethod
+    def update(force=False):
+        """
+        Refresh the process metrics and write the textfile if the interval passed
+        :param force: Write the textfile regardless of the interval, e.g. at the end of the run
+        :type force: bool
+        """
+        if not Metrics.__enabled:
+            return
+        Metrics.__metrics['resident_memory'].set(psutil.Process().memory_info().rss)
+        now = time.monotonic()
+        interval_passed = now - Metrics.__last_textfile_write >= Metrics.__textfile_interval
+        if Metrics.__textfile is not None and (force or interval_passed):
+            # write_to_textfile writes a temporary file and renames it, node_exporter never reads a partial file
+            prometheus_client.write_to_textfile(Metrics.__textfile, Metrics.__registry)
+            Metrics.__last_textfile_write = now
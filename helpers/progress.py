@@ -0,0 +1,120 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+
+import time
+from collections import deque
+from helpers.tracing import Tracer
+from helpers.converter import Converter
+from helpers.io_handler import IOHandler, Color
+
+
+class Progress:
+    """
+    Live progress of an extraction run, printed at most every interval seconds also in non-verbose mode: completed and
+    total songs and audio hours, the real-time factor over the last songs, the share of the processing time spent in
+    every model and the remaining time estimated from the remaining audio duration.
+    Processed songs are taken from the song spans of the tracer, songs that are not processed are reported with skip.
+    Songs known to be skipped before the run, e.g. unchanged files, are left out of media_paths so the ETA only covers
+    the audio that is actually processed.
+    """
+
+    def __init__(self, media_paths, durations, window=20, interval=10.0):
+        """
+        :param media_paths: Media paths of the songs of the run that are expected to be processed
+        :type media_paths: list[str]
+        :param durations: Dictionary with media paths as keys and audio durations in seconds as values
+        :type durations: dict
+        :param window: Number of last songs the real-time factor is averaged over
+        :type window: int
+        :param interval: Minimal number of seconds between two progress lines
+        :type interval: float
+        """
+        self.durations = durations
+        self.interval = interval
+        self.media_paths = set(media_paths)
+        self.total_songs = len(self.media_paths)
+        self.total_audio = sum(durations.get(media_path) or 0.0 for media_path in self.media_paths)
+        self.done_songs = 0
+        self.done_audio = 0.0
+        self.recent = deque(maxlen=window)
+        self.processing_seconds = 0.0
+        self.model_seconds = {}
+        self.__last_print = time.monotonic()
+        Tracer.add_listener(self.__observe_span)
+
+    def skip(self, media_path):
+        """
+        Count a song of the run that is not processed after all, e.g. because only its mtime changed. Songs that were
+        left out of media_paths are ignored.
+        :param media_path: Media path of the song
+        :type media_path: str
+        """
+        if media_path in self.media_paths:
+            self.__complete(self.durations.get(media_path) or 0.0)
+
+    def close(self):
+        """
+        Stop observing the spans of the tracer, called at the end of the run
+        """
+        Tracer.remove_listener(self.__observe_span)
+
+    def real_time_factor(self):
+        """
+        :return: Processing time divided by audio duration over the last songs, None before the first song
+        """
+        audio_seconds = sum(audio for _, audio in self.recent)
+        if audio_seconds <= 0:
+            return None
+        return sum(seconds for seconds, _ in self.recent) / audio_seconds
+
+    def remaining_seconds(self):
+        """
+        :return: Estimated remaining time of the run, None before the first song
+        """
+        real_time_factor = self.real_time_factor()
+        if real_time_factor is None:
+            return None
+        return max(self.total_audio - self.done_audio, 0.0) * real_time_factor
+
+    def print_progress(self, force=False):
+        """
+        Print the progress line if the interval passed since the last one
+        :param force: Print regardless of the interval, e.g. at the end of the run
+        :type force: bool
+        """
+        now = time.monotonic()
+        if not force and now - self.__last_print < self.interval:
+            return
+        self.__last_print = now
+        share = 100 * self.done_songs / self.total_songs if self.total_songs else 100.0
+        parts = [f"{self.done_songs}/{self.total_songs} songs ({share:.1f}%)",
+                 f"{self.done_audio / 3600:.1f}/{self.total_audio / 3600:.1f} h audio"]
+        real_time_factor = self.real_time_factor()
+        if real_time_factor is not None:
+            parts.append(f"RTF {real_time_factor:.3f} (last {len(self.recent)} songs)")
+        if self.processing_seconds > 0 and self.model_seconds:
+            shares = sorted(self.model_seconds.items(), key=lambda item: -item[1])
+            parts.append("models " + ", ".join(f"{name} {100 * seconds / self.processing_seconds:.0f}%"
+                                               for name, seconds in shares))
+        remaining = self.remaining_seconds()
+        if remaining is not None:
+            parts.append(f"ETA {Converter.seconds_to_dhms_str(remaining)}")
+        IOHandler.print_color(message="Progress: " + " | ".join(parts), color=Color.BLUE, enforce=True)
+
+    def __complete(self, audio_seconds):
+        self.done_songs += 1
+        self.done_audio += audio_seconds
+        self.print_progress()
+
+    def __observe_span(self, span):
+        if span['name'] == "song":
+            audio_seconds = self.durations.get(span['attributes'].get('media_path'))
+            if audio_seconds is None:
+                audio_seconds = span['attributes'].get('audio_seconds') or 0.0
+            self.processing_seconds += span['duration']
+            self.recent.append((span['duration'], audio_seconds))
+            self.__complete(audio_seconds)
+        elif span['name'].startswith("infer["):
+            # Short model name, e.g. mtg_jamendo_genre for mtg_jamendo_genre-discogs-effnet-1
+            name = span['name'][len("infer["):-1].split("-")[0]
+            self.model_seconds[name] = self.model_seconds.get(name, 0.0) + span['duration']
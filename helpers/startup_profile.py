@@ -0,0 +1,57 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+
+import sys
+import time
+from contextlib import contextmanager
+from helpers.io_handler import IOHandler, Color
+from helpers.lazy_import import LazyImport
+
+# Modules whose presence is reported, they are loaded lazily and only by code paths that need them
+HEAVY_MODULES = ['essentia', 'tensorflow', 'matplotlib']
+
+
+class StartupProfile:
+    __enabled = False
+    __phases = []
+
+    @staticmethod
+    def enable():
+        StartupProfile.__enabled = True
+
+    @staticmethod
+    def is_enabled():
+        return StartupProfile.__enabled
+
+    @staticmethod
+    def record(name, seconds):
+        StartupProfile.__phases.append((name, seconds))
+
+    @staticmethod
+    @contextmanager
+    def measure(name):
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            StartupProfile.record(name, time.perf_counter() - phase_start)
+
+    @staticmethod
+    def report():
+        """
+        Print the time spent in every start-up phase and in every lazy import (which happen within the phases)
+        """
+        if not StartupProfile.__enabled:
+            return
+        IOHandler.print_text_line(text="STARTUP PROFILE", color=Color.GREEN, enforce=True)
+        for name, seconds in StartupProfile.__phases:
+            IOHandler.print_color(f"{name:<40} {seconds:>8.3f} s", color=Color.GREEN, enforce=True)
+        total = sum(seconds for _, seconds in StartupProfile.__phases)
+        IOHandler.print_color(f"{'total':<40} {total:>8.3f} s", color=Color.GREEN, enforce=True)
+        for module_name, seconds in LazyImport.import_times.items():
+            IOHandler.print_color(f"  of which lazy import {module_name:<18} {seconds:>8.3f} s", color=Color.GREEN,
+                                  enforce=True)
+        loaded = [module for module in HEAVY_MODULES if module in sys.modules]
+        IOHandler.print_color(f"Loaded heavy modules: {', '.join(loaded) if loaded else 'none'}", color=Color.GREEN,
+                              enforce=True)
+        IOHandler.print_text_line(color=Color.GREEN, enforce=True)
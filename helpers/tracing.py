@@ -0,0 +1,216 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+
+import os
+import json
+import time
+import threading
+import numpy as np
+from contextlib import contextmanager
+from helpers.io_handler import IOHandler, Color
+from helpers.file_handler import FileHandler
+
+SUMMARY_PERCENTILES = [50, 95, 99]
+
+
+class Tracer:
+    """
+    Nested timing spans, e.g. song > decode > infer[model] > pool > db_write, measured with time.perf_counter.
+    Every span has a name, a start relative to enable(), a duration, the id of its parent span and attributes such as
+    media_id or audio_seconds. Spans are exported as JSON lines (one span per line) or, for files ending with .json,
+    in the Chrome trace event format that chrome://tracing and Perfetto open.
+    Tracing is disabled by default and spans are then not recorded. Listeners, e.g. the metrics, receive every span
+    when it is closed, also if tracing is disabled.
+    """
+    __enabled = False
+    __output_file = None
+    __origin = 0.0
+    __spans = []
+    __listeners = []
+    __local = threading.local()
+
+    @staticmethod
+    def enable(output_file):
+        """
+        Record spans and store them in output_file with export
+        :param output_file: Path of the trace, .json for Chrome trace format, JSON lines otherwise
+        :type output_file: str
+        """
+        Tracer.__enabled = True
+        Tracer.__output_file = output_file
+        Tracer.__origin = time.perf_counter()
+        Tracer.__spans = []
+
+    @staticmethod
+    def is_enabled():
+        return Tracer.__enabled
+
+    @staticmethod
+    def add_listener(listener):
+        """
+        Call listener(span) whenever a span is closed
+        :param listener: Function taking the closed span
+        :type listener: callable
+        """
+        Tracer.__listeners.append(listener)
+
+    @staticmethod
+    def remove_listener(listener):
+        """
+        Stop calling a listener registered with add_listener
+        :param listener: Function passed to add_listener
+        :type listener: callable
+        """
+        if listener in Tracer.__listeners:
+            Tracer.__listeners.remove(listener)
+
+    @staticmethod
+    def start_span(name, **attributes):
+        """
+        Open a span as child of the innermost open span of the current thread
+        :param name: Span type, e.g. 'decode' or 'infer[mtg_jamendo_genre-discogs-effnet-1]'
+        :type name: str
+        :param attributes: Attributes of the span
+        :return: span, None if tracing is disabled
+        """
+        if not Tracer.__enabled and not Tracer.__listeners:
+            return None
+        stack = Tracer.__stack()
+        span = {
+            'id': len(Tracer.__spans) if Tracer.__enabled else None,
+            'parent': stack[-1]['id'] if stack else None,
+            'name': name,
+            'thread': threading.get_ident(),
+            'start': time.perf_counter() - Tracer.__origin,
+            'duration': None,
+            'attributes': attributes,
+        }
+        if Tracer.__enabled:
+            Tracer.__spans.append(span)
+        stack.append(span)
+        return span
+
+    @staticmethod
+    def end_span(span, **attributes):
+        """
+        Close a span opened with start_span, together with all spans opened within it and not closed yet
+        :param span: Span returned by start_span, may be None
+        :type span: dict | None
+        :param attributes: Attributes added to the span
+        """
+        if span is None or span['duration'] is not None:
+            return
+        span['attributes'].update(attributes)
+        end = time.perf_counter() - Tracer.__origin
+        stack = Tracer.__stack()
+        while stack:
+            open_span = stack.pop()
+            open_span['duration'] = end - open_span['start']
+            for listener in Tracer.__listeners:
+                listener(open_span)
+            if open_span is span:
+                break
+
+    @staticmethod
+    @contextmanager
+    def span(name, **attributes):
+        """
+        Context manager around start_span and end_span, yields the span (None if tracing is disabled)
+        """
+        span = Tracer.start_span(name, **attributes)
+        try:
+            yield span
+        finally:
+            Tracer.end_span(span)
+
+    @staticmethod
+    def set_attributes(**attributes):
+        """
+        Add attributes to the innermost open span of the current thread, e.g. the audio length once it was decoded
+        """
+        if Tracer.__enabled or Tracer.__listeners:
+            stack = Tracer.__stack()
+            if stack:
+                stack[-1]['attributes'].update(attributes)
+
+    @staticmethod
+    def export():
+        """
+        Store all closed spans in the output file given to enable
+        """
+        if not Tracer.__enabled:
+            return
+        spans = [span for span in Tracer.__spans if span['duration'] is not None]
+        FileHandler.create_folders_if_not_exists(Tracer.__output_file)
+        with open(Tracer.__output_file, 'w') as f:
+            if Tracer.__output_file.endswith(".json"):
+                pid = os.getpid()
+                events = [{
+                    'name': span['name'],
+                    'cat': span['name'].split("[")[0],
+                    'ph': "X",
+                    'ts': span['start'] * 1e6,
+                    'dur': span['duration'] * 1e6,
+                    'pid': pid,
+                    'tid': span['thread'],
+                    'args': span['attributes'],
+                } for span in spans]
+                f.write(json.dumps({'traceEvents': events, 'displayTimeUnit': "ms"}, default=str))
+            else:
+                for span in spans:
+                    f.write(json.dumps(span, default=str) + "\n")
+
+    @staticmethod
+    def summary():
+        """
+        Count, total and percentiles of the duration per span type
+        :return: Dictionary with span names as keys
+        """
+        durations = {}
+        for span in Tracer.__spans:
+            if span['duration'] is not None:
+                durations.setdefault(span['name'], []).append(span['duration'])
+        summary = {}
+        for name, values in durations.items():
+            percentiles = np.percentile(values, SUMMARY_PERCENTILES)
+            summary[name] = {'count': len(values), 'total': float(np.sum(values))}
+            summary[name].update({f"p{p}": float(v) for p, v in zip(SUMMARY_PERCENTILES, percentiles)})
+        return summary
+
+    @staticmethod
+    def print_summary():
+        """
+        Print the summary of all span types, sorted by total time
+        """
+        if not Tracer.__enabled:
+            return
+        IOHandler.print_text_line(text="TRACE SUMMARY", color=Color.GREEN, enforce=True)
+        IOHandler.print_color(
+            f"{'span':<48} {'count':>7} {'total [s]':>10} {'p50 [s]':>9} {'p95 [s]':>9} {'p99 [s]':>9}",
+            color=Color.GREEN, enforce=True)
+        for name, values in sorted(Tracer.summary().items(), key=lambda item: -item[1]['total']):
+            IOHandler.print_color(
+                f"{name:<48} {values['count']:>7} {values['total']:>10.3f} {values['p50']:>9.4f} "
+                f"{values['p95']:>9.4f} {values['p99']:>9.4f}",
+                color=Color.GREEN, enforce=True)
+        IOHandler.print_color(f"Trace written to {Tracer.__output_file}", color=Color.GREEN, enforce=True)
+        IOHandler.print_text_line(color=Color.GREEN, enforce=True)
+
+    @staticmethod
+    def finish():
+        """
+        Close all open spans, export them and print the summary
+        """
+        if not Tracer.__enabled:
+            return
+        stack = Tracer.__stack()
+        if stack:
+            Tracer.end_span(stack[0])
+        Tracer.export()
+        Tracer.print_summary()
+
+    @staticmethod
+    def __stack():
+        if not hasattr(Tracer.__local, 'stack'):
+            Tracer.__local.stack = []
+        return Tracer.__local.stack
@@ -36,6 +36,30 @@ class UI:
         )
         IOHandler.print_title_line(color=Color.BLUE)
 
+    @staticmethod
+    def resume_information(journal_file, num_journaled):
+        IOHandler.print_color(
+            message=f"Resuming from {journal_file}: skipping {num_journaled} songs already done or unchanged",
+            color=Color.BLUE,
+            enforce=True
+        )
+
+    @staticmethod
+    def unchanged_files_information(num_unchanged):
+        IOHandler.print_color(
+            message=f"Skipped {num_unchanged} media files whose fingerprint did not change",
+            color=Color.BLUE,
+            enforce=True
+        )
+
+    @staticmethod
+    def reused_features_information(num_reused):
+        IOHandler.print_color(
+            message=f"Reused the features of an identical recording for {num_reused} media files",
+            color=Color.BLUE,
+            enforce=True
+        )
+
     @staticmethod
     def overall_information(db_totals, db_num_media, overall_time, num_counter, duration_counter):
         # Print info for overall execution time
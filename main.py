@@ -2,81 +2,196 @@
 #  All rights reserved.
 #
 #  Usage:
-#  python main.py -i <input folder> -o <output folder>
+#  python main.py -i <input folder> -o <output folder> [--profile-startup]
 
+import os
 import sys
-from essentia_handlers.tagger import Tagger
+import time
+
+import_start = time.perf_counter()
 from database.db_agent import DBAgent
 from models.models import Model
 from helpers.timer import Timer
 from helpers.file_handler import FileHandler
 from helpers.io_handler import IOHandler
 from helpers.ui import UI
-from helpers.logger import ExtractionLogger
+from helpers.logger import ExtractionLogger, ExtractionJournal, JOURNAL_COMPLETED_STATUSES
 from helpers.errors import UnknownTaggerException
-
-
-# Read presets from config file
-settings = FileHandler.read_config_file()
-MEDIA_PATH_ROOT = settings['defaults']['media_path_root']
-OUTPUT_FOLDER = settings['defaults']['output_folder']
-DATABASE = settings['database']['name']
+from helpers.change_detector import ChangeDetector
+from essentia_handlers.audio_fingerprint import AudioFingerprintIndex
+from helpers.startup_profile import StartupProfile
+from helpers.tracing import Tracer
+from helpers.metrics import Metrics
+from helpers.progress import Progress
+IMPORT_SECONDS = time.perf_counter() - import_start
 
 # Additional parameters
 FILE_LIMIT = None
 
-# Get tagger instance according to tagger type specified in config file
-try:
-    tagger = Tagger.get_instance(settings['tagger'])
-except KeyError as error:
-    IOHandler.show_error(f"Key not found in config file: {error}")
-    sys.exit()
-except UnknownTaggerException as error:
-    IOHandler.show_error(error)
-    sys.exit()
+
+def create_tagger(tagger_type):
+    # Get tagger instance according to tagger type specified in config file
+    from essentia_handlers.tagger import Tagger
+    try:
+        return Tagger.get_instance(tagger_type)
+    except UnknownTaggerException as error:
+        IOHandler.show_error(error)
+        sys.exit()
 
 
 # ----------------------------------
 # MAIN
 # ----------------------------------
 def main(argv):
+    # Read presets from config file
+    config_start = time.perf_counter()
+    settings = FileHandler.read_config_file()
+    try:
+        media_path_root = settings['defaults']['media_path_root']
+        output_folder = settings['defaults']['output_folder']
+        database = settings['database']['name']
+        tagger_type = settings['tagger']
+        manifest_settings = settings['media_manifest']
+        change_settings = settings['change_detection']
+        deduplication_settings = settings['deduplication']
+        metrics_settings = settings['metrics']
+        journal_settings = settings['journal']
+        progress_settings = settings['progress']
+    except KeyError as error:
+        IOHandler.show_error(f"Key not found in config file: {error}")
+        sys.exit()
+    config_seconds = time.perf_counter() - config_start
 
-    input_folder, output_folder, limit, skip = IOHandler.read_and_confirm_main_arguments(
-        argv, MEDIA_PATH_ROOT, OUTPUT_FOLDER, FILE_LIMIT)
+    input_folder, output_folder, limit, skip, resume_file = IOHandler.read_and_confirm_main_arguments(
+        argv, media_path_root, output_folder, FILE_LIMIT)
+    StartupProfile.record("module imports", IMPORT_SECONDS)
+    StartupProfile.record("config", config_seconds)
 
     program_timer = Timer()
     UI.start_line()
 
+    # Build the tagger only after the arguments were parsed
+    with StartupProfile.measure("tagger"):
+        tagger = create_tagger(tagger_type)
+
     # Connect to database
-    db_agent = DBAgent(DATABASE)
-    db_agent.open_connection()
+    with StartupProfile.measure("database"):
+        db_agent = DBAgent(database)
+        db_agent.open_connection()
 
-    # Get summary information from database for statistical information
-    db_num_media = db_agent.count_entries_in_table_media()
-    db_totals = db_agent.calculate_summary_values()
+        # Get summary information from database for statistical information
+        db_num_media = db_agent.count_entries_in_table_media()
+        db_totals = db_agent.calculate_summary_values()
 
     # Print database and metadata information
     UI.metadata_information(db_num_media, db_totals)
 
-    # Create list of all media files on disk and sort it
-    media_file_list = FileHandler.create_file_list_from(input_folder, limit=limit)
+    # Create list of all media files on disk and sort it, skip and limit select a window of the sorted list
+    with StartupProfile.measure("media file list"):
+        manifest_file = None
+        if manifest_settings['enabled']:
+            manifest_file = os.path.join(output_folder, manifest_settings['filename'])
+        media_file_list = FileHandler.create_file_list_from(
+            input_folder, limit=limit, skip=skip, manifest_file=manifest_file, workers=manifest_settings['workers'])
 
     # Prepare ML models
-    Model.init()
+    with StartupProfile.measure("models (incl. essentia and TensorFlow)"):
+        Model.init()
+
+    # Fetch the stored fingerprints of the whole archive at once, files that did not change are skipped
+    change_detector = None
+    if change_settings['enabled'] and tagger.db_model_names and \
+            not db_agent.check_if_feature_column_exists('fingerprint'):
+        IOHandler.show_error("Change detection disabled: the feature table has no fingerprint column, add it with "
+                             "ALTER TABLE feature ADD COLUMN fingerprint jsonb;")
+    elif change_settings['enabled'] and tagger.db_model_names:
+        with StartupProfile.measure("change detection"):
+            change_detector = ChangeDetector(
+                stored_fingerprints=db_agent.fetch_feature_fingerprints(),
+                model_names=[Model.get_model(name).display_name for name in tagger.db_model_names],
+                hash_bytes=change_settings['partial_hash_bytes']
+            )
+    StartupProfile.report()
+
+    # Serve metrics for dashboards during long runs
+    if metrics_settings['enabled']:
+        Metrics.enable(
+            http_port=metrics_settings['http_port'],
+            textfile=metrics_settings['textfile'],
+            textfile_interval=metrics_settings['textfile_interval']
+        )
 
     num_counter = 0
+    num_unchanged = 0
+    num_reused = 0
     duration_counter = 0.0
-    iteration_counter = 0
+    iteration_counter = skip
 
-    # Prepare Logger
+    # Prepare Logger and journal, a resumed run skips the songs its journal records as done or unchanged
     logger = ExtractionLogger(output_folder)
     tagger.attach_logger(logger)
+    journaled_songs = set()
+    if resume_file is not None:
+        _, songs = ExtractionJournal.read(resume_file)
+        journaled_songs = {media_path for media_path, record in songs.items()
+                           if record['status'] in JOURNAL_COMPLETED_STATUSES}
+        UI.resume_information(resume_file, len(journaled_songs))
+    journal = ExtractionJournal(
+        journal_file=resume_file or ExtractionJournal.journal_file_for(output_folder),
+        run_info={
+            'input_folder': input_folder,
+            'output_folder': output_folder,
+            'skip': skip,
+            'limit': limit,
+            'tagger': tagger_type,
+        },
+        fsync_interval=journal_settings['fsync_interval']
+    )
+    logger.attach_journal(journal)
+
+    # Live progress with an ETA from the remaining audio duration of the songs that are extracted, unchanged files are
+    # recognised by their size and mtime without hashing them
+    progress = None
+    if progress_settings['enabled']:
+        progress = Progress(
+            media_paths=[rel_media_path for (abs_media_path, rel_media_path, _) in media_file_list
+                         if rel_media_path not in journaled_songs and
+                         (change_detector is None or not change_detector.is_unchanged(rel_media_path, abs_media_path))],
+            durations=db_agent.fetch_media_durations(),
+            window=progress_settings['window'],
+            interval=progress_settings['interval']
+        )
+
+    # Reuse the features of identical recordings under other media paths
+    if deduplication_settings['enabled'] and tagger.db_model_names:
+        tagger.attach_fingerprint_index(AudioFingerprintIndex(
+            index_file=os.path.join(output_folder, deduplication_settings['filename']),
+            seconds=deduplication_settings['seconds'],
+            min_similarity=deduplication_settings['min_similarity'],
+            duration_tolerance=deduplication_settings['duration_tolerance']
+        ))
 
     for (abs_media_path, rel_media_path, rel_output_prefix) in media_file_list:
-        # Skip iteration if skip value was provided
+        Metrics.set_queue_depth("songs", len(media_file_list) - (iteration_counter - skip))
+        Metrics.update()
         iteration_counter += 1
-        if iteration_counter <= skip:
+        if rel_media_path in journaled_songs:
             continue
+        journal.start_song()
+        fingerprint = None
+        replace_features = False
+        if change_detector is not None:
+            status, fingerprint, media_id = change_detector.classify(rel_media_path, abs_media_path)
+            if status == ChangeDetector.TOUCHED:
+                db_agent.update_fingerprint_for(fingerprint, media_id)
+            if status in (ChangeDetector.TOUCHED, ChangeDetector.UNCHANGED):
+                num_unchanged += 1
+                Metrics.count_song("unchanged")
+                journal.record(media_path=rel_media_path, status="unchanged", index=iteration_counter)
+                if progress is not None:
+                    progress.skip(rel_media_path)
+                continue
+            replace_features = status == ChangeDetector.CHANGED
         # Prepare log
         logger.reset_values()
         logger.set_value("index", iteration_counter)
@@ -87,29 +202,53 @@ def main(argv):
             logger.set_media_id_from_media_data(song_media_data)
             # Process one song
             song_timer = Timer()
+            song_span = Tracer.start_span("song", media_id=song_media_data['media_id'], media_path=rel_media_path)
             tagger.init(
                 media_file_path=abs_media_path,
                 media_data=song_media_data,
                 output_folder=output_folder,
-                db_agent=db_agent
+                db_agent=db_agent,
+                fingerprint=fingerprint,
+                replace_features=replace_features
             )
             num_counter += 1
-            tagger.process_song(counter=iteration_counter)
+            reused = tagger.reuse_features_of_identical_recording()
+            if reused:
+                num_reused += 1
+            else:
+                tagger.process_song(counter=iteration_counter)
+            tagger.register_audio_fingerprint()
             duration_counter += tagger.get_media_duration_secs()
+            Tracer.end_span(song_span, audio_seconds=tagger.get_media_duration_secs(), reused=reused)
             UI.song_process_time(song_timer.get_seconds())
             UI.spacer()
         else:
             error_message = UI.db_metadata_not_found_error(rel_media_path)
             logger.add_error(error_message)
+            Metrics.count_song("missing_metadata")
+            if progress is not None:
+                progress.skip(rel_media_path)
         # Write to logfile
         logger.commit_entry()
 
-    # Close database connections
+    # Close database connections and journal
     db_agent.close_connection()
+    journal.close()
+    if progress is not None:
+        progress.print_progress(force=True)
+        progress.close()
+    Metrics.set_queue_depth("songs", 0)
+    Metrics.update(force=True)
+
+    if change_detector is not None:
+        UI.unchanged_files_information(num_unchanged)
+    if num_reused > 0:
+        UI.reused_features_information(num_reused)
 
     # Print info for overall execution time
     overall_time = program_timer.get_seconds()
     UI.overall_information(db_totals, db_num_media, overall_time, num_counter, duration_counter)
+    Tracer.finish()
 
     UI.end_line()
 
@@ -49,14 +49,17 @@ def main(argv):
         IOHandler.show_error(f"ERROR: Input folder does not exist: {input_folder}")
         sys.exit()
 
-    # Create command template
-    command_template = f"python main.py -i '{input_folder}' -o '{output_folder}' " + "-s {} -l {}"
+    # Create command template, the windows read the manifest refreshed below instead of scanning the volume again
+    command_template = f"python main.py -i '{input_folder}' -o '{output_folder}' --cached-manifest " + "-s {} -l {}"
 
     # Floor first to 1
     first = max(first, 1)
 
     # Ceil last to the actual number of files in the input_folder
-    media_file_list = FileHandler.create_file_list_from(input_folder)
+    settings = FileHandler.read_config_file()['media_manifest']
+    manifest_file = os.path.join(output_folder, settings['filename']) if settings['enabled'] else None
+    media_file_list = FileHandler.create_file_list_from(
+        input_folder, manifest_file=manifest_file, workers=settings['workers'])
     files_count = len(media_file_list)
     if last > 0:
         last = min(last, files_count)
@@ -3,9 +3,13 @@
 
 import json
 import os.path
-import essentia.standard as es
 from helpers.timer import Timer
 from helpers.io_handler import IOHandler
+from helpers.lazy_import import LazyImport
+from helpers.tracing import Tracer
+
+# Loaded on first use: essentia pulls in TensorFlow
+es = LazyImport("essentia.standard")
 
 model_data_folder = os.path.dirname(__file__) + "/model_data/"
 
@@ -91,7 +95,8 @@ class Model:
             input=self.input,
             output=self.output_embedding
         )
-        return embedding_model(audio)
+        with Tracer.span(f"embed[{self.shortname}]", media_id=media.media_id):
+            return embedding_model(audio)
 
     @staticmethod
     def init():
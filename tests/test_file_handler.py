@@ -0,0 +1,19 @@
+#  Copyright (c) 2024. Jonas Zellweger, University of Zurich (jonas.zellweger@uzh.ch)
+#  All rights reserved.
+
+import os
+from helpers.file_handler import FileHandler
+
+
+def test_file_list_keeps_dangling_symlink(tmp_path):
+    media_folder = tmp_path / "media"
+    media_folder.mkdir()
+    (media_folder / "1.mp4").write_bytes(b"video")
+    os.symlink(media_folder / "missing.mp4", media_folder / "2.mp4")
+    manifest_file = str(tmp_path / "media_manifest.json")
+
+    file_list = FileHandler.create_file_list_from(str(media_folder), manifest_file=manifest_file)
+
+    assert [rel_media_path for _, rel_media_path, _ in file_list] == ["1.mp4", "2.mp4"]
+    manifest = FileHandler.read_media_manifest(manifest_file, str(media_folder))
+    assert manifest['files'][1][1:3] == [None, None]